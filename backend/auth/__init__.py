@@ -1,6 +1,6 @@
 from .google import verify_google_token
 from .jwt import create_access_token, create_refresh_token, verify_token, TokenData
-from .middleware import get_current_user
+from .middleware import authenticate, get_current_user
 
 __all__ = [
     "verify_google_token",
@@ -8,5 +8,6 @@ __all__ = [
     "create_refresh_token",
     "verify_token",
     "TokenData",
+    "authenticate",
     "get_current_user",
 ]
@@ -1,8 +1,21 @@
-from google.oauth2 import id_token
-from google.auth.transport import requests
+import asyncio
+import base64
+import json
+import re
+import time
+from typing import Awaitable, Callable
+
 from pydantic import BaseModel
 from config import get_settings
 
+# Google's ID token signing certs (PEM, keyed by key id)
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Don't refetch more often than this when a token names an unknown key id
+_MIN_REFRESH_INTERVAL = 60.0
+_DEFAULT_MAX_AGE = 3600.0
+
 
 class GoogleUser(BaseModel):
     email: str
@@ -15,43 +28,105 @@ class GoogleVerificationError(Exception):
     pass
 
 
-def verify_google_token(token: str) -> GoogleUser:
+CertFetcher = Callable[[str], Awaitable[tuple[dict[str, str], float]]]
+
+
+def _max_age(cache_control: str | None) -> float:
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return float(match.group(1)) if match else _DEFAULT_MAX_AGE
+
+
+async def _fetch_certs(url: str) -> tuple[dict[str, str], float]:
+    """Fetch certs over HTTP. Returns (certs, max_age_seconds)."""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        resp = await client.get(url)
+        resp.raise_for_status()
+        return resp.json(), _max_age(resp.headers.get("cache-control"))
+
+
+class GoogleCertCache:
+    """Google's signing certs, cached for their Cache-Control lifetime.
+
+    ``fetch`` can be replaced to serve a locally generated key set offline.
+    """
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL, fetch: CertFetcher = _fetch_certs):
+        self.url = url
+        self._fetch = fetch
+        self._certs: dict[str, str] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, kid: str | None = None) -> dict[str, str]:
+        """Return current certs, refetching if expired or if ``kid`` is unknown (key rotation)."""
+        if not self._needs_refresh(kid):
+            return self._certs
+        async with self._lock:
+            # Another caller may have refreshed while we waited
+            if self._needs_refresh(kid):
+                certs, max_age = await self._fetch(self.url)
+                now = time.time()
+                self._certs = certs
+                self._fetched_at = now
+                self._expires_at = now + max_age
+        return self._certs
+
+    def _needs_refresh(self, kid: str | None) -> bool:
+        now = time.time()
+        if now >= self._expires_at:
+            return True
+        unknown_kid = kid is not None and kid not in self._certs
+        return unknown_kid and now - self._fetched_at >= _MIN_REFRESH_INTERVAL
+
+
+_cert_cache = GoogleCertCache()
+
+
+def _key_id(token: str) -> str | None:
+    try:
+        header = token.split(".", 1)[0]
+        return json.loads(base64.urlsafe_b64decode(header + "=" * (-len(header) % 4))).get("kid")
+    except (ValueError, AttributeError):
+        return None
+
+
+async def verify_google_token(token: str, cert_cache: GoogleCertCache | None = None) -> GoogleUser:
     """
     Verify a Google ID token and extract user information.
 
     This verifies:
-    - Token signature (using Google's public keys)
+    - Token signature (using Google's public keys, cached per Cache-Control)
     - Token expiry
     - Token audience (matches one of our client IDs - iOS or Web)
     - Token issuer (accounts.google.com)
     """
+    from google.auth import jwt as google_jwt
+
     settings = get_settings()
+    cert_cache = cert_cache or _cert_cache
+
+    try:
+        certs = await cert_cache.get(_key_id(token))
+    except Exception as e:
+        raise GoogleVerificationError(f"Could not fetch Google certs: {e}")
+
+    try:
+        # One decode checks the audience against every client ID
+        idinfo = google_jwt.decode(token, certs=certs, audience=settings.google_client_ids)
+    except ValueError as e:
+        raise GoogleVerificationError(f"Invalid token: {str(e)}")
+
+    # Verify issuer
+    if idinfo.get("iss") not in GOOGLE_ISSUERS:
+        raise GoogleVerificationError("Invalid token issuer")
 
-    # Try each client ID (iOS and Web use different client IDs)
-    last_error = None
-    for client_id in settings.google_client_ids:
-        try:
-            # Verify the token with Google's API
-            idinfo = id_token.verify_oauth2_token(
-                token,
-                requests.Request(),
-                client_id
-            )
-
-            # Verify issuer
-            if idinfo["iss"] not in ["accounts.google.com", "https://accounts.google.com"]:
-                raise GoogleVerificationError("Invalid token issuer")
-
-            # Extract user info
-            return GoogleUser(
-                email=idinfo["email"],
-                name=idinfo.get("name"),
-                picture=idinfo.get("picture"),
-                google_id=idinfo["sub"]
-            )
-
-        except ValueError as e:
-            last_error = e
-            continue
-
-    raise GoogleVerificationError(f"Invalid token: {str(last_error)}")
+    # Extract user info
+    return GoogleUser(
+        email=idinfo["email"],
+        name=idinfo.get("name"),
+        picture=idinfo.get("picture"),
+        google_id=idinfo["sub"]
+    )
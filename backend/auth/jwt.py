@@ -8,6 +8,7 @@ class TokenData(BaseModel):
     user_id: str
     email: str
     token_type: str = "access"
+    exp: int | None = None  # Expiry as a unix timestamp
 
 
 class TokenPair(BaseModel):
@@ -84,7 +85,12 @@ def verify_token(token: str, expected_type: str = "access") -> TokenData | None:
         if user_id is None or email is None:
             return None
 
-        return TokenData(user_id=user_id, email=email, token_type=expected_type)
+        return TokenData(
+            user_id=user_id,
+            email=email,
+            token_type=expected_type,
+            exp=payload.get("exp"),
+        )
 
     except JWTError:
         return None
@@ -1,4 +1,7 @@
+import hashlib
 import os
+import time
+from collections import OrderedDict
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from .jwt import verify_token, TokenData
@@ -9,6 +12,44 @@ bearer_scheme = HTTPBearer(auto_error=False)
 # Dev mode bypass - only enable when DEV_MODE=1
 DEV_MODE = os.environ.get("DEV_MODE", "0") == "1"
 
+# Verified access tokens keyed by SHA-256 digest, least recently used first.
+# Clients reuse one access token for its whole lifetime, so this skips the
+# full JWT decode on nearly every request. Entries expire at the token's exp.
+TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "4096"))
+_token_cache: OrderedDict[bytes, TokenData] = OrderedDict()
+
+
+def _verify_access_token(token: str) -> TokenData | None:
+    """verify_token for access tokens, memoized until each token's expiry."""
+    if TOKEN_CACHE_SIZE <= 0:
+        return verify_token(token)
+
+    key = hashlib.sha256(token.encode()).digest()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        if cached.exp > time.time():
+            _token_cache.move_to_end(key)
+            return cached
+        del _token_cache[key]
+
+    token_data = verify_token(token)
+    if token_data is not None and token_data.exp is not None:
+        _token_cache[key] = token_data
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return token_data
+
+
+def authenticate(token: str) -> TokenData | None:
+    """Validate a bearer access token (accepting dev tokens in DEV_MODE)."""
+    if DEV_MODE and token.startswith("dev_access_token_"):
+        return TokenData(
+            user_id="dev_user",
+            email="dev@example.com",
+            exp=None
+        )
+    return _verify_access_token(token)
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials | None = Depends(bearer_scheme)
@@ -28,15 +69,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Dev mode bypass - accept fake dev tokens
-    if DEV_MODE and credentials.credentials.startswith("dev_access_token_"):
-        return TokenData(
-            user_id="dev_user",
-            email="dev@example.com",
-            exp=None
-        )
-
-    token_data = verify_token(credentials.credentials)
+    token_data = authenticate(credentials.credentials)
 
     if token_data is None:
         raise HTTPException(
@@ -59,4 +92,4 @@ async def get_current_user_optional(
     if credentials is None:
         return None
 
-    return verify_token(credentials.credentials)
+    return _verify_access_token(credentials.credentials)
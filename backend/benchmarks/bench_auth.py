@@ -0,0 +1,81 @@
+"""Microbenchmark: per-request bearer auth cost with and without the token cache.
+
+Runs from the backend directory:
+
+    python -m benchmarks.bench_auth --requests 20000 --concurrency 100
+
+Measures the get_current_user dependency directly and a full request to
+/api/session through the ASGI app, both under concurrent load.
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi.security import HTTPAuthorizationCredentials
+
+from auth import middleware
+from auth.jwt import create_access_token
+
+
+async def _run(concurrency: int, total: int, call) -> float:
+    """Run ``total`` calls across ``concurrency`` workers. Returns seconds elapsed."""
+    per_worker = total // concurrency
+
+    async def worker():
+        for _ in range(per_worker):
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def bench_dependency(token: str, concurrency: int, total: int) -> float:
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    async def call():
+        await middleware.get_current_user(credentials)
+
+    return await _run(concurrency, total, call)
+
+
+async def bench_request(token: str, concurrency: int, total: int) -> float:
+    from main import app
+
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def call():
+            resp = await client.get("/api/session", headers=headers)
+            assert resp.status_code == 200
+
+        return await _run(concurrency, total, call)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    token = create_access_token("bench-user", "bench@example.com")
+    cache_size = middleware.TOKEN_CACHE_SIZE or 4096
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}")
+    print(f"{'mode':<12}{'cache':<8}{'total s':>10}{'us/req':>10}")
+    for name, bench, total in [
+        ("dependency", bench_dependency, args.requests),
+        ("request", bench_request, args.requests // 10),
+    ]:
+        for size in (0, cache_size):
+            middleware.TOKEN_CACHE_SIZE = size
+            middleware._token_cache.clear()
+            elapsed = await bench(token, args.concurrency, total)
+            label = "on" if size else "off"
+            print(f"{name:<12}{label:<8}{elapsed:>10.3f}{elapsed / total * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
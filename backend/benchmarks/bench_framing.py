@@ -0,0 +1,216 @@
+"""Bytes on the wire and CPU of the controller <-> sandbox encodings.
+
+Runs from the backend directory:
+
+    python -m benchmarks.bench_framing
+    python -m benchmarks.bench_framing --turns 50 --tools 8 --no-offload
+
+Builds tool-heavy turns the way sandbox_server emits them: streamed text
+deltas, then Read-style tool calls whose results are this repository's own
+source files (offloaded to blob references above the inline limit, as
+blobs.py does, unless --no-offload), then the final ``done`` event repeating
+the tool events with timings and usage. Each turn is encoded with
+sandbox_server's own encoders (server-sent JSON events, and frames for each
+framing codec) and decoded the way sandbox_manager does, fed in network-sized
+chunks.
+
+Prints one JSON document with, per codec, the bytes per turn and the encode
+and decode CPU time per turn, for both the streaming and blocking (/chat)
+responses.
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import blobs  # noqa: E402
+import framing  # noqa: E402
+import sandbox_server  # noqa: E402
+
+
+def _sources() -> list[tuple[str, str]]:
+    paths = sorted(BACKEND_DIR.glob("*.py")) + sorted(BACKEND_DIR.glob("*/*.py"))
+    return [(str(p.relative_to(BACKEND_DIR)), p.read_text()) for p in paths]
+
+
+def _tool_result(tool_use_id: str, content: str, offload: bool) -> dict[str, object]:
+    event = {"type": "tool_result", "tool_use_id": tool_use_id, "content": content, "is_error": None}
+    data, ext = blobs.encode(content)
+    if not offload or len(data) <= blobs.INLINE_MAX:
+        return event
+    blob_id = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+    return {
+        **event,
+        "content": blobs.preview(content),
+        "truncated": True,
+        "blob": {"id": blob_id, "size": len(data), "media_type": blobs.MEDIA_TYPES[ext]},
+    }
+
+
+def make_turn(rng: random.Random, sources: list[tuple[str, str]], tools: int, tokens: int,
+              offload: bool) -> list[dict[str, object]]:
+    """One turn's events, in the order sandbox_server streams them."""
+    prose = rng.choice(sources)[1]
+    start = rng.randrange(max(len(prose) - tokens * 4, 1))
+    text = prose[start:start + tokens * 4]
+    events: list[dict[str, object]] = [
+        {"type": "text", "text": text[i:i + 4]} for i in range(0, len(text), 4)
+    ]
+    tool_events = []
+    for i in range(tools):
+        path, content = rng.choice(sources)
+        tool_use_id = f"toolu_{rng.getrandbits(96):024x}"
+        tool_events.append({
+            "type": "tool_use", "name": "Read", "input": {"file_path": f"/workspace/{path}"},
+            "tool_use_id": tool_use_id,
+        })
+        tool_events.append(_tool_result(tool_use_id, content, offload))
+    events.extend(tool_events)
+    events.append({
+        "type": "done",
+        "content": text,
+        "session_id": f"{rng.getrandbits(128):032x}",
+        "tool_events": tool_events,
+        "timings": [
+            {"stage": stage, "start_ms": round(rng.uniform(0, 50), 3), "ms": round(rng.uniform(0, 900), 3)}
+            for stage in ["lock_wait", "query", "first_message"] + ["tool"] * tools
+        ],
+        "usage": {
+            "peak_rss_mb": 180.5, "cpu_seconds": 3.2, "busy_seconds": 12.0, "turns": 4,
+            "tool_calls": 9, "oom_kills": 0, "uptime_seconds": 120.0,
+        },
+    })
+    return events
+
+
+def _parse_sse(body: bytes, chunk: int) -> list[dict[str, object]]:
+    """sandbox_manager._iter_sse over a body arriving ``chunk`` bytes at a time."""
+    events, data_lines, pending = [], [], ""
+    for i in range(0, len(body), chunk):
+        pending += body[i:i + chunk].decode()
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+            elif not line and data_lines:
+                events.append(json.loads("\n".join(data_lines)))
+                data_lines = []
+    if data_lines:
+        events.append(json.loads("\n".join(data_lines)))
+    return events
+
+
+def _parse_frames(body: bytes, chunk: int) -> list[dict[str, object]]:
+    decoder = framing.Decoder()
+    events = []
+    for i in range(0, len(body), chunk):
+        events.extend(decoder.feed(body[i:i + chunk]))
+    decoder.close()
+    return events
+
+
+def _cpu(fn, repeat: int) -> float:
+    """CPU microseconds of the fastest of ``repeat`` calls of ``fn``, like timeit."""
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.process_time()
+            fn()
+            best = min(best, time.process_time() - started)
+    finally:
+        gc.enable()
+    return best * 1e6
+
+
+def measure(codec: str, turns: list[list[dict[str, object]]], chunk: int, repeat: int) -> dict:
+    if codec == "json":
+        def encode_stream(events):
+            return b"".join(sandbox_server._sse(e) for e in events)
+
+        def encode_blocking(done):
+            return json.dumps(done).encode()
+
+        def decode_stream(body):
+            return _parse_sse(body, chunk)
+
+        def decode_blocking(body):
+            return json.loads(body)
+    else:
+        def encode_stream(events):
+            encoder = sandbox_server._FrameEncoder(codec)
+            return b"".join(encoder.encode(e) for e in events)
+
+        def encode_blocking(done):
+            return sandbox_server._FrameEncoder(codec).encode(done)
+
+        def decode_stream(body):
+            return _parse_frames(body, chunk)
+
+        def decode_blocking(body):
+            return framing.decode(body)[0]
+
+    results = {}
+    for mode, encode, decode, payloads in (
+        ("stream", encode_stream, decode_stream, turns),
+        ("blocking", encode_blocking, decode_blocking, [events[-1] for events in turns]),
+    ):
+        bodies = [encode(p) for p in payloads]
+        # Round trip must be lossless, or the numbers mean nothing
+        for payload, body in zip(payloads, bodies):
+            decoded = decode(body)
+            assert decoded == payload, f"{codec} {mode} round trip changed the events"
+        results[mode] = {
+            "bytes_per_turn": round(sum(map(len, bodies)) / len(bodies)),
+            "encode_us_per_turn": round(_cpu(lambda: [encode(p) for p in payloads], repeat) / len(payloads), 1),
+            "decode_us_per_turn": round(_cpu(lambda: [decode(b) for b in bodies], repeat) / len(bodies), 1),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--tools", type=int, default=5, help="Tool calls per turn")
+    parser.add_argument("--tokens", type=int, default=150, help="Text deltas per turn")
+    parser.add_argument("--no-offload", action="store_true",
+                        help="Keep every tool result inline, as before blob offloading")
+    parser.add_argument("--chunk", type=int, default=16384, help="Bytes per network read when decoding")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if framing.msgpack is None:
+        sys.exit("msgpack is not installed")
+    codecs = ["json"] + list(reversed(framing.supported() or ["msgpack"]))
+
+    rng = random.Random(args.seed)
+    sources = _sources()
+    turns = [
+        make_turn(rng, sources, args.tools, args.tokens, not args.no_offload)
+        for _ in range(args.turns)
+    ]
+    results = {codec: measure(codec, turns, args.chunk, args.repeat) for codec in codecs}
+    for mode in ("stream", "blocking"):
+        baseline = results["json"][mode]["bytes_per_turn"]
+        for codec in codecs:
+            results[codec][mode]["bytes_vs_json"] = round(results[codec][mode]["bytes_per_turn"] / baseline, 3)
+    print(json.dumps({
+        "turns": args.turns,
+        "tools_per_turn": args.tools,
+        "tokens_per_turn": args.tokens,
+        "offload": not args.no_offload,
+        "codecs": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
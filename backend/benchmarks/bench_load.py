@@ -0,0 +1,352 @@
+"""Load and latency benchmark for the chat endpoints, backed by a fake Claude client.
+
+Runs from the backend directory:
+
+    python -m benchmarks.bench_load --mode both --users 20 --concurrency 20 --requests 400
+    python -m benchmarks.bench_load --endpoint /api/chat --mix short:3,tools:1 --output results.json
+
+Serves the FastAPI app with uvicorn on a local port in this process and
+drives it over real HTTP, so streaming latencies are real. In
+``local`` mode turns go through sessions.py with FakeClaudeSDKClient; in
+``sandbox`` mode they go through sandbox_manager with LocalProcessBackend,
+so every user gets a real sandbox_server.py subprocess (running the fake
+client) and requests cross a real HTTP hop. ``both`` runs each mode in a
+fresh interpreter, since the backend is chosen at import time.
+
+Prints one JSON document with latency percentiles (total and, for streaming
+endpoints, time to first event), throughput, status counts, and peak memory
+and process counts of the controller and its child processes.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.fake_claude import FakeConfig
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+ENDPOINTS = ("/chat", "/chat/stream", "/api/chat", "/api/chat/stream")
+
+# Named message shapes for --mix; key=value words are read by the fake client
+MESSAGE_KINDS = {
+    "short": "tokens=20",
+    "long": "tokens=300",
+    "tools": "tokens=40 tools=2",
+    "heavy": "tokens=150 tools=5 tool_result_bytes=20000",
+}
+
+
+def _parse_mix(mix: str) -> list[tuple[str, int]]:
+    kinds = []
+    for part in mix.split(","):
+        name, _, weight = part.partition(":")
+        if name not in MESSAGE_KINDS:
+            raise SystemExit(f"Unknown message kind {name!r}; choose from {sorted(MESSAGE_KINDS)}")
+        kinds.append((name, int(weight or 1)))
+    return kinds
+
+
+def _percentiles(samples: list[float]) -> dict[str, float | None]:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "p50": pct(50) * 1000,
+        "p95": pct(95) * 1000,
+        "p99": pct(99) * 1000,
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "max": ordered[-1] * 1000,
+    }
+
+
+def _process_tree() -> tuple[int, float]:
+    """(descendant process count, their total RSS in MB), Linux only."""
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return 0, 0.0
+    children: dict[int, list[int]] = {}
+    rss_pages: dict[int, int] = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+            ppid, rss = int(fields[1]), int(fields[21])
+        except (OSError, ValueError, IndexError):
+            continue
+        pid = int(entry.name)
+        children.setdefault(ppid, []).append(pid)
+        rss_pages[pid] = rss
+    count, pages = 0, 0
+    stack = list(children.get(os.getpid(), []))
+    while stack:
+        pid = stack.pop()
+        count += 1
+        pages += rss_pages.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return count, pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _self_rss_mb() -> float:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class _ResourceSampler:
+    """Samples controller and child process memory in the background, keeping peaks."""
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self.peak_children = 0
+        self.peak_children_rss_mb = 0.0
+        self._task: asyncio.Task | None = None
+
+    def sample(self):
+        count, rss = _process_tree()
+        self.peak_rss_mb = max(self.peak_rss_mb, _self_rss_mb())
+        self.peak_children = max(self.peak_children, count)
+        self.peak_children_rss_mb = max(self.peak_children_rss_mb, rss)
+
+    async def _run(self):
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.sample()
+
+    def report(self) -> dict[str, float]:
+        return {
+            "controller_peak_rss_mb": round(self.peak_rss_mb, 1),
+            "controller_maxrss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "children_peak": self.peak_children,
+            "children_peak_rss_mb": round(self.peak_children_rss_mb, 1),
+        }
+
+
+def _configure(mode: str, workdir: Path, fake: FakeConfig):
+    """Set environment for ``mode`` before the app is imported."""
+    os.environ.pop("MODAL_ENVIRONMENT", None)
+    os.environ["MONIOS_DB_PATH"] = str(workdir / "bench.db")
+    os.environ.update(fake.to_env())
+    if mode == "sandbox":
+        os.environ["SANDBOX_BACKEND"] = "local"
+    else:
+        os.environ.pop("SANDBOX_BACKEND", None)
+
+
+async def _one_request(
+    client: httpx.AsyncClient, endpoint: str, user_id: str, message: str, headers: dict[str, str]
+) -> tuple[str, float, float | None]:
+    """Send one chat request. Returns (outcome, total_seconds, first_event_seconds)."""
+    if endpoint.startswith("/api/"):
+        body = {"content": message}
+    else:
+        body = {"message": message, "user_id": user_id}
+
+    start = time.perf_counter()
+    if not endpoint.endswith("/stream"):
+        resp = await client.post(endpoint, json=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        if resp.status_code != 200:
+            return str(resp.status_code), elapsed, None
+        content = resp.json().get("content", "")
+        return ("error" if content.startswith("Error:") else "ok"), elapsed, None
+
+    first = None
+    outcome = "incomplete"
+    async with client.stream("POST", endpoint, json=body, headers=headers) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            return str(resp.status_code), time.perf_counter() - start, None
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            if first is None:
+                first = time.perf_counter() - start
+            event_type = json.loads(line[5:]).get("type")
+            if event_type == "done":
+                outcome = "ok"
+            elif event_type == "error":
+                outcome = "error"
+    return outcome, time.perf_counter() - start, first
+
+
+async def run_mode(args: argparse.Namespace, mode: str) -> dict[str, object]:
+    fake = FakeConfig.from_env()
+    with tempfile.TemporaryDirectory(prefix="monios-bench-") as tmp:
+        workdir = Path(tmp)
+        _configure(mode, workdir, fake)
+
+        import uvicorn
+
+        import chat_backend
+        from auth.jwt import create_access_token
+        from benchmarks import fake_claude
+        from main import app
+
+        if mode == "sandbox":
+            import sandbox_manager
+            from sandbox_backends import LocalProcessBackend
+
+            sandbox_manager.set_backend(LocalProcessBackend(
+                root=workdir / "sandboxes",
+                server_command=(sys.executable, str(Path(__file__).parent / "fake_sandbox_server.py")),
+                env={"ANTHROPIC_API_KEY": "fake", "PYTHONUNBUFFERED": "1"},
+            ))
+            sandbox_manager.set_pool_target(args.pool_size)
+        else:
+            fake_claude.install()
+
+        kinds = _parse_mix(args.mix)
+        names = [name for name, weight in kinds for _ in range(weight)]
+        users = [f"bench-user-{i}" for i in range(args.users)]
+        tokens = {u: create_access_token(u, f"{u}@example.com") for u in users}
+        rng = random.Random(args.seed)
+        work: asyncio.Queue = asyncio.Queue()
+        for i in range(args.requests):
+            kind = rng.choice(names)
+            work.put_nowait((users[i % len(users)], kind, f"{MESSAGE_KINDS[kind]} bench message {i}"))
+
+        latencies: list[float] = []
+        first_events: list[float] = []
+        outcomes: dict[str, int] = {}
+        per_kind: dict[str, list[float]] = {name: [] for name, _ in kinds}
+
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        serving = asyncio.create_task(server.serve())  # Runs the app's startup/shutdown hooks
+        while not server.started:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.05)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        sampler = _ResourceSampler()
+        try:
+            async with httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits
+            ) as client:
+                async def worker():
+                    while not work.empty():
+                        user_id, kind, message = work.get_nowait()
+                        headers = {}
+                        if args.endpoint.startswith("/api/"):
+                            headers["Authorization"] = f"Bearer {tokens[user_id]}"
+                        try:
+                            outcome, elapsed, first = await _one_request(
+                                client, args.endpoint, user_id, message, headers
+                            )
+                        except httpx.HTTPError as e:
+                            outcome, elapsed, first = type(e).__name__, 0.0, None
+                        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                        if outcome == "ok":
+                            latencies.append(elapsed)
+                            per_kind[kind].append(elapsed)
+                            if first is not None:
+                                first_events.append(first)
+
+                with sampler:
+                    start = time.perf_counter()
+                    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+                    wall = time.perf_counter() - start
+                backend_stats = chat_backend.stats()
+        finally:
+            server.should_exit = True
+            await serving
+
+    return {
+        "mode": mode,
+        "endpoint": args.endpoint,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "mix": dict(kinds),
+        "fake_claude": fake.__dict__,
+        "wall_seconds": round(wall, 3),
+        "rps": round(outcomes.get("ok", 0) / wall, 2) if wall else None,
+        "outcomes": outcomes,
+        "latency_ms": _percentiles(latencies),
+        "first_event_ms": _percentiles(first_events) if first_events else None,
+        "latency_ms_by_kind": {kind: _percentiles(s) for kind, s in per_kind.items()},
+        "resources": sampler.report(),
+        "backend": backend_stats,
+    }
+
+
+def _run_in_subprocess(argv: list[str], mode: str) -> dict[str, object]:
+    """Run one mode in a fresh interpreter and return its JSON result."""
+    cmd = [sys.executable, "-m", "benchmarks.bench_load", *argv, "--mode", mode, "--output", "-"]
+    out = subprocess.run(cmd, cwd=BACKEND_DIR, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("local", "sandbox", "both"), default="local")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="/chat/stream")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--mix", default="short:3,long:1,tools:1",
+                        help=f"Weighted message kinds, e.g. short:3,tools:1 ({', '.join(MESSAGE_KINDS)})")
+    parser.add_argument("--pool-size", type=int, default=2, help="Warm pool size in sandbox mode")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write JSON here ('-' for stdout only)")
+    args = parser.parse_args()
+
+    if args.mode == "both":
+        argv = [a for a in sys.argv[1:]]
+        # Drop --mode/--output and their values; each child gets its own
+        for flag in ("--mode", "--output"):
+            while flag in argv:
+                i = argv.index(flag)
+                del argv[i:i + 2]
+        result: object = [_run_in_subprocess(argv, mode) for mode in ("local", "sandbox")]
+    else:
+        # App logging goes to stderr so stdout stays machine-readable
+        with contextlib.redirect_stdout(sys.stderr):
+            result = asyncio.run(run_mode(args, args.mode))
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output and args.output != "-":
+        Path(args.output).write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
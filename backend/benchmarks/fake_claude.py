@@ -0,0 +1,145 @@
+"""A stand-in for ClaudeSDKClient that streams canned responses with tunable delays.
+
+It emits the same message types the real client does (SystemMessage,
+StreamEvent text deltas, AssistantMessage with TextBlock/ToolUseBlock,
+UserMessage with ToolResultBlock and a final ResultMessage), so sessions.py
+and sandbox_server.py run their real parsing code against it.
+
+Defaults come from FAKE_CLAUDE_* environment variables so a sandbox server
+subprocess picks up the same settings as the benchmark that started it. A
+prompt may override them per message with ``key=value`` words, e.g.
+``"tokens=200 tools=2 hello"``.
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, fields
+from typing import AsyncIterator
+
+from claude_agent_sdk import (
+    AssistantMessage,
+    ResultMessage,
+    StreamEvent,
+    SystemMessage,
+    TextBlock,
+    ToolResultBlock,
+    ToolUseBlock,
+    UserMessage,
+)
+
+MODEL = "fake-claude"
+
+
+@dataclass
+class FakeConfig:
+    connect_delay: float = 0.2  # Seconds to "start the CLI"
+    first_token_delay: float = 0.3  # Seconds before the first text delta
+    token_delay: float = 0.01  # Seconds between text deltas
+    tokens: int = 50  # Text deltas per response
+    tools: int = 0  # Tool calls before the final text
+    tool_delay: float = 0.1  # Seconds each tool call takes
+    tool_result_bytes: int = 200  # Size of each tool result
+
+    @classmethod
+    def from_env(cls) -> "FakeConfig":
+        config = cls()
+        for f in fields(cls):
+            value = os.environ.get(f"FAKE_CLAUDE_{f.name.upper()}")
+            if value is not None:
+                setattr(config, f.name, f.type(value))
+        return config
+
+    def with_overrides(self, prompt: str) -> "FakeConfig":
+        """Copy with ``key=value`` words in the prompt applied."""
+        values = asdict(self)
+        for word in prompt.split():
+            key, sep, value = word.partition("=")
+            if sep and key in values:
+                values[key] = type(values[key])(value)
+        return FakeConfig(**values)
+
+    def to_env(self) -> dict[str, str]:
+        return {f"FAKE_CLAUDE_{k.upper()}": str(v) for k, v in asdict(self).items()}
+
+
+class FakeClaudeSDKClient:
+    """Drop-in for ClaudeSDKClient: connect/query/receive_response/interrupt/disconnect."""
+
+    def __init__(self, options=None, config: FakeConfig | None = None):
+        self.options = options
+        self.config = config or FakeConfig.from_env()
+        resume = getattr(options, "resume", None)
+        self.session_id = resume or str(uuid.uuid4())
+        self._prompt: str | None = None
+        self._interrupted = False
+
+    async def connect(self, prompt=None):
+        await asyncio.sleep(self.config.connect_delay)
+
+    async def disconnect(self):
+        pass
+
+    async def interrupt(self):
+        self._interrupted = True
+
+    async def query(self, prompt: str, session_id: str = "default"):
+        self._prompt = prompt
+        self._interrupted = False
+
+    def _stream_event(self, event: dict[str, object]) -> StreamEvent:
+        return StreamEvent(uuid=str(uuid.uuid4()), session_id=self.session_id, event=event)
+
+    async def receive_response(self) -> AsyncIterator[object]:
+        config = self.config.with_overrides(self._prompt or "")
+        start = time.monotonic()
+        yield SystemMessage(subtype="init", data={"session_id": self.session_id})
+
+        for i in range(config.tools):
+            tool_id = f"toolu_{uuid.uuid4().hex[:12]}"
+            yield AssistantMessage(
+                content=[ToolUseBlock(id=tool_id, name="Bash", input={"command": f"echo {i}"})],
+                model=MODEL,
+            )
+            await asyncio.sleep(config.tool_delay)
+            if self._interrupted:
+                break
+            yield UserMessage(content=[ToolResultBlock(
+                tool_use_id=tool_id, content="x" * config.tool_result_bytes, is_error=False,
+            )])
+
+        await asyncio.sleep(config.first_token_delay)
+        words = []
+        for i in range(config.tokens):
+            if self._interrupted:
+                break
+            if i:
+                await asyncio.sleep(config.token_delay)
+            word = f"word{i} "
+            words.append(word)
+            yield self._stream_event({
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": word},
+            })
+
+        yield AssistantMessage(content=[TextBlock(text="".join(words))], model=MODEL)
+        yield ResultMessage(
+            subtype="success",
+            duration_ms=int((time.monotonic() - start) * 1000),
+            duration_api_ms=0,
+            is_error=False,
+            num_turns=1,
+            session_id=self.session_id,
+        )
+
+
+def install():
+    """Replace ClaudeSDKClient in sessions (and sandbox_server, if imported)."""
+    import sys
+
+    for name in ("sessions", "sandbox_server"):
+        module = sys.modules.get(name)
+        if module is not None:
+            module.ClaudeSDKClient = FakeClaudeSDKClient
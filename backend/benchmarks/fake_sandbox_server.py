@@ -0,0 +1,20 @@
+"""Run sandbox_server.py with FakeClaudeSDKClient in place of the real client.
+
+Used as the LocalProcessBackend server command by bench_load's sandbox mode.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "fake")
+
+import sandbox_server  # noqa: E402
+from benchmarks import fake_claude  # noqa: E402
+
+if __name__ == "__main__":
+    fake_claude.install()
+    sandbox_server.main()
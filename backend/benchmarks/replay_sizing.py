@@ -0,0 +1,65 @@
+"""Replay recorded sandbox usage through sizing policies.
+
+Runs from the backend directory, on controller logs (or any file containing
+the ``sandbox_usage`` JSON lines sandbox_manager prints):
+
+    python -m benchmarks.replay_sizing controller.log
+    python -m benchmarks.replay_sizing usage.jsonl --memory-headroom 1.25 --window 5
+
+Compares the headroom policy with the given settings against a fixed size
+for everyone (the old ``cpu=1.0, memory=512``, or ``--fixed-tier``), and
+prints one JSON document with each policy's under-sized rate, tier counts
+and allocated memory/CPU hours.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from sandbox_sizing import (  # noqa: E402
+    TIERS, FixedPolicy, HeadroomPolicy, SandboxSize, load_samples, replay,
+)
+
+LEGACY_SIZE = SandboxSize("legacy", 1.0, 512)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Log or JSONL files with sandbox_usage lines ('-' for stdin)")
+    parser.add_argument("--memory-headroom", type=float, default=1.5)
+    parser.add_argument("--cpu-headroom", type=float, default=1.25)
+    parser.add_argument("--window", type=int, default=10, help="Recent samples per user to consider")
+    parser.add_argument("--fixed-tier", choices=[t.name for t in TIERS], default=None,
+                        help="Baseline tier (default: the legacy 1 CPU / 512 MB)")
+    args = parser.parse_args()
+
+    lines: list[str] = []
+    for path in args.paths:
+        lines.extend(sys.stdin if path == "-" else Path(path).read_text().splitlines())
+    samples = load_samples(lines)
+    if not samples:
+        sys.exit("No sandbox_usage lines found")
+
+    baseline = next((t for t in TIERS if t.name == args.fixed_tier), LEGACY_SIZE)
+    policy = HeadroomPolicy(
+        memory_headroom=args.memory_headroom,
+        cpu_headroom=args.cpu_headroom,
+        window=args.window,
+    )
+    print(json.dumps({
+        "fixed": {"size": baseline.name, **replay(FixedPolicy(baseline), samples)},
+        "headroom": {
+            "memory_headroom": args.memory_headroom,
+            "cpu_headroom": args.cpu_headroom,
+            "window": args.window,
+            **replay(policy, samples),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
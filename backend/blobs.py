@@ -0,0 +1,227 @@
+"""Content-addressed store for large tool results.
+
+A tool result can be megabytes (a file read, a command's output), and it
+used to travel inline through every hop: the sandbox's JSON, the
+controller's, the client's and the chat history. ``offload`` stores the
+content of a ``tool_result`` event above ``INLINE_MAX`` bytes once, named by
+its SHA-256, and replaces it with a short preview plus a reference::
+
+    {"type": "tool_result", "content": "<first PREVIEW_CHARS chars>",
+     "truncated": true,
+     "blob": {"id": "<sha256>.txt", "size": 4194304, "media_type": "text/plain"}}
+
+Clients fetch the full content (or a byte range of it) from
+/api/blobs/{id} (/chat/blobs/{id} for the web UI). String content is stored
+as UTF-8 text, anything else as JSON.
+
+Blobs are kept per user, so one user can't probe for another's content by
+its hash. In sandbox mode sandbox_server offloads into the user's workspace
+and the controller pulls a blob into this store the first time it's fetched
+(from a running sandbox only).
+
+Clearing a user's history deletes their blobs (``delete_user``). Otherwise
+``prune`` runs hourly and deletes blobs not written for MAX_AGE, then the
+oldest until the store fits in MAX_BYTES. A pruned blob's preview stays in
+the history; fetching the rest then returns 404.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+BLOB_DIR = Path(os.environ.get("MONIOS_BLOB_DIR", Path(__file__).parent / ".monios-blobs"))
+
+# Tool results larger than this (encoded) are offloaded
+INLINE_MAX = int(os.environ.get("TOOL_RESULT_INLINE_MAX", "16384"))
+PREVIEW_CHARS = 2048
+
+MAX_AGE = float(os.environ.get("TOOL_RESULT_BLOB_MAX_AGE", str(7 * 24 * 3600)))
+MAX_BYTES = int(os.environ.get("TOOL_RESULT_BLOB_MAX_BYTES", str(1024**3)))
+PRUNE_INTERVAL = 3600.0
+
+_pruner_task: asyncio.Task | None = None
+
+_BLOB_ID = re.compile(r"^([0-9a-f]{64})\.(txt|json)$")
+MEDIA_TYPES = {"txt": "text/plain", "json": "application/json"}
+
+
+def valid_id(blob_id: str) -> bool:
+    return _BLOB_ID.match(blob_id) is not None
+
+
+def media_type(blob_id: str) -> str:
+    return MEDIA_TYPES[blob_id.rpartition(".")[2]]
+
+
+def _user_dir(user_id: str) -> Path:
+    # Hashed so any user id is a safe directory name
+    return BLOB_DIR / hashlib.sha256(user_id.encode()).hexdigest()[:32]
+
+
+def path(user_id: str, blob_id: str) -> Path:
+    """Where ``blob_id`` lives for ``user_id``. Raises ValueError for a malformed id."""
+    if not valid_id(blob_id):
+        raise ValueError(f"Invalid blob id: {blob_id!r}")
+    return _user_dir(user_id) / blob_id[:2] / blob_id
+
+
+def encode(content: object) -> tuple[bytes, str]:
+    """Encode tool result content as stored: (data, extension)."""
+    if isinstance(content, str):
+        return content.encode(), "txt"
+    return json.dumps(content).encode(), "json"
+
+
+def preview(content: object) -> str:
+    """The first PREVIEW_CHARS characters of the content's text."""
+    if isinstance(content, list):
+        content = "\n".join(
+            block.get("text", "") for block in content
+            if isinstance(block, dict) and block.get("type") == "text"
+        )
+    elif not isinstance(content, str):
+        content = json.dumps(content)
+    return content[:PREVIEW_CHARS]
+
+
+def put(user_id: str, data: bytes, ext: str) -> str:
+    """Store ``data`` for the user if it isn't stored already. Returns its blob id."""
+    blob_id = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+    target = path(user_id, blob_id)
+    if target.exists():
+        # Offloaded again, so it's recent as far as pruning goes
+        os.utime(target)
+        return blob_id
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so a reader never sees a partial blob
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return blob_id
+
+
+def put_verified(user_id: str, blob_id: str, data: bytes) -> bool:
+    """Store ``data`` fetched from elsewhere, if it really is ``blob_id``."""
+    match = _BLOB_ID.match(blob_id)
+    if match is None or hashlib.sha256(data).hexdigest() != match.group(1):
+        return False
+    put(user_id, data, match.group(2))
+    return True
+
+
+def read(user_id: str, blob_id: str, start: int = 0, end: int | None = None) -> bytes:
+    """Bytes ``start`` through ``end`` (inclusive) of a blob; to the end if ``end`` is None."""
+    with open(path(user_id, blob_id), "rb") as f:
+        f.seek(start)
+        return f.read(-1 if end is None else end - start + 1)
+
+
+def delete_user(user_id: str):
+    """Delete all of a user's blobs."""
+    shutil.rmtree(_user_dir(user_id), ignore_errors=True)
+
+
+def prune(root: Path = BLOB_DIR, max_age: float = MAX_AGE, max_bytes: int = MAX_BYTES) -> int:
+    """Delete blobs under ``root`` older than ``max_age`` seconds, then the oldest
+    until the rest fit in ``max_bytes``. Returns how many were deleted."""
+    files = []
+    for file in root.rglob("*"):
+        try:
+            if file.is_file():
+                stat = file.stat()
+                files.append((stat.st_mtime, stat.st_size, file))
+        except OSError:
+            continue  # Deleted meanwhile
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    cutoff = time.time() - max_age
+    deleted = 0
+    for mtime, size, file in files:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        file.unlink(missing_ok=True)
+        total -= size
+        deleted += 1
+    return deleted
+
+
+async def _prune_forever():
+    while True:
+        try:
+            deleted = await asyncio.to_thread(prune)
+            if deleted:
+                print(f"[blobs] Pruned {deleted} blob(s)")
+        except Exception as e:
+            print(f"[blobs] Pruning failed: {e}")
+        await asyncio.sleep(PRUNE_INTERVAL)
+
+
+def start_pruner() -> asyncio.Task:
+    """Start pruning the store in the background, now and every PRUNE_INTERVAL."""
+    global _pruner_task
+    if _pruner_task is None or _pruner_task.done():
+        _pruner_task = asyncio.create_task(_prune_forever())
+    return _pruner_task
+
+
+def stop_pruner():
+    if _pruner_task is not None:
+        _pruner_task.cancel()
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """The (start, end) of a single ``bytes=`` Range header, inclusive.
+
+    None means serve the whole blob: no header, or one this doesn't handle
+    (multiple ranges), which HTTP lets a server ignore. Raises ValueError if
+    the range can't be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[6:].strip().partition("-")
+    if not sep or not (first or last):
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise ValueError(f"Range {header!r} not satisfiable for {size} bytes")
+    return start, end
+
+
+async def offload(user_id: str, event: dict[str, object]) -> dict[str, object]:
+    """Replace a large ``tool_result`` event's content with a preview and a blob reference."""
+    if event.get("type") != "tool_result" or "blob" in event:
+        return event
+    content = event.get("content")
+    if content is None:
+        return event
+    data, ext = encode(content)
+    if len(data) <= INLINE_MAX:
+        return event
+    blob_id = await asyncio.to_thread(put, user_id, data, ext)
+    return {
+        **event,
+        "content": preview(content),
+        "truncated": True,
+        "blob": {"id": blob_id, "size": len(data), "media_type": MEDIA_TYPES[ext]},
+    }
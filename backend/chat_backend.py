@@ -0,0 +1,265 @@
+"""Chat backend shared by the web and iOS routes.
+
+Uses per-user Modal sandboxes when running on Modal, per-user local sandbox
+processes with SANDBOX_BACKEND=local, and local Claude SDK sessions
+otherwise. Turns for the same user are serialized through
+turn_queue, so a double-send from two clients never interleaves.
+"""
+
+import asyncio
+import json
+import os
+import time
+import weakref
+from contextlib import aclosing
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+import blobs
+import metrics
+import tracing
+import turn_queue
+from turn_queue import QueueFullError
+
+T = TypeVar("T")
+
+# Use sandbox_manager on Modal (or with a local sandbox backend), sessions otherwise
+IS_MODAL = os.environ.get("MODAL_ENVIRONMENT") is not None
+USE_SANDBOXES = IS_MODAL or os.environ.get("SANDBOX_BACKEND") is not None
+
+if USE_SANDBOXES:
+    import sandbox_manager
+
+    if not IS_MODAL and not sandbox_manager.init_from_env():
+        raise RuntimeError(f"Unknown SANDBOX_BACKEND: {os.environ['SANDBOX_BACKEND']!r}")
+
+    async def _get_response(message: str, user_id: str, session_id: str | None = None):
+        return await sandbox_manager.send_message(user_id, message)
+
+    def _stream_response(
+        message: str, user_id: str, session_id: str | None = None
+    ) -> AsyncIterator[dict[str, object]]:
+        return sandbox_manager.stream_message(user_id, message)
+
+    async def clear_session(user_id: str):
+        return await sandbox_manager.clear_session(user_id)
+
+    async def _fetch_blob(user_id: str, blob_id: str) -> bytes | None:
+        return await sandbox_manager.fetch_blob(user_id, blob_id)
+
+    async def _delete_remote_blobs(user_id: str):
+        await sandbox_manager.delete_blobs(user_id)
+
+    async def startup():
+        sandbox_manager.refill_pool()
+        sandbox_manager.start_supervisor()
+        blobs.start_pruner()
+
+    async def shutdown():
+        blobs.stop_pruner()
+        # Modal sandboxes outlive the controller until their idle timeout; local ones don't
+        await sandbox_manager.shutdown(terminate_all=not IS_MODAL)
+
+    def _backend_stats() -> dict[str, object]:
+        return {
+            "sandbox_pool": sandbox_manager.pool_stats(),
+            "sandboxes": sandbox_manager.sandbox_stats(),
+        }
+
+    metrics.Gauge(
+        "monios_active_sandboxes", "Sandboxes attached to a user.",
+        lambda: sandbox_manager.sandbox_stats()["active"],
+    )
+    metrics.Gauge(
+        "monios_pooled_sandboxes", "Booted sandboxes waiting in the warm pool.",
+        lambda: sandbox_manager.pool_stats()["size"],
+    )
+else:
+    import sessions
+    from sessions import get_response as _get_response
+    from sessions import stream_response as _stream_response
+    from sessions import clear_session
+
+    async def _fetch_blob(user_id: str, blob_id: str) -> bytes | None:
+        # Local sessions offload straight into the blob store
+        return None
+
+    async def _delete_remote_blobs(user_id: str):
+        pass
+
+    async def startup():
+        sessions.start_reaper()
+        blobs.start_pruner()
+
+    async def shutdown():
+        blobs.stop_pruner()
+        await sessions.close_all()
+
+    def _backend_stats() -> dict[str, object]:
+        return {"session_cache": sessions.cache_stats()}
+
+    metrics.Gauge(
+        "monios_local_clients", "Connected local Claude SDK clients.",
+        lambda: sessions.cache_stats()["clients"],
+    )
+
+metrics.Gauge(
+    "monios_queued_turns", "Turns running or waiting in per-user queues.",
+    lambda: turn_queue.stats()["queued_turns"],
+)
+
+
+def stats() -> dict[str, object]:
+    return {**_backend_stats(), "turn_queue": turn_queue.stats()}
+
+
+async def get_response(
+    message: str,
+    user_id: str,
+    session_id: str | None = None,
+    on_turn: Callable[[str, tuple[str, str | None, list[dict[str, object]]]], None] | None = None,
+) -> tuple[str, str | None, list[dict[str, object]]]:
+    """Run a turn for the user once earlier turns finish. Raises QueueFullError if backed up.
+
+    ``on_turn(message, result)`` is called once per turn that actually ran.
+    With turn_queue.COALESCE, several callers share one turn: only the caller
+    whose turn ran gets the call, with everyone's messages joined.
+    """
+    trace = tracing.current()
+    queued_at = time.perf_counter()
+
+    async def timed(m: str):
+        if trace is not None:
+            trace.record("queue_wait", queued_at)
+        try:
+            with metrics.TURN.time("blocking"), tracing.span("turn"):
+                result = await _get_response(m, user_id, session_id)
+        except Exception:
+            metrics.ERRORS.inc("turn")
+            raise
+        if on_turn is not None:
+            on_turn(m, result)
+        return result
+
+    return await turn_queue.run(user_id, message, timed)
+
+
+def stream_response(
+    message: str, user_id: str, session_id: str | None = None
+) -> AsyncIterator[dict[str, object]]:
+    """Stream a turn for the user once earlier turns finish.
+
+    Raises QueueFullError immediately (before any event is sent) if backed up.
+    """
+    reservation = turn_queue.reserve(user_id)
+
+    async def events():
+        trace = tracing.current()
+        queued_at = time.perf_counter()
+        async with turn_queue.turn(user_id, reservation):
+            started = time.perf_counter()
+            if trace is not None:
+                trace.record("queue_wait", queued_at, started)
+            first = True
+            try:
+                async with aclosing(_stream_response(message, user_id, session_id)) as turn:
+                    async for event in turn:
+                        if first:
+                            metrics.TURN_FIRST_EVENT.observe(time.perf_counter() - started)
+                            first = False
+                        yield event
+            except Exception:
+                metrics.ERRORS.inc("turn")
+                raise
+            except (asyncio.CancelledError, GeneratorExit):
+                metrics.CANCELLED_TURNS.inc("stream")
+                raise
+            finally:
+                metrics.TURN.observe(time.perf_counter() - started, "stream")
+                if trace is not None:
+                    trace.record("turn", started)
+
+    stream = events()
+    # A stream dropped before its first event never enters the turn; give its place back
+    weakref.finalize(stream, reservation.release)
+    return stream
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before its turn finished."""
+
+
+async def unless_disconnected(receive: Any, turn: Awaitable[T]) -> T:
+    """Await ``turn``, cancelling it if the ASGI ``receive`` reports a disconnect first.
+
+    Call only after the request body has been read, so ``receive`` has nothing
+    left to deliver but ``http.disconnect``. Raises ClientDisconnected.
+    """
+    task = asyncio.ensure_future(turn)
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.create_task(disconnected())
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if task not in done:
+        task.cancel()
+        await asyncio.wait({task})  # Let the turn unwind and start its interrupt
+        metrics.CANCELLED_TURNS.inc("blocking")
+        raise ClientDisconnected("Client disconnected before the turn finished")
+    return task.result()
+
+
+async def reset_after_error(user_id: str):
+    """Clear a user's session after a failed turn so the next one starts clean."""
+    metrics.FORCED_CLEARS.inc()
+    await clear_session(user_id)
+
+
+async def local_blob(user_id: str, blob_id: str) -> Path | None:
+    """Path of one of the user's tool result blobs, or None if there's no such blob.
+
+    A blob the sandbox offloaded is pulled into the local store on first
+    fetch, if the user's sandbox is running.
+    """
+    if not blobs.valid_id(blob_id):
+        return None
+    path = blobs.path(user_id, blob_id)
+    if path.exists():
+        return path
+    try:
+        data = await _fetch_blob(user_id, blob_id)
+    except Exception as e:
+        metrics.ERRORS.inc("blob_fetch")
+        print(f"[chat_backend] Fetching blob {blob_id} for {user_id} failed: {e}")
+        return None
+    if data is None or not await asyncio.to_thread(blobs.put_verified, user_id, blob_id, data):
+        return None
+    return path
+
+
+async def delete_blobs(user_id: str):
+    """Delete the user's tool result blobs, with their history."""
+    await asyncio.to_thread(blobs.delete_user, user_id)
+    try:
+        await _delete_remote_blobs(user_id)
+    except Exception as e:
+        print(f"[chat_backend] Deleting sandbox blobs for {user_id} failed: {e}")
+
+
+def sse_event(event: dict[str, object]) -> str:
+    """Encode an event as a server-sent event frame."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Disable proxy buffering so deltas flush immediately
+}
@@ -0,0 +1,135 @@
+"""Compact binary framing for the controller <-> sandbox protocol.
+
+By default a sandbox answers /chat with one JSON document and /chat/stream
+with server-sent events, each one a JSON document on a text line. Framing
+replaces both with a stream of length-prefixed msgpack frames, optionally
+zstd-compressed, which the controller parses as bytes arrive.
+
+Each frame is a 4-byte big-endian header and a payload. The header's low 31
+bits are the payload length, and its top bit is set if the payload is
+zstd-compressed. The payload is one msgpack-encoded event. With zstd, only
+frames of at least COMPRESS_MIN bytes (tool events, the final ``done``) are
+compressed; text deltas are too small to gain anything.
+
+Negotiation: the controller sends HEADER listing the codecs it can decode,
+best first ("msgpack+zstd", "msgpack"). A sandbox that can encode one of them
+answers with Content-Type MEDIA_TYPE and names its choice in HEADER. Anyone
+else (an older sandbox, a missing library, SANDBOX_FRAMING=json on the
+controller) gets JSON as before. Only successful responses are framed;
+errors stay JSON.
+
+sandbox_server.py is shipped on its own, so it has its own copy of the
+encoder; keep the two in step.
+"""
+
+import os
+import struct
+from typing import AsyncIterator
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MEDIA_TYPE = "application/vnd.monios.frames"
+HEADER = "X-Monios-Framing"
+CODECS = ("msgpack+zstd", "msgpack")
+
+COMPRESS_MIN = 512
+COMPRESS_LEVEL = 3
+
+_FRAME_HEADER = struct.Struct(">I")
+_COMPRESSED = 0x80000000
+_LENGTH = 0x7FFFFFFF
+
+
+def supported() -> list[str]:
+    """Codecs this process can use, best first; empty if framing is off or unavailable."""
+    if os.environ.get("SANDBOX_FRAMING", "auto") == "json" or msgpack is None:
+        return []
+    return [c for c in CODECS if c == "msgpack" or zstandard is not None]
+
+
+def request_headers() -> dict[str, str]:
+    """Headers offering framing to a sandbox."""
+    codecs = supported()
+    return {HEADER: ", ".join(codecs)} if codecs else {}
+
+
+def is_framed(headers) -> bool:
+    """Whether a response (by its headers) is framed rather than JSON."""
+    return headers.get("content-type", "").startswith(MEDIA_TYPE)
+
+
+class Encoder:
+    def __init__(self, codec: str = "msgpack"):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown framing codec: {codec!r}")
+        self.codec = codec
+        self._compressor = (
+            zstandard.ZstdCompressor(level=COMPRESS_LEVEL) if codec == "msgpack+zstd" else None
+        )
+
+    def encode(self, event: dict[str, object]) -> bytes:
+        payload = msgpack.packb(event)
+        flag = 0
+        if self._compressor is not None and len(payload) >= COMPRESS_MIN:
+            compressed = self._compressor.compress(payload)
+            if len(compressed) < len(payload):
+                payload, flag = compressed, _COMPRESSED
+        return _FRAME_HEADER.pack(len(payload) | flag) + payload
+
+
+class Decoder:
+    """Incremental decoder: feed it bytes as they arrive, get back whole events."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def feed(self, data: bytes) -> list[dict[str, object]]:
+        self._buffer += data
+        events = []
+        offset = 0
+        while len(self._buffer) - offset >= _FRAME_HEADER.size:
+            (header,) = _FRAME_HEADER.unpack_from(self._buffer, offset)
+            start = offset + _FRAME_HEADER.size
+            end = start + (header & _LENGTH)
+            if len(self._buffer) < end:
+                break
+            payload = bytes(self._buffer[start:end])
+            if header & _COMPRESSED:
+                if self._decompressor is None:
+                    raise ValueError("Received a zstd frame but zstandard isn't installed")
+                payload = self._decompressor.decompress(payload)
+            events.append(msgpack.unpackb(payload))
+            offset = end
+        del self._buffer[:offset]
+        return events
+
+    def close(self):
+        """Check the stream ended on a frame boundary."""
+        if self._buffer:
+            raise ValueError(f"Stream ended inside a frame ({len(self._buffer)} bytes left)")
+
+
+def decode(data: bytes) -> list[dict[str, object]]:
+    """All events in a complete framed body."""
+    decoder = Decoder()
+    events = decoder.feed(data)
+    decoder.close()
+    return events
+
+
+async def iter_frames(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict[str, object]]:
+    """Events from a framed body as its chunks arrive."""
+    decoder = Decoder()
+    async for chunk in chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    decoder.close()
@@ -0,0 +1,188 @@
+"""Idempotency-Key support for chat requests.
+
+A retried request carrying the same key as an earlier one never starts a
+second turn. While the original is still running, the retry attaches to it:
+it waits for the same result or, for streams, replays the events sent so far
+and then follows the live ones. Once the original finishes, its result or
+events are served from a cache bounded by IDEMPOTENCY_MAX_ENTRIES and
+IDEMPOTENCY_TTL seconds.
+
+The turn runs in its own task, so it keeps going if the original client
+goes away. That is what lets a retry after a timeout pick it up. Failed turns
+are not cached, so a retry after an error runs the turn again.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+TTL = float(os.environ.get("IDEMPOTENCY_TTL", "600"))
+MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "1024"))
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyMismatch(Exception):
+    """Raised when a key is reused with a different request."""
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    task: Optional[asyncio.Task] = None
+    finished_at: Optional[float] = None
+    # Streams only: every item produced so far, and an event set on each new one
+    events: list = field(default_factory=list)
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+# (scope, key) -> entry, oldest first
+_entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+_stats: dict[str, int] = {"started": 0, "joined": 0, "replayed": 0}
+
+
+def _fingerprint(kind: str, request: str) -> str:
+    return hashlib.sha256(f"{kind}\0{request}".encode()).hexdigest()
+
+
+def _prune(now: float):
+    """Drop expired entries, then the oldest finished ones until under MAX_ENTRIES."""
+    for k, entry in list(_entries.items()):
+        if entry.finished_at is not None and now - entry.finished_at > TTL:
+            del _entries[k]
+    if len(_entries) > MAX_ENTRIES:
+        for k, entry in list(_entries.items()):
+            if len(_entries) <= MAX_ENTRIES:
+                break
+            if entry.finished_at is not None:
+                del _entries[k]
+
+
+def _lookup(scope: str, key: str, fingerprint: str) -> Optional[_Entry]:
+    entry = _entries.get((scope, key))
+    if entry is None:
+        return None
+    if entry.finished_at is not None and time.monotonic() - entry.finished_at > TTL:
+        del _entries[(scope, key)]
+        return None
+    if entry.fingerprint != fingerprint:
+        raise IdempotencyKeyMismatch("Idempotency-Key was already used for a different request")
+    return entry
+
+
+def _store(scope: str, key: str, entry: _Entry):
+    _prune(time.monotonic())
+    _entries[(scope, key)] = entry
+    _stats["started"] += 1
+
+
+def _finished(scope: str, key: str, entry: _Entry, task: asyncio.Task):
+    if entry.finished_at is None:
+        entry.finished_at = time.monotonic()
+    failed = task.cancelled() or task.exception() is not None
+    if failed and _entries.get((scope, key)) is entry:
+        del _entries[(scope, key)]
+
+
+def forget(scope: str, key: str | None):
+    """Stop serving a key from cache, e.g. because its turn failed."""
+    if key:
+        _entries.pop((scope, key), None)
+
+
+def cancel(scope: str, key: str | None):
+    """Cancel a key's turn if it is still running, and forget it."""
+    entry = _entries.pop((scope, key), None) if key else None
+    if entry is not None and entry.task is not None and not entry.task.done():
+        entry.task.cancel()
+
+
+def validate(key: str | None) -> str | None:
+    """Normalise an Idempotency-Key header value; raises ValueError if unusable."""
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    return key
+
+
+async def run(scope: str, key: str | None, request: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """Run ``fn()`` once per (scope, key), sharing its result with duplicates.
+
+    ``request`` identifies the request body; reusing a key with a different
+    one raises IdempotencyKeyMismatch.
+    """
+    if not key:
+        return await fn()
+    fingerprint = _fingerprint("run", request)
+    entry = _lookup(scope, key, fingerprint)
+    if entry is None:
+        entry = _Entry(fingerprint)
+        entry.task = asyncio.create_task(fn())
+        entry.task.add_done_callback(lambda t: _finished(scope, key, entry, t))
+        _store(scope, key, entry)
+    else:
+        _stats["joined" if entry.finished_at is None else "replayed"] += 1
+    # Shield so a caller going away doesn't cancel the turn a retry may attach to
+    return await asyncio.shield(entry.task)
+
+
+async def _produce(entry: _Entry, items: AsyncIterator[T]):
+    try:
+        async for item in items:
+            entry.events.append(item)
+            entry.wakeup.set()
+            entry.wakeup = asyncio.Event()
+    finally:
+        entry.finished_at = time.monotonic()
+        entry.wakeup.set()
+
+
+async def _follow(entry: _Entry) -> AsyncIterator:
+    i = 0
+    while True:
+        wakeup = entry.wakeup
+        while i < len(entry.events):
+            yield entry.events[i]
+            i += 1
+        if entry.finished_at is not None:
+            return
+        await wakeup.wait()
+
+
+def stream(
+    scope: str, key: str | None, request: str, start: Callable[[], AsyncIterator[T]]
+) -> AsyncIterator[T]:
+    """Stream ``start()`` once per (scope, key), replaying it to duplicates.
+
+    ``start`` is only called for a new key, so any error it raises (e.g.
+    QueueFullError) surfaces here, before a response has begun.
+    """
+    if not key:
+        return start()
+    fingerprint = _fingerprint("stream", request)
+    entry = _lookup(scope, key, fingerprint)
+    if entry is None:
+        items = start()
+        entry = _Entry(fingerprint)
+        entry.task = asyncio.create_task(_produce(entry, items))
+        entry.task.add_done_callback(lambda t: _finished(scope, key, entry, t))
+        _store(scope, key, entry)
+    else:
+        _stats["joined" if entry.finished_at is None else "replayed"] += 1
+    return _follow(entry)
+
+
+def stats() -> dict[str, int]:
+    """Cached keys, in-flight turns and started/joined/replayed counters."""
+    return {
+        "entries": len(_entries),
+        "in_flight": sum(1 for e in _entries.values() if e.finished_at is None),
+        **_stats,
+    }
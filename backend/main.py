@@ -1,24 +1,24 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
+import asyncio
 import os
+import idempotency
+import metrics
+import store
+import tracing
 from config import get_settings
-from routes import auth_router, chat_router
-
-# Use sandbox_manager on Modal, sessions locally
-IS_MODAL = os.environ.get("MODAL_ENVIRONMENT") is not None
-
-if IS_MODAL:
-    import sandbox_manager
-    async def get_response(message: str, user_id: str):
-        return await sandbox_manager.send_message(user_id, message)
-    async def clear_session(user_id: str):
-        return await sandbox_manager.clear_session(user_id)
-else:
-    from sessions import get_response, clear_session
+from static_assets import StaticAssets
+from routes import auth_router, chat_router, ws_router
+import chat_backend
+from idempotency import IdempotencyKeyMismatch
+from chat_backend import (
+    get_response, stream_response, clear_session, reset_after_error, sse_event, SSE_HEADERS,
+    QueueFullError, ClientDisconnected, unless_disconnected, delete_blobs,
+)
+from routes.chat import blob_response
 
 app = FastAPI(
     title="Monios API",
@@ -35,9 +35,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    await chat_backend.startup()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await chat_backend.shutdown()
+    await asyncio.to_thread(store.close)
+
+
 # Include routers
 app.include_router(auth_router)
 app.include_router(chat_router)
+app.include_router(ws_router)
 
 
 # Public chat endpoint for web UI (no auth required)
@@ -46,12 +58,39 @@ class WebChatRequest(BaseModel):
     user_id: str = "guest"
 
 
+def _idempotency_key(header: str | None) -> str | None:
+    try:
+        return idempotency.validate(header)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/chat")
-async def web_chat(request: WebChatRequest):
-    """Public chat endpoint for web UI."""
+async def web_chat(
+    request: WebChatRequest,
+    response: Response,
+    http_request: Request,
+    traceparent: str | None = Header(None),
+    idempotency_key: str | None = Header(None),
+):
+    """Public chat endpoint for web UI. Honors ``Idempotency-Key`` like /api/chat."""
+    trace = tracing.start("web.chat", traceparent)
+    response.headers["traceparent"] = trace.traceparent()
+    key = _idempotency_key(idempotency_key)
+
+    async def run_turn():
+        try:
+            return await get_response(request.message, request.user_id)
+        except QueueFullError:
+            raise
+        except Exception as e:
+            trace.attrs["error"] = f"{type(e).__name__}: {e}"
+            await reset_after_error(request.user_id)
+            raise
+
     try:
-        response_text, session_id, tool_events = await get_response(
-            request.message, request.user_id
+        response_text, session_id, tool_events = await unless_disconnected(
+            http_request.receive, idempotency.run(request.user_id, key, request.message, run_turn)
         )
 
         if not response_text:
@@ -64,35 +103,119 @@ async def web_chat(request: WebChatRequest):
             "session_id": session_id,
         }
 
+    except ClientDisconnected:
+        trace.attrs["status"] = 499
+        return Response(status_code=499)
+    except IdempotencyKeyMismatch as e:
+        trace.attrs["status"] = 422
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueueFullError as e:
+        trace.attrs["status"] = 429
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"Chat error: {error_details}")
-        await clear_session(request.user_id)
         return {"content": f"Error: {type(e).__name__}: {str(e)}", "user_id": request.user_id}
+    finally:
+        trace.finish(user_id=request.user_id)
+
+
+@app.post("/chat/stream")
+async def web_chat_stream(
+    request: WebChatRequest,
+    traceparent: str | None = Header(None),
+    idempotency_key: str | None = Header(None),
+):
+    """Public chat endpoint for web UI, streamed as server-sent events."""
+    trace = tracing.start("web.chat.stream", traceparent)
+    key = _idempotency_key(idempotency_key)
+
+    async def events(turn_events):
+        tracing.use(trace)
+        try:
+            async for event in turn_events:
+                if event["type"] == "done":
+                    event = {**event, "user_id": request.user_id}
+                yield sse_event(event)
+        except asyncio.CancelledError:
+            trace.attrs["status"] = 499
+            raise
+        except QueueFullError as e:
+            idempotency.forget(request.user_id, key)
+            yield sse_event({"type": "error", "error": str(e)})
+        except Exception as e:
+            import traceback
+            error_details = traceback.format_exc()
+            print(f"Chat error: {error_details}")
+            trace.attrs["error"] = f"{type(e).__name__}: {e}"
+            idempotency.forget(request.user_id, key)
+            await reset_after_error(request.user_id)
+            yield sse_event({"type": "error", "error": f"Error: {type(e).__name__}: {str(e)}"})
+        finally:
+            trace.finish(user_id=request.user_id)
+
+    started = False
+
+    def start_turn():
+        nonlocal started
+        turn_events = stream_response(request.message, request.user_id)
+        started = True
+        return events(turn_events)
+
+    try:
+        body = idempotency.stream(request.user_id, key, request.message, start_turn)
+    except IdempotencyKeyMismatch as e:
+        trace.finish(user_id=request.user_id, status=422)
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueueFullError as e:
+        trace.finish(user_id=request.user_id, status=429)
+        raise HTTPException(status_code=429, detail=str(e))
+    if not started:
+        trace.finish(user_id=request.user_id, idempotent_replay=True)
+
+    headers = {**SSE_HEADERS, "traceparent": trace.traceparent()}
+    return StreamingResponse(body, media_type="text/event-stream", headers=headers)
 
 
 @app.post("/chat/clear")
 async def clear_chat(request: WebChatRequest):
     """Clear chat history for a user."""
     await clear_session(request.user_id)
+    await delete_blobs(request.user_id)
     return {"status": "cleared", "user_id": request.user_id}
 
 
+@app.get("/chat/blobs/{blob_id}")
+async def get_chat_blob(blob_id: str, user_id: str = "guest", range: str | None = Header(None)):
+    """Full content (or a byte range) of an offloaded tool result for the web UI."""
+    return await blob_response(user_id, blob_id, range)
+
+
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {"status": "healthy", **chat_backend.stats(), "idempotency": idempotency.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: per-stage latency histograms, gauges and error counters."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 # Serve static frontend files
 FRONTEND_DIR = os.path.join(os.path.dirname(__file__), "frontend", "dist")
 
 if os.path.exists(FRONTEND_DIR):
-    app.mount("/assets", StaticFiles(directory=os.path.join(FRONTEND_DIR, "assets")), name="assets")
+    static = StaticAssets(FRONTEND_DIR)
 
-    @app.get("/")
-    async def serve_frontend():
-        return FileResponse(os.path.join(FRONTEND_DIR, "index.html"))
+    @app.api_route("/assets/{path:path}", methods=["GET", "HEAD"])
+    async def serve_asset(path: str, request: Request):
+        return static.response(f"assets/{path}", request.headers)
+
+    @app.api_route("/", methods=["GET", "HEAD"])
+    async def serve_frontend(request: Request):
+        return static.response("index.html", request.headers)
 else:
     @app.get("/")
     async def root():
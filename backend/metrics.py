@@ -0,0 +1,201 @@
+"""Process-local metrics rendered in the Prometheus text format.
+
+Everything that records metrics runs on the controller's event loop, so
+there are no locks: a counter increment is a dict update and a histogram
+observation is a bisect plus two additions. That is cheap enough to leave
+on in the hot path.
+"""
+
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# Seconds; covers a warm cache hit through a slow cold boot or long turn
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: list["_Metric"] = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        _registry.append(self)
+
+    @abstractmethod
+    def _samples(self) -> Iterator[str]:
+        """Sample lines in the text format, without the HELP/TYPE header."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _samples(self) -> Iterator[str]:
+        if not self._values and not self.label_names:
+            yield f"{self.name} 0"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Current value, read from ``fn`` at scrape time so nothing is kept in sync."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def _samples(self) -> Iterator[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Distribution of observed durations over fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Observe the duration of the ``with`` block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def _samples(self) -> Iterator[str]:
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                le = bound if bound == "+Inf" else _format_value(bound)
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % le)
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            label_str = _format_labels(self.label_names, labels)
+            yield f"{self.name}_sum{label_str} {_format_value(total)}"
+            yield f"{self.name}_count{label_str} {count}"
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Controller stages
+
+SANDBOX_ACQUIRE = Histogram(
+    "monios_sandbox_acquire_seconds",
+    "Time to get a user's sandbox, from cache, warm pool or a cold boot.",
+)
+SANDBOX_CREATE = Histogram(
+    "monios_sandbox_create_seconds",
+    "Time for the backend to create a sandbox.",
+)
+SANDBOX_READY = Histogram(
+    "monios_sandbox_ready_wait_seconds",
+    "Time from starting the sandbox server to its first healthy response.",
+)
+SANDBOX_REQUEST = Histogram(
+    "monios_sandbox_request_seconds",
+    "Controller to sandbox round trip, until response headers arrive.",
+    labels=("path",),
+)
+SDK_FIRST_MESSAGE = Histogram(
+    "monios_sdk_first_message_seconds",
+    "Time from sending a query to the first non-system message from the Claude SDK "
+    "(locally or, from its reported timings, in the sandbox).",
+)
+TURN_FIRST_EVENT = Histogram(
+    "monios_turn_first_event_seconds",
+    "Time from a streamed turn starting to its first event.",
+)
+TURN = Histogram(
+    "monios_turn_seconds",
+    "Total time of a chat turn, after waiting for the user's earlier turns.",
+    labels=("kind",),
+)
+CONTROLLER_STARTUP = Histogram(
+    "monios_controller_startup_seconds",
+    "Controller container startup by phase, observed once per container.",
+    labels=("phase",),
+)
+ERRORS = Counter(
+    "monios_errors_total",
+    "Errors by stage.",
+    labels=("stage",),
+)
+CANCELLED_TURNS = Counter(
+    "monios_cancelled_turns_total",
+    "Turns interrupted because the client disconnected.",
+    labels=("kind",),
+)
+FORCED_CLEARS = Counter(
+    "monios_forced_clears_total",
+    "Sessions cleared because a turn failed.",
+)
@@ -14,7 +14,9 @@ controller_image = (
         "google-auth-oauthlib",
         "requests",
         "pydantic",
-        "httpx",
+        "httpx[http2]",
+        "msgpack",
+        "zstandard",
     )
     .add_local_dir(".", remote_path="/app", ignore=[
         "frontend/node_modules",
@@ -23,6 +25,9 @@ controller_image = (
         "*.pyc",
         ".env",
         "venv",
+        ".monios.db*",
+        ".monios-blobs",
+        ".sandboxes",
     ])
 )
 
@@ -33,6 +38,10 @@ sandbox_image = (
     .run_commands("npm install -g @anthropic-ai/claude-code")
     .pip_install(
         "claude-agent-sdk",
+        "starlette",
+        "uvicorn",
+        "msgpack",
+        "zstandard",
     )
     .add_local_dir(BACKEND_DIR, remote_path="/app", ignore=[
         "frontend",
@@ -48,10 +57,47 @@ app = modal.App(name="monios-api")
 # Volume to store sandbox server code (shared across all sandboxes)
 code_volume = modal.Volume.from_name("monios-sandbox-code", create_if_missing=True)
 
+# Each user's workspace is their own volume, monios-user-<user_id>, mounted
+# only in their sandboxes (see sandbox_backends.ModalBackend)
+
 
 monios_secrets = modal.Secret.from_name("monios-secrets")
 
 
+def _process_age() -> float | None:
+    """Seconds since this process started (Linux): interpreter and Modal runtime boot included."""
+    import os
+
+    try:
+        # Field 22 of /proc/self/stat, counted after the parenthesized command name
+        start_ticks = int(Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()[19])
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _sync_sandbox_code() -> bool:
+    """Copy sandbox_server.py to the code volume unless it's already there. Returns True if copied.
+
+    Most container starts run the same code as the last one, so comparing
+    content hashes saves a write and a volume commit.
+    """
+    import hashlib
+
+    source = Path("/app/sandbox_server.py").read_bytes()
+    target = Path("/code/sandbox_server.py")
+    try:
+        current = hashlib.sha256(target.read_bytes()).digest()
+    except FileNotFoundError:
+        current = None
+    if current == hashlib.sha256(source).digest():
+        return False
+    target.write_bytes(source)
+    code_volume.commit()
+    return True
+
+
 @app.function(
     image=controller_image,
     secrets=[monios_secrets],
@@ -59,25 +105,69 @@ monios_secrets = modal.Secret.from_name("monios-secrets")
 )
 @modal.asgi_app()
 def fastapi_app():
+    import json
     import sys
+    import time
     sys.path.insert(0, "/app")
 
-    # Write sandbox_server.py to the shared code volume (always refresh)
-    import shutil
-    from pathlib import Path
-    code_path = Path("/code/sandbox_server.py")
-    shutil.copy("/app/sandbox_server.py", code_path)
-    code_volume.commit()
-    print("[modal_app] Refreshed sandbox_server.py in code volume")
+    started = time.perf_counter()
+    phases = {"boot": _process_age()}
+
+    def phase(name: str, since: float) -> float:
+        now = time.perf_counter()
+        phases[name] = now - since
+        return now
+
+    # Write sandbox_server.py to the shared code volume if it changed
+    copied = _sync_sandbox_code()
+    print(f"[modal_app] {'Refreshed' if copied else 'Unchanged'} sandbox_server.py in code volume")
+    mark = phase("code_sync", started)
 
     # Initialize sandbox manager with app, image, secrets, and code volume
+    # Controller containers share user -> sandbox leases through a modal.Dict
     import sandbox_manager
+    from sandbox_registry import ModalDictRegistry
     sandbox_manager.init(
         app,
         sandbox_image,
         secrets=[monios_secrets],
         code_volume=code_volume,
+        registry=ModalDictRegistry(),
     )
+    mark = phase("sandbox_init", mark)
 
     from main import app as fastapi_application
+    phase("app_import", mark)
+
+    import metrics
+    phases["total"] = (phases["boot"] or 0.0) + time.perf_counter() - started
+    for name, seconds in phases.items():
+        if seconds is not None:
+            metrics.CONTROLLER_STARTUP.observe(seconds, name)
+    print(json.dumps({
+        "event": "controller_startup",
+        "code_copied": copied,
+        **{f"{name}_seconds": None if s is None else round(s, 3) for name, s in phases.items()},
+    }))
     return fastapi_application
+
+
+@app.function(image=controller_image, schedule=modal.Period(hours=1))
+def prune_pool_volumes():
+    """Delete fresh workspace volumes left behind by pooled sandboxes that were never adopted.
+
+    Controllers delete them when terminating a pooled sandbox; this catches
+    those whose controller died first. Anything older than a sandbox's
+    lifetime can no longer be mounted.
+    """
+    import sys
+    from datetime import datetime, timedelta, timezone
+    sys.path.insert(0, "/app")
+    from sandbox_backends import POOL_VOLUME_PREFIX
+    from sandbox_manager import SANDBOX_LIFETIME
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SANDBOX_LIFETIME)
+    for volume in modal.Volume.objects.list(created_before=cutoff):
+        if volume.name and volume.name.startswith(POOL_VOLUME_PREFIX):
+            print(f"[prune_pool_volumes] Deleting {volume.name}")
+            modal.Volume.objects.delete(volume.name, allow_missing=True)
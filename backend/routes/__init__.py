@@ -1,4 +1,5 @@
 from .auth import router as auth_router
 from .chat import router as chat_router
+from .ws import router as ws_router
 
-__all__ = ["auth_router", "chat_router"]
+__all__ = ["auth_router", "chat_router", "ws_router"]
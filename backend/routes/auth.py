@@ -39,7 +39,7 @@ async def google_auth(request: GoogleAuthRequest):
     """
     try:
         # Verify the Google ID token
-        google_user = verify_google_token(request.id_token)
+        google_user = await verify_google_token(request.id_token)
 
         # In production, you'd lookup/create user in database here
         # For now, we use Google ID as user ID
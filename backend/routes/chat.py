@@ -1,24 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, AsyncIterator
 from typing import Optional
 from datetime import datetime, timezone
+import asyncio
 import random
-import os
+import blobs
+import idempotency
+import store
+import tracing
 from auth.middleware import get_current_user
 from auth.jwt import TokenData
-
-# Use sandbox_manager on Modal, sessions locally
-IS_MODAL = os.environ.get("MODAL_ENVIRONMENT") is not None
-
-if IS_MODAL:
-    import sandbox_manager
-    async def get_response(message: str, user_id: str, session_id: str | None = None):
-        return await sandbox_manager.send_message(user_id, message)
-    async def clear_session(user_id: str):
-        return await sandbox_manager.clear_session(user_id)
-else:
-    from sessions import get_response, clear_session
+from idempotency import IdempotencyKeyMismatch
+from chat_backend import (
+    get_response, stream_response, clear_session, reset_after_error, sse_event, SSE_HEADERS,
+    QueueFullError, ClientDisconnected, unless_disconnected, local_blob, delete_blobs,
+)
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
@@ -34,6 +32,29 @@ class ToolEvent(BaseModel):
     tool_use_id: str | None = None
     content: Any | None = None
     is_error: bool | None = None
+    # Set when a large result was offloaded: content is then a preview
+    truncated: bool | None = None
+    blob: dict[str, Any] | None = None
+
+
+_NO_RESPONSE = "I couldn't generate a response. Please try again."
+
+
+def _record_turn(
+    user_id: str,
+    message: str,
+    sent_at: str,
+    response_text: str,
+    timestamp: str,
+    tool_events: list[dict[str, object]],
+    session_id: str | None,
+):
+    """Queue both sides of a completed turn for the user's chat history."""
+    store.append_message(user_id, "user", message, sent_at, session_id=session_id)
+    store.append_message(
+        user_id, "assistant", response_text, timestamp,
+        tool_events=tool_events, session_id=session_id,
+    )
 
 
 class ChatResponse(BaseModel):
@@ -45,62 +66,257 @@ class ChatResponse(BaseModel):
     user_email: str
 
 
+def _request_fingerprint(content: str, session_id: str | None) -> str:
+    return f"{session_id or ''}\0{content}"
+
+
+def _idempotency_key(header: str | None) -> str | None:
+    try:
+        return idempotency.validate(header)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     message: ChatMessage,
+    response: Response,
+    http_request: Request,
     user: TokenData = Depends(get_current_user),
-    session_id: str | None = None
+    session_id: str | None = None,
+    traceparent: str | None = Header(None),
+    idempotency_key: str | None = Header(None),
 ):
-    """Protected chat endpoint with conversation history."""
-    try:
-        response_text, session_id, tool_events = await get_response(
-            message.content, user.user_id, session_id
+    """Protected chat endpoint with conversation history.
+
+    A retry with the same ``Idempotency-Key`` header gets the original turn's
+    response instead of running the turn again. If the client disconnects
+    first, the turn is interrupted, unless it has an ``Idempotency-Key`` a
+    retry could attach to.
+    """
+    trace = tracing.start("api.chat", traceparent)
+    response.headers["traceparent"] = trace.traceparent()
+    key = _idempotency_key(idempotency_key)
+    sent_at = datetime.now(timezone.utc).isoformat()
+
+    def record(sent: str, result: tuple[str, str | None, list[dict[str, object]]]):
+        # Once per turn that ran, so a coalesced turn is one exchange in the history
+        response_text, new_session_id, tool_events = result
+        _record_turn(
+            user.user_id, sent, sent_at, response_text or _NO_RESPONSE,
+            datetime.now(timezone.utc).isoformat(), tool_events, new_session_id,
         )
 
-        if not response_text:
-            response_text = "I couldn't generate a response. Please try again."
+    async def run_turn() -> ChatResponse:
+        try:
+            response_text, new_session_id, tool_events = await get_response(
+                message.content, user.user_id, session_id, on_turn=record
+            )
+        except QueueFullError:
+            raise
+        except Exception as e:
+            print(f"Claude SDK error: {e}")
+            trace.attrs["error"] = f"{type(e).__name__}: {e}"
+            await reset_after_error(user.user_id)
+            raise
 
         return ChatResponse(
-            session_id=session_id,
+            session_id=new_session_id,
             id=f"msg_{random.randint(100000, 999999)}",
-            content=response_text,
+            content=response_text or _NO_RESPONSE,
             tool_events=tool_events,
             timestamp=datetime.now(timezone.utc).isoformat(),
             user_email=user.email,
         )
 
+    try:
+        return await unless_disconnected(http_request.receive, idempotency.run(
+            user.user_id, key, _request_fingerprint(message.content, session_id), run_turn
+        ))
+    except ClientDisconnected:
+        trace.attrs["status"] = 499
+        return Response(status_code=499)
+    except IdempotencyKeyMismatch as e:
+        trace.attrs["status"] = 422
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueueFullError as e:
+        trace.attrs["status"] = 429
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
-        print(f"Claude SDK error: {e}")
-        await clear_session(user.user_id)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to get response: {str(e)}"
         )
+    finally:
+        trace.finish(user_id=user.user_id)
+
+
+def stream_turn(
+    user: TokenData,
+    content: str,
+    session_id: str | None,
+    key: str | None,
+    trace: tracing.Trace,
+) -> AsyncIterator[dict[str, object]]:
+    """Start a streamed turn for ``user``, or attach to the one ``key`` already started.
+
+    Yields ``text``, ``tool_use`` and ``tool_result`` events, then a ``done``
+    event with the same fields as ``ChatResponse``; failures end the stream
+    with an ``error`` event. Finishes ``trace``. Raises IdempotencyKeyMismatch
+    or QueueFullError before any event is produced.
+    """
+    sent_at = datetime.now(timezone.utc).isoformat()
+
+    async def events(turn_events):
+        tracing.use(trace)
+        try:
+            async for event in turn_events:
+                if event["type"] == "done":
+                    event = {
+                        **event,
+                        "id": f"msg_{random.randint(100000, 999999)}",
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "user_email": user.email,
+                    }
+                    _record_turn(
+                        user.user_id, content, sent_at, event["content"],
+                        event["timestamp"], event["tool_events"], event["session_id"],
+                    )
+                yield event
+        except asyncio.CancelledError:
+            trace.attrs["status"] = 499
+            raise
+        except QueueFullError as e:
+            idempotency.forget(user.user_id, key)
+            yield {"type": "error", "error": str(e)}
+        except Exception as e:
+            print(f"Claude SDK error: {e}")
+            trace.attrs["error"] = f"{type(e).__name__}: {e}"
+            idempotency.forget(user.user_id, key)
+            await reset_after_error(user.user_id)
+            yield {"type": "error", "error": f"Failed to get response: {str(e)}"}
+        finally:
+            trace.finish(user_id=user.user_id)
+
+    started = False
+
+    def start_turn():
+        nonlocal started
+        turn_events = stream_response(content, user.user_id, session_id)
+        started = True
+        return events(turn_events)
+
+    turn = idempotency.stream(
+        user.user_id, key, _request_fingerprint(content, session_id), start_turn
+    )
+    if not started:
+        trace.finish(user_id=user.user_id, idempotent_replay=True)
+    return turn
+
+
+@router.post("/chat/stream")
+async def chat_stream(
+    message: ChatMessage,
+    user: TokenData = Depends(get_current_user),
+    session_id: str | None = None,
+    traceparent: str | None = Header(None),
+    idempotency_key: str | None = Header(None),
+):
+    """Protected chat endpoint streaming text and tool events as server-sent events.
+
+    Emits ``text``, ``tool_use`` and ``tool_result`` events while the turn runs,
+    then a ``done`` event with the same fields as ``ChatResponse``. A retry
+    with the same ``Idempotency-Key`` header replays the original turn's
+    events (following it live if it is still running).
+    """
+    trace = tracing.start("api.chat.stream", traceparent)
+    key = _idempotency_key(idempotency_key)
+
+    try:
+        turn = stream_turn(user, message.content, session_id, key, trace)
+    except IdempotencyKeyMismatch as e:
+        trace.finish(user_id=user.user_id, status=422)
+        raise HTTPException(status_code=422, detail=str(e))
+    except QueueFullError as e:
+        trace.finish(user_id=user.user_id, status=429)
+        raise HTTPException(status_code=429, detail=str(e))
+
+    body = (sse_event(event) async for event in turn)
+    headers = {**SSE_HEADERS, "traceparent": trace.traceparent()}
+    return StreamingResponse(body, media_type="text/event-stream", headers=headers)
 
 
 @router.post("/chat/clear")
 async def clear_ios_chat(user: TokenData = Depends(get_current_user)):
     """Clear chat history for authenticated iOS user."""
     await clear_session(user.user_id)
+    store.delete_messages(user.user_id)
+    await delete_blobs(user.user_id)
     return {"status": "cleared", "user_id": user.user_id}
 
 
 @router.get("/chat/history")
 async def get_chat_history(
     user: TokenData = Depends(get_current_user),
-    limit: int = 50,
-    offset: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    before: int | None = None,
 ):
-    """Get chat history for the authenticated user."""
+    """Get chat history for the authenticated user, newest page first.
+
+    Pass the returned ``next_cursor`` as ``before`` to fetch the next older page.
+    """
+    messages, next_cursor = await asyncio.to_thread(
+        store.list_messages, user.user_id, limit, before
+    )
     return {
-        "messages": [],
-        "total": 0,
+        "messages": messages,
         "limit": limit,
-        "offset": offset,
+        "next_cursor": next_cursor,
         "user_id": user.user_id,
     }
 
 
+async def blob_response(user_id: str, blob_id: str, range_header: str | None = None) -> Response:
+    """Serve one of the user's tool result blobs, or the byte range the client asked for."""
+    path = await local_blob(user_id, blob_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    size = path.stat().st_size
+    media_type = blobs.media_type(blob_id)
+    # Content-addressed, so a blob id's bytes never change
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{blob_id}"',
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    try:
+        span = blobs.parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if span is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = span
+    data = await asyncio.to_thread(blobs.read, user_id, blob_id, start, end)
+    return Response(
+        data, status_code=206, media_type=media_type,
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"},
+    )
+
+
+@router.get("/blobs/{blob_id}")
+async def get_blob(
+    blob_id: str,
+    user: TokenData = Depends(get_current_user),
+    range: str | None = Header(None),
+):
+    """Full content of an offloaded tool result (see ``blob`` on tool events).
+
+    Honors a single ``Range: bytes=...`` header, so large results can be paged.
+    """
+    return await blob_response(user.user_id, blob_id, range)
+
+
 @router.get("/session")
 async def get_session(user: TokenData = Depends(get_current_user)):
     """Get current session info."""
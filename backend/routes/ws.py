@@ -0,0 +1,265 @@
+"""WebSocket chat channel: authenticate once, then run many turns on one connection.
+
+Frames are JSON text. The client sends:
+
+- ``{"type": "auth", "token": ...}`` first, unless the upgrade request
+  carried an ``Authorization: Bearer`` header (browsers can't set one).
+- ``{"type": "chat", "turn_id": ..., "content": ...}`` to start a turn, with
+  optional ``session_id``, ``idempotency_key`` and ``traceparent`` fields
+  meaning what they do on /api/chat/stream. Resending a turn with the same
+  ``idempotency_key`` after a reconnect replays it.
+- ``{"type": "cancel", "turn_id": ...}`` to interrupt a turn; answered
+  with ``cancelled``.
+- ``{"type": "clear"}`` to clear the session and history.
+- ``{"type": "ping", ...}``, answered with a ``pong`` echoing its fields.
+- ``{"type": "auth", "token": ...}`` again at any time, with a fresh token
+  for the same user, to keep the connection open past the first token's
+  expiry.
+
+The server answers auth with ``ready`` (including the token's ``exp``), then sends each turn's events (the
+same ``text``/``tool_use``/``tool_result``/``done``/``error`` events as
+/api/chat/stream) tagged with its ``turn_id``. Turns on one connection may
+overlap; as everywhere, a user's turns run one at a time via turn_queue.
+Closing the connection cancels its turns, except those with an idempotency
+key, which keep running so a reconnect can pick them up. When the current
+token expires the server closes the connection with 1008.
+
+``push()`` sends an event to every open connection of a user, for updates
+the server initiates.
+"""
+
+import asyncio
+import json
+import secrets
+import time
+from contextlib import aclosing
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+
+import idempotency
+import metrics
+import store
+import tracing
+from auth.jwt import TokenData
+from auth.middleware import authenticate
+from chat_backend import QueueFullError, clear_session, delete_blobs
+from idempotency import IdempotencyKeyMismatch
+from .chat import stream_turn
+
+router = APIRouter(prefix="/api", tags=["chat"])
+
+AUTH_TIMEOUT = 10.0  # seconds to wait for the auth frame
+
+
+class _Connection:
+    """An authenticated socket and its turns in flight."""
+
+    def __init__(self, websocket: WebSocket, user: TokenData):
+        self.websocket = websocket
+        self.user = user
+        self.turns: dict[str, asyncio.Task] = {}
+        self.cancelling: set[str] = set()  # turn_ids the client asked to cancel
+        self.closed = False
+        # Turns send concurrently; one frame at a time
+        self._send_lock = asyncio.Lock()
+
+    async def close(self, code: int, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        async with self._send_lock:
+            try:
+                await self.websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
+
+    async def send(self, event: dict[str, object]):
+        if self.closed:
+            return
+        async with self._send_lock:
+            try:
+                await self.websocket.send_text(json.dumps(event))
+            except Exception:
+                # Gone; the receive loop notices and cleans up
+                self.closed = True
+
+
+# user_id -> open connections
+_connections: dict[str, set[_Connection]] = {}
+
+metrics.Gauge(
+    "monios_websocket_connections", "Open authenticated WebSocket chat connections.",
+    lambda: sum(len(conns) for conns in _connections.values()),
+)
+
+
+async def push(user_id: str, event: dict[str, object]) -> int:
+    """Send ``event`` to each of the user's open connections. Returns how many there were."""
+    conns = list(_connections.get(user_id, ()))
+    await asyncio.gather(*(conn.send(event) for conn in conns))
+    return len(conns)
+
+
+async def _authenticate(websocket: WebSocket) -> TokenData | None:
+    scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return authenticate(token)
+    try:
+        frame = await asyncio.wait_for(websocket.receive_json(), AUTH_TIMEOUT)
+    except (asyncio.TimeoutError, ValueError, KeyError):
+        return None
+    if not isinstance(frame, dict) or frame.get("type") != "auth":
+        return None
+    token = frame.get("token")
+    return authenticate(token) if isinstance(token, str) else None
+
+
+async def _reject(conn: _Connection, turn_id: str, trace: tracing.Trace, e: Exception, code: int):
+    trace.finish(user_id=conn.user.user_id, status=code)
+    await conn.send({"type": "error", "turn_id": turn_id, "error": str(e), "status": code})
+
+
+async def _run_turn(conn: _Connection, turn_id: str, frame: dict):
+    user = conn.user
+    trace = tracing.start("ws.chat", frame.get("traceparent"))
+    content = frame["content"]
+    session_id = frame.get("session_id")
+
+    try:
+        key = idempotency.validate(frame.get("idempotency_key"))
+        turn = stream_turn(user, content, session_id, key, trace)
+    except ValueError as e:
+        await _reject(conn, turn_id, trace, e, 400)
+        return
+    except IdempotencyKeyMismatch as e:
+        await _reject(conn, turn_id, trace, e, 422)
+        return
+    except QueueFullError as e:
+        await _reject(conn, turn_id, trace, e, 429)
+        return
+
+    try:
+        # aclosing: cancelled mid-send, the turn still interrupts and drains now, not at GC
+        async with aclosing(turn) as events:
+            async for event in events:
+                await conn.send({**event, "turn_id": turn_id})
+    except asyncio.CancelledError:
+        if turn_id in conn.cancelling:
+            # Asked for, so stop it even if a retry could have attached
+            conn.cancelling.discard(turn_id)
+            idempotency.cancel(user.user_id, key)
+            await conn.send({"type": "cancelled", "turn_id": turn_id})
+        raise
+
+
+async def _start_turn(conn: _Connection, frame: dict):
+    turn_id = frame.get("turn_id") or secrets.token_hex(8)
+    content = frame.get("content")
+    if not isinstance(turn_id, str) or not isinstance(content, str) or not content:
+        await conn.send({
+            "type": "error", "turn_id": turn_id,
+            "error": "chat frames need a non-empty string content", "status": 400,
+        })
+        return
+    if turn_id in conn.turns:
+        await conn.send({
+            "type": "error", "turn_id": turn_id,
+            "error": "A turn with this turn_id is already running", "status": 409,
+        })
+        return
+
+    task = asyncio.create_task(_run_turn(conn, turn_id, frame))
+    conn.turns[turn_id] = task
+
+    def _done(t: asyncio.Task):
+        if conn.turns.get(turn_id) is t:
+            del conn.turns[turn_id]
+
+    task.add_done_callback(_done)
+
+
+async def _close_on_expiry(conn: _Connection):
+    """Close the connection once its token expires, unless re-auth extended it meanwhile."""
+    while (exp := conn.user.exp) is not None:
+        remaining = exp - time.time()
+        if remaining <= 0:
+            await conn.close(status.WS_1008_POLICY_VIOLATION, "Token expired")
+            return
+        await asyncio.sleep(remaining)
+
+
+async def _reauthenticate(conn: _Connection, frame: dict):
+    token = frame.get("token")
+    user = authenticate(token) if isinstance(token, str) else None
+    if user is None:
+        await conn.send({"type": "error", "error": "Invalid or expired token", "status": 401})
+    elif user.user_id != conn.user.user_id:
+        await conn.send({"type": "error", "error": "Token is for a different user", "status": 403})
+    else:
+        conn.user = user
+        await conn.send(_ready(user))
+
+
+def _ready(user: TokenData) -> dict[str, object]:
+    return {"type": "ready", "user_id": user.user_id, "email": user.email, "exp": user.exp}
+
+
+async def _handle(conn: _Connection, frame: object):
+    kind = frame.get("type") if isinstance(frame, dict) else None
+    if kind == "chat":
+        await _start_turn(conn, frame)
+    elif kind == "ping":
+        await conn.send({**frame, "type": "pong"})
+    elif kind == "cancel":
+        turn_id = frame.get("turn_id")
+        task = conn.turns.get(turn_id)
+        if task is not None:
+            conn.cancelling.add(turn_id)
+            task.cancel()
+    elif kind == "auth":
+        await _reauthenticate(conn, frame)
+    elif kind == "clear":
+        await clear_session(conn.user.user_id)
+        store.delete_messages(conn.user.user_id)
+        await delete_blobs(conn.user.user_id)
+        await conn.send({"type": "cleared", "user_id": conn.user.user_id})
+    else:
+        await conn.send({"type": "error", "error": f"Unknown frame type: {kind!r}", "status": 400})
+
+
+@router.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """Persistent chat channel; see the module docstring for the protocol."""
+    await websocket.accept()
+    try:
+        user = await _authenticate(websocket)
+    except WebSocketDisconnect:
+        return
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or expired token")
+        return
+
+    conn = _Connection(websocket, user)
+    _connections.setdefault(user.user_id, set()).add(conn)
+    expiry = asyncio.create_task(_close_on_expiry(conn))
+    try:
+        await conn.send(_ready(user))
+        while not conn.closed:
+            try:
+                frame = await websocket.receive_json()
+            except (ValueError, KeyError):
+                await conn.send({"type": "error", "error": "Frames must be JSON text", "status": 400})
+                continue
+            await _handle(conn, frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        conn.closed = True
+        expiry.cancel()
+        for task in conn.turns.values():
+            task.cancel()
+        conns = _connections.get(user.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del _connections[user.user_id]
@@ -0,0 +1,375 @@
+"""Sandbox backends used by sandbox_manager.
+
+A backend knows how to create a sandbox, run commands in it, find the URL
+its server port is reachable at, check whether it is still alive and
+terminate it.
+
+Every user has their own workspace, mounted at the same path in each of
+their sandboxes and never in anyone else's. A sandbox created for a user
+mounts theirs. A sandbox created for the warm pool mounts a fresh, empty
+workspace that adopt() hands to a user who doesn't have one yet; one that
+is never adopted is deleted with its sandbox.
+
+ModalBackend runs real Modal sandboxes; LocalProcessBackend
+runs sandbox_server.py as local subprocesses so pool sizing, concurrency and
+cold-start timing can be measured on a single machine.
+"""
+
+import asyncio
+import hashlib
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Protocol, Sequence
+
+from sandbox_sizing import DEFAULT_TIER, SandboxSize
+
+SANDBOX_PORT = 8080
+
+
+class SandboxProcess(Protocol):
+    """A command started inside a sandbox."""
+
+    async def poll(self) -> int | None:
+        """Return the exit code, or None while still running."""
+
+    async def output(self) -> tuple[str, str]:
+        """Return (stdout, stderr). Only meaningful once the process has exited."""
+
+
+class SandboxBackend(Protocol):
+    # Command that starts sandbox_server.py inside a sandbox
+    server_command: Sequence[str]
+
+    async def create(self, size: SandboxSize = DEFAULT_TIER, user_id: str | None = None) -> Any:
+        """Create a sandbox with ``size``'s resources and return its handle.
+
+        With ``user_id``, the sandbox mounts that user's workspace (created if
+        missing); without, a fresh one for adopt().
+        """
+
+    async def adopt(self, sandbox: Any, user_id: str) -> bool:
+        """Make a pooled sandbox's fresh workspace the user's.
+
+        Returns False if the user already has a workspace; only a sandbox
+        created for them can mount it.
+        """
+
+    async def exec(self, sandbox: Any, *args: str) -> SandboxProcess:
+        """Start a command in the sandbox without waiting for it."""
+
+    async def commit_workspace(self, sandbox: Any) -> None:
+        """Persist the sandbox's workspace changes for sandboxes that reload it."""
+
+    async def reload_workspace(self, sandbox: Any) -> None:
+        """Make changes other sandboxes committed to the workspace visible in this one."""
+
+    async def tunnel_url(self, sandbox: Any, port: int) -> str:
+        """URL at which the sandbox's ``port`` is reachable from the controller."""
+
+    async def poll(self, sandbox: Any) -> int | None:
+        """Return the sandbox's exit code, or None while it is running."""
+
+    async def terminate(self, sandbox: Any) -> None:
+        """Terminate the sandbox, deleting its workspace if nobody adopted it."""
+
+    def sandbox_id(self, sandbox: Any) -> str:
+        """Stable identifier for logs."""
+
+
+class _ModalProcess:
+    def __init__(self, process):
+        self._process = process
+
+    async def poll(self) -> int | None:
+        return await self._process.poll.aio()
+
+    async def output(self) -> tuple[str, str]:
+        stdout = await self._process.stdout.read.aio()
+        stderr = await self._process.stderr.read.aio()
+        return stdout, stderr
+
+
+def user_volume_name(user_id: str) -> str:
+    """Name of the Modal volume holding a user's workspace."""
+    return f"monios-user-{user_id}"
+
+
+# Fresh workspace volumes of pooled sandboxes are named with this prefix
+# until a user adopts them
+POOL_VOLUME_PREFIX = "monios-pool-"
+
+
+class ModalBackend:
+    """Sandboxes on Modal, each with its user's own volume mounted at /workspace.
+
+    A pooled sandbox's fresh volume is adopted by renaming it to the user's
+    volume name, which fails if the user already has a volume.
+    """
+
+    server_command = ("python", "/code/sandbox_server.py")
+
+    def __init__(
+        self,
+        app,
+        sandbox_image,
+        secrets: list | None = None,
+        code_volume=None,
+        timeout: int = 3600,
+        idle_timeout: int = 300,
+    ):
+        self.app = app
+        self.sandbox_image = sandbox_image
+        self.secrets = secrets or []
+        self.code_volume = code_volume
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        # sandbox id -> name of its fresh workspace volume, until adopted
+        self._unadopted: dict[str, str] = {}
+
+    async def create(self, size: SandboxSize = DEFAULT_TIER, user_id: str | None = None):
+        import modal
+
+        if user_id is not None:
+            volume_name = user_volume_name(user_id)
+        else:
+            volume_name = POOL_VOLUME_PREFIX + secrets.token_hex(8)
+        volumes = {"/workspace": modal.Volume.from_name(volume_name, create_if_missing=True)}
+        if self.code_volume:
+            volumes["/code"] = self.code_volume
+
+        # Create new sandbox with secrets for Claude API
+        sandbox = await modal.Sandbox.create.aio(
+            app=self.app,
+            image=self.sandbox_image,
+            secrets=self.secrets,
+            env={
+                "IS_SANDBOX": "1",
+                "WORKSPACE": "/workspace",
+            },
+            timeout=self.timeout,
+            idle_timeout=self.idle_timeout,
+            volumes=volumes,
+            cpu=size.cpu,
+            memory=size.memory_mb,
+            encrypted_ports=[SANDBOX_PORT],  # Expose sandbox server port
+        )
+        if user_id is None:
+            self._unadopted[sandbox.object_id] = volume_name
+        return sandbox
+
+    async def adopt(self, sandbox, user_id: str) -> bool:
+        import modal
+
+        volume_name = self._unadopted.get(sandbox.object_id)
+        if volume_name is None:
+            return False
+        try:
+            await modal.Volume.rename.aio(volume_name, user_volume_name(user_id))
+        except modal.exception.AlreadyExistsError:
+            return False
+        del self._unadopted[sandbox.object_id]
+        return True
+
+    async def exec(self, sandbox, *args: str) -> SandboxProcess:
+        return _ModalProcess(await sandbox.exec.aio(*args))
+
+    async def commit_workspace(self, sandbox) -> None:
+        # A sync on the mount point commits a sandbox's volume changes
+        process = await sandbox.exec.aio("sync", "/workspace")
+        if (returncode := await process.wait.aio()) != 0:
+            raise Exception(f"Workspace commit failed with exit code {returncode}")
+
+    async def reload_workspace(self, sandbox) -> None:
+        await sandbox.reload_volumes.aio()
+
+    async def tunnel_url(self, sandbox, port: int) -> str:
+        tunnels = await sandbox.tunnels.aio()
+        tunnel = tunnels.get(port)
+        if not tunnel:
+            raise Exception(f"No tunnel on port {port}. Available: {list(tunnels.keys())}")
+        return tunnel.url
+
+    async def poll(self, sandbox) -> int | None:
+        return await sandbox.poll.aio()
+
+    async def terminate(self, sandbox) -> None:
+        import modal
+
+        await sandbox.terminate.aio()
+        volume_name = self._unadopted.pop(sandbox.object_id, None)
+        if volume_name is not None:
+            await modal.Volume.objects.delete.aio(volume_name, allow_missing=True)
+
+    def sandbox_id(self, sandbox) -> str:
+        return sandbox.object_id
+
+
+class _LocalProcess:
+    def __init__(self, process: asyncio.subprocess.Process, stdout: Path, stderr: Path):
+        self._process = process
+        self._stdout = stdout
+        self._stderr = stderr
+
+    async def poll(self) -> int | None:
+        return self._process.returncode
+
+    async def output(self) -> tuple[str, str]:
+        await self._process.wait()
+        return (
+            self._stdout.read_text(errors="replace"),
+            self._stderr.read_text(errors="replace"),
+        )
+
+
+@dataclass
+class LocalSandbox:
+    """A local stand-in for a sandbox: a port, plus the processes started for it."""
+    port: int
+    size: SandboxSize = DEFAULT_TIER  # recorded, not enforced
+    workspace: Path | None = None  # the directory its mount points at
+    adopted: bool = False
+    processes: list[asyncio.subprocess.Process] = field(default_factory=list)
+    returncode: int | None = None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalProcessBackend:
+    """Runs sandbox_server.py as local subprocesses on free ports.
+
+    Users' workspaces are directories under ``root/workspaces``, named by a
+    hash of the user id. Each sandbox's WORKSPACE is a symlink under
+    ``root/mounts`` standing in for the Modal mount, so adopting a pooled
+    sandbox's workspace can rename the directory behind it. Process output
+    goes to files under ``root/logs`` rather than pipes, so a chatty server
+    can never block on a full pipe.
+    Commands run with the controller's environment plus PORT and WORKSPACE;
+    there is no isolation between sandboxes, and sizes are recorded but not
+    enforced.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike | None = None,
+        server_command: Sequence[str] | None = None,
+        env: dict[str, str] | None = None,
+    ):
+        self.root = Path(root or os.environ.get(
+            "LOCAL_SANDBOX_ROOT", Path(__file__).parent / ".sandboxes"
+        ))
+        self.server_command = tuple(server_command or (
+            sys.executable, str(Path(__file__).parent / "sandbox_server.py"),
+        ))
+        self.env = env or {}
+
+    def _user_workspace(self, user_id: str) -> Path:
+        return self.root / "workspaces" / hashlib.sha256(user_id.encode()).hexdigest()
+
+    def _mount(self, sandbox: LocalSandbox) -> Path:
+        return self.root / "mounts" / str(sandbox.port)
+
+    def _point_mount(self, sandbox: LocalSandbox, workspace: Path):
+        mount = self._mount(sandbox)
+        staged = mount.with_name(mount.name + ".new")
+        staged.unlink(missing_ok=True)
+        staged.symlink_to(workspace, target_is_directory=True)
+        os.replace(staged, mount)
+        sandbox.workspace = workspace
+
+    async def create(self, size: SandboxSize = DEFAULT_TIER, user_id: str | None = None) -> LocalSandbox:
+        for name in ("workspaces", "mounts", "logs"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+        sandbox = LocalSandbox(port=_free_port(), size=size, adopted=user_id is not None)
+        if user_id is not None:
+            workspace = self._user_workspace(user_id)
+        else:
+            workspace = self.root / "workspaces" / f"pool-{sandbox.port}"
+        workspace.mkdir(exist_ok=True)
+        self._point_mount(sandbox, workspace)
+        return sandbox
+
+    async def adopt(self, sandbox: LocalSandbox, user_id: str) -> bool:
+        workspace = self._user_workspace(user_id)
+        if sandbox.adopted or sandbox.workspace is None or workspace.exists():
+            return False
+        sandbox.workspace.rename(workspace)
+        self._point_mount(sandbox, workspace)
+        sandbox.adopted = True
+        return True
+
+    async def exec(self, sandbox: LocalSandbox, *args: str) -> SandboxProcess:
+        env = {
+            **os.environ,
+            **self.env,
+            "IS_SANDBOX": "1",
+            "PORT": str(sandbox.port),
+            "WORKSPACE": str(self._mount(sandbox)),
+        }
+        log = self.root / "logs" / f"{sandbox.port}-{len(sandbox.processes)}"
+        stdout, stderr = log.with_suffix(".out"), log.with_suffix(".err")
+        with open(stdout, "wb") as out, open(stderr, "wb") as err:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                env=env,
+                stdout=out,
+                stderr=err,
+                start_new_session=True,  # So terminate() can kill the whole process group
+            )
+        sandbox.processes.append(process)
+        return _LocalProcess(process, stdout, stderr)
+
+    async def commit_workspace(self, sandbox: LocalSandbox) -> None:
+        pass  # Every local sandbox sees the same directory
+
+    async def reload_workspace(self, sandbox: LocalSandbox) -> None:
+        pass
+
+    async def tunnel_url(self, sandbox: LocalSandbox, port: int) -> str:
+        # Every local sandbox listens on its own port; ``port`` is the in-sandbox one
+        return f"http://127.0.0.1:{sandbox.port}"
+
+    async def poll(self, sandbox: LocalSandbox) -> int | None:
+        if sandbox.returncode is not None:
+            return sandbox.returncode
+        # The first process is the server; the sandbox is gone when it exits
+        if sandbox.processes and sandbox.processes[0].returncode is not None:
+            return sandbox.processes[0].returncode
+        return None
+
+    async def terminate(self, sandbox: LocalSandbox) -> None:
+        for process in sandbox.processes:
+            if process.returncode is None:
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for process in sandbox.processes:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+        if sandbox.returncode is None:
+            sandbox.returncode = -signal.SIGTERM
+        self._mount(sandbox).unlink(missing_ok=True)
+        if not sandbox.adopted and sandbox.workspace is not None:
+            shutil.rmtree(sandbox.workspace, ignore_errors=True)
+
+    def sandbox_id(self, sandbox: LocalSandbox) -> str:
+        return f"local-{sandbox.port}"
+
+    def cleanup(self):
+        """Remove all local workspaces and logs."""
+        shutil.rmtree(self.root / "workspaces", ignore_errors=True)
+        shutil.rmtree(self.root / "mounts", ignore_errors=True)
+        shutil.rmtree(self.root / "logs", ignore_errors=True)
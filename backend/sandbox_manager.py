@@ -1,223 +1,1125 @@
-"""Manages per-user Modal sandboxes.
+"""Manages per-user sandboxes.
 
 Each user gets their own isolated sandbox with:
 - Their own Claude Code instance
-- Their own persistent volume at /workspace
+- Their own persistent workspace, which no other user's sandbox mounts
 - Their own session state
+
+A small pool of pre-booted sandboxes absorbs cold starts for new users:
+each pooled sandbox has a fresh, empty workspace that is handed to the
+first user without one (see SandboxBackend.adopt). Users who already have
+a workspace get a sandbox booted with it mounted.
+Where they run is up to the backend (see sandbox_backends): Modal in
+production, local processes for load testing.
+
+Which sandbox serves which user is recorded in a registry (see
+sandbox_registry). With a shared registry, a controller that didn't boot a
+user's sandbox routes to it rather than booting a duplicate; only the
+controller holding the lease supervises it.
+
+Each new sandbox, and each rollover, is sized from the user's recent
+resource usage (see sandbox_sizing).
 """
 
-import modal
-import httpx
 import asyncio
-from typing import Optional
+import json
+import os
+import random
+import secrets
+import socket
+import time
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Optional
+
+import framing
+import metrics
+import sandbox_registry
+import tracing
+from sandbox_backends import SANDBOX_PORT, LocalProcessBackend, ModalBackend, SandboxBackend
+from sandbox_registry import LEASE_TTL, Lease, MemoryRegistry, SandboxRegistry
+from sandbox_sizing import DEFAULT_TIER, HeadroomPolicy, SandboxSize, SizingPolicy, UsageSample
+
+if TYPE_CHECKING:
+    import httpx
+
+# Where sandboxes come from - set by init() (Modal) or set_backend()
+_backend: Optional[SandboxBackend] = None
+
+# user -> sandbox leases, shared with other controllers - set by set_registry()
+_registry: SandboxRegistry = MemoryRegistry()
+
+# Identifies this controller process as a lease owner
+CONTROLLER_ID = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+
+# Sizes each new sandbox (and each rollover) from the user's recent usage
+# samples, which are kept in the registry
+_sizing_policy: SizingPolicy = HeadroomPolicy()
+
+# Sandbox lifetime limits (enforced by Modal) and how the supervisor stays ahead of them
+SANDBOX_LIFETIME = 3600  # 1 hour max lifetime
+SANDBOX_IDLE_TIMEOUT = 300  # 5 min idle = terminate
+_REAP_IDLE_AFTER = float(os.environ.get("SANDBOX_REAP_IDLE_AFTER", "270"))
+_ROLLOVER_MARGIN = float(os.environ.get("SANDBOX_ROLLOVER_MARGIN", "300"))
+_SUPERVISE_INTERVAL = float(os.environ.get("SANDBOX_SUPERVISE_INTERVAL", "15"))
+# Long enough for a rollover's predecessor to finish a running turn
+_HANDOVER_TIMEOUT = float(os.environ.get("SANDBOX_HANDOVER_TIMEOUT", "150"))
+
+
+@dataclass
+class ActiveSandbox:
+    """A sandbox attached to a user, with the bookkeeping the supervisor needs.
+
+    ``owned`` entries were booted here and are supervised here. The others
+    route to a sandbox another controller leased; they have no backend handle
+    and are only trusted until their copy of the lease expires.
+    """
+    sandbox: Any  # backend-specific sandbox handle (None when routed)
+    tunnel_url: str
+    created_at: float  # time.monotonic() when the sandbox was created
+    last_used: float = field(default_factory=time.monotonic)
+    in_use: int = 0  # requests currently talking to the sandbox
+    lease: Optional[Lease] = None
+    owned: bool = True
+    retired_at: float = 0.0  # time.monotonic() when replaced by a rollover
+    user_id: str = ""
+    size: SandboxSize = DEFAULT_TIER
+    usage: Optional[dict] = None  # latest usage report from the sandbox
+
 
-# Reference to the main app - will be set by modal_app.py
-_app: Optional[modal.App] = None
+# Track active sandboxes: user_id -> ActiveSandbox
+_active_sandboxes: dict[str, ActiveSandbox] = {}
 
-# Sandbox image with Claude Code + our sandbox server
-_sandbox_image: Optional[modal.Image] = None
+# Sandboxes replaced by a rollover, terminated once their last request finishes
+_retiring: list[ActiveSandbox] = []
+_rolling_over: set[str] = set()
+_supervisor_task: Optional[asyncio.Task] = None
+_sandbox_stats: dict[str, int] = {
+    "reaped_dead": 0, "reaped_idle": 0, "rollovers": 0, "resized": 0, "fenced": 0,
+    "lost_claims": 0,
+}
 
-# Secrets for Claude API access
-_secrets: Optional[list] = None
+# Long-lived HTTP clients keyed by tunnel URL, so each message reuses a warm
+# connection instead of paying a new TCP+TLS handshake. httpx (and h2) are
+# imported on first use to keep them off the controller's cold start.
+_http_clients: dict[str, "httpx.AsyncClient"] = {}
+_HTTP_MAX_CONNECTIONS = int(os.environ.get("SANDBOX_HTTP_MAX_CONNECTIONS", "8"))
+_HTTP_MAX_KEEPALIVE = int(os.environ.get("SANDBOX_HTTP_MAX_KEEPALIVE", "4"))
+_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("SANDBOX_HTTP_KEEPALIVE_EXPIRY", "60"))
+_HTTP2: Optional[bool] = None  # Whether h2 is installed, once checked
 
-# Shared code volume (contains sandbox_server.py)
-_code_volume: Optional[modal.Volume] = None
+# In-progress acquisitions: user_id -> task shared by concurrent callers
+_acquiring: dict[str, asyncio.Task] = {}
 
-# Track active sandboxes: user_id -> (sandbox, tunnel_url)
-_active_sandboxes: dict[str, tuple[modal.Sandbox, str]] = {}
+# Warm pool of booted, healthy, unattached sandboxes with fresh workspaces:
+# (sandbox, tunnel_url, created_at)
+_pool: list[tuple[Any, str, float]] = []
+_pool_target: int = int(os.environ.get("SANDBOX_POOL_SIZE", "1"))
+_pool_max_age: float = float(os.environ.get("SANDBOX_POOL_MAX_AGE", "900"))
+_pool_booting: int = 0
+_pool_stats: dict[str, int] = {"hits": 0, "misses": 0, "created": 0, "discarded": 0}
+_refill_task: Optional[asyncio.Task] = None
+
+# Fire-and-forget work (terminations, rollovers, remote cancels). The event
+# loop only keeps weak references to tasks, so hold them until they finish.
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    """Run ``coro`` in the background, keeping a reference and logging its failure."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[sandbox_manager] Background task failed: {task.exception()!r}")
 
 
 def init(
-    app: modal.App,
-    sandbox_image: modal.Image,
+    app,
+    sandbox_image,
     secrets: list = None,
-    code_volume: modal.Volume = None,
+    code_volume=None,
+    registry: Optional[SandboxRegistry] = None,
 ):
-    """Initialize the sandbox manager with app and image references."""
-    global _app, _sandbox_image, _secrets, _code_volume
-    _app = app
-    _sandbox_image = sandbox_image
-    _secrets = secrets or []
-    _code_volume = code_volume
-
-
-async def get_or_create_sandbox(user_id: str) -> tuple[modal.Sandbox, str]:
-    """Get existing sandbox or create new one for user. Returns (sandbox, tunnel_url)."""
-    global _active_sandboxes
-
-    print(f"[sandbox_manager] get_or_create_sandbox for user: {user_id}")
-
-    # Check if we have an active sandbox
-    if user_id in _active_sandboxes:
-        sb, tunnel_url = _active_sandboxes[user_id]
-        # Check if still running
-        if sb.poll() is None:
-            print(f"[sandbox_manager] Reusing existing sandbox for {user_id}")
-            return sb, tunnel_url
-        else:
-            # Sandbox terminated, remove from cache
-            print(f"[sandbox_manager] Sandbox terminated, creating new one for {user_id}")
+    """Initialize the sandbox manager to run sandboxes on Modal.
+
+    Pass a shared ``registry`` (e.g. a ModalDictRegistry) when more than one
+    controller container can serve the same user.
+    """
+    set_backend(ModalBackend(
+        app,
+        sandbox_image,
+        secrets=secrets,
+        code_volume=code_volume,
+        timeout=SANDBOX_LIFETIME,
+        idle_timeout=SANDBOX_IDLE_TIMEOUT,
+    ))
+    if registry is not None:
+        set_registry(registry)
+
+
+def set_backend(backend: SandboxBackend):
+    """Use ``backend`` for every sandbox created from now on."""
+    global _backend
+    _backend = backend
+
+
+def set_registry(registry: SandboxRegistry):
+    """Record and look up user -> sandbox leases in ``registry``."""
+    global _registry
+    _registry = registry
+
+
+def set_sizing_policy(policy: SizingPolicy):
+    """Size new sandboxes with ``policy`` (see sandbox_sizing)."""
+    global _sizing_policy
+    _sizing_policy = policy
+
+
+async def _choose_size(user_id: str, current: Optional[ActiveSandbox] = None) -> SandboxSize:
+    """Size for the user's next sandbox, counting the one it replaces so far."""
+    try:
+        history = [UsageSample.from_dict(s) for s in await _registry.usage_history(user_id)]
+    except Exception as e:
+        metrics.ERRORS.inc("sandbox_registry")
+        print(f"[sandbox_manager] Usage history lookup failed for {user_id}: {e}")
+        history = []
+    if current is not None and current.usage:
+        history.append(UsageSample.from_report(user_id, current.size, current.usage))
+    try:
+        return _sizing_policy.choose(history)
+    except Exception as e:
+        print(f"[sandbox_manager] Sizing policy failed for {user_id}: {e}")
+        return DEFAULT_TIER
+
+
+async def _record_usage(entry: ActiveSandbox, exit_code: int | None = None):
+    """Keep a finished sandbox's usage as a sample for sizing its user's next one.
+
+    A live sandbox is asked for its final report; a dead one's last report
+    (plus its exit code) is all there is.
+    """
+    if not entry.owned or not entry.user_id:
+        return
+    report = entry.usage
+    if exit_code is None:
+        status = await _remote_status(entry.tunnel_url)
+        if status and status.get("usage"):
+            report = status["usage"]
+    if report is None and exit_code is None:
+        return
+    sample = UsageSample.from_report(entry.user_id, entry.size, report or {}, exit_code)
+    print(sample.to_json())
+    try:
+        await _registry.add_usage(entry.user_id, asdict(sample))
+    except Exception as e:
+        metrics.ERRORS.inc("sandbox_registry")
+        print(f"[sandbox_manager] Recording usage failed for {entry.user_id}: {e}")
+
+
+def _note_usage(user_id: str, usage: Optional[dict]):
+    entry = _active_sandboxes.get(user_id)
+    if entry is not None and usage:
+        entry.usage = usage
+
+
+def init_from_env() -> bool:
+    """Select a non-Modal backend from SANDBOX_BACKEND. Returns True if one was set.
+
+    Also picks the registry named by SANDBOX_REGISTRY, if set.
+    """
+    registry = sandbox_registry.from_env()
+    if registry is not None:
+        set_registry(registry)
+    if os.environ.get("SANDBOX_BACKEND") == "local":
+        set_backend(LocalProcessBackend())
+        return True
+    return False
+
+
+async def get_or_create_sandbox(user_id: str) -> tuple[Any, str]:
+    """Get existing sandbox or create new one for user. Returns (sandbox, tunnel_url).
+
+    Concurrent callers for the same user share a single in-progress acquisition.
+    Liveness is tracked by the background supervisor, not checked here.
+    """
+    stale = None
+    entry = _active_sandboxes.get(user_id)
+    if entry is not None:
+        if entry.owned or entry.lease.live:
+            return entry.sandbox, entry.tunnel_url
+        # Our copy of another controller's lease is stale; look it up again
+        stale = _active_sandboxes.pop(user_id)
+
+    task = _acquiring.get(user_id)
+    if task is None:
+        task = asyncio.create_task(_acquire_sandbox(user_id))
+        _acquiring[user_id] = task
+
+        def _done(t: asyncio.Task):
+            if _acquiring.get(user_id) is t:
+                del _acquiring[user_id]
+
+        task.add_done_callback(_done)
+    # Shield so one caller giving up doesn't abort the creation others wait on
+    entry = await asyncio.shield(task)
+    if stale is not None and stale.tunnel_url != entry.tunnel_url:
+        await _close_routed_client(stale)
+    return entry.sandbox, entry.tunnel_url
+
+
+async def _acquire_sandbox(user_id: str) -> ActiveSandbox:
+    """Route to the user's leased sandbox, or take a pooled one (or boot one) and lease it."""
+    lease = None
+    try:
+        lease = await _registry.get(user_id)
+    except Exception as e:
+        metrics.ERRORS.inc("sandbox_registry")
+        print(f"[sandbox_manager] Registry lookup failed for {user_id}: {e}")
+
+    if lease is not None and lease.owner != CONTROLLER_ID:
+        print(f"[sandbox_manager] Routing {user_id} to {lease.sandbox_id} leased by {lease.owner}")
+        entry = _routed(lease)
+    else:
+        print(f"[sandbox_manager] Acquiring sandbox for user: {user_id}")
+        entry = await _new_attached_sandbox(user_id)
+        entry = await _claim(user_id, entry)
+    _active_sandboxes[user_id] = entry
+    return entry
+
+
+def _routed(lease: Lease) -> ActiveSandbox:
+    return ActiveSandbox(
+        sandbox=None, tunnel_url=lease.tunnel_url, created_at=time.monotonic(),
+        lease=lease, owned=False, user_id=lease.user_id,
+    )
+
+
+async def _drop_routed(user_id: str, entry: ActiveSandbox):
+    """Forget a routed entry, closing its HTTP client unless something still uses it."""
+    if _active_sandboxes.get(user_id) is entry:
+        del _active_sandboxes[user_id]
+    await _close_routed_client(entry)
+
+
+async def _close_routed_client(entry: ActiveSandbox):
+    # With requests in flight the last one closes it (see _using_sandbox)
+    if entry.in_use or any(e.tunnel_url == entry.tunnel_url for e in _active_sandboxes.values()):
+        return
+    await _close_http_client(entry.tunnel_url)
+
+
+async def _claim(user_id: str, entry: ActiveSandbox) -> ActiveSandbox:
+    """Lease a freshly attached sandbox, or give it up for one another controller leased first."""
+    sandbox_id = _backend.sandbox_id(entry.sandbox)
+    try:
+        lease = await _registry.claim(user_id, sandbox_id, entry.tunnel_url, CONTROLLER_ID)
+    except Exception as e:
+        # Still usable from this controller; the supervisor retries the lease
+        metrics.ERRORS.inc("sandbox_registry")
+        print(f"[sandbox_manager] Lease claim failed for {user_id}: {e}")
+        return entry
+    if lease.owner == CONTROLLER_ID and lease.sandbox_id == sandbox_id:
+        entry.lease = lease
+        return entry
+    print(f"[sandbox_manager] {lease.owner} leased a sandbox for {user_id} first, using theirs")
+    _sandbox_stats["lost_claims"] += 1
+    _spawn(_terminate(entry.sandbox, entry.tunnel_url))
+    return _routed(lease)
+
+
+async def _release(entry: ActiveSandbox):
+    """Give up an owned entry's lease, ignoring registry errors."""
+    if not entry.owned or entry.lease is None:
+        return
+    try:
+        await _registry.release(entry.lease)
+    except Exception as e:
+        metrics.ERRORS.inc("sandbox_registry")
+        print(f"[sandbox_manager] Lease release failed for {entry.lease.user_id}: {e}")
+
+
+async def _new_attached_sandbox(
+    user_id: str, size: Optional[SandboxSize] = None, takeover: bool = False
+) -> ActiveSandbox:
+    size = size or await _choose_size(user_id)
+    # Prefer a pre-booted sandbox from the warm pool, which holds the default size
+    pooled = await _take_from_pool() if size == DEFAULT_TIER else None
+    if pooled is not None and not await _adopt(pooled, user_id):
+        pooled = None
+    if pooled is not None:
+        _pool_stats["hits"] += 1
+        sb, tunnel_url, created_at = pooled
+        print(f"[sandbox_manager] Pool hit for {user_id}: {_backend.sandbox_id(sb)}")
+    else:
+        _pool_stats["misses"] += 1
+        print(f"[sandbox_manager] Pool miss for {user_id}, booting {size.name} sandbox")
+        sb, tunnel_url, created_at = await _boot_sandbox(size, user_id)
+    refill_pool()
+
+    # Bind the sandbox to the user now that it is theirs
+    try:
+        await _attach(tunnel_url, user_id, takeover)
+    except Exception:
+        await _terminate(sb, tunnel_url)
+        raise
+
+    return ActiveSandbox(
+        sandbox=sb, tunnel_url=tunnel_url, created_at=created_at, user_id=user_id, size=size,
+    )
+
+
+class _HandedOver(Exception):
+    """The sandbox was rolled over before the turn started; it can be sent again."""
+
+
+@asynccontextmanager
+async def _using_sandbox(user_id: str) -> AsyncIterator[str]:
+    """Acquire the user's sandbox for one request and yield its tunnel URL.
+
+    Marks the sandbox busy so the supervisor won't reap it mid-request, and
+    drops it from the cache if a transport error turns out to mean it died.
+    """
+    import httpx
+
+    try:
+        with metrics.SANDBOX_ACQUIRE.time(), tracing.span("sandbox_acquire"):
+            sb, tunnel_url = await get_or_create_sandbox(user_id)
+    except Exception:
+        metrics.ERRORS.inc("sandbox_acquire")
+        raise
+    entry = _active_sandboxes.get(user_id)
+    if entry is not None:
+        entry.in_use += 1
+    try:
+        yield tunnel_url
+    except _HandedOver:
+        # The registry points at the replacement by now; look it up again
+        if entry is not None and not entry.owned and _active_sandboxes.get(user_id) is entry:
             del _active_sandboxes[user_id]
+        raise
+    except httpx.TransportError:
+        if entry is not None and not entry.owned:
+            # Only the owner can poll it; look the lease up again next time
+            if _active_sandboxes.get(user_id) is entry:
+                del _active_sandboxes[user_id]
+        elif (returncode := await _backend.poll(sb)) is not None:
+            print(f"[sandbox_manager] Sandbox for {user_id} died mid-request")
+            if entry is not None:
+                await _record_usage(entry, returncode)
+            await _forget(user_id, sb)
+        raise
+    finally:
+        if entry is not None:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            if not entry.owned and _active_sandboxes.get(user_id) is not entry:
+                await _close_routed_client(entry)
+
+
+async def _forget(user_id: str, sb: Any = None):
+    """Drop a user's cached sandbox (only if it is still ``sb``, when given)."""
+    entry = _active_sandboxes.get(user_id)
+    if entry is None or (sb is not None and entry.sandbox is not sb):
+        return
+    del _active_sandboxes[user_id]
+    await _release(entry)
+    await _close_http_client(entry.tunnel_url)
+
+
+async def _boot_sandbox(
+    size: SandboxSize = DEFAULT_TIER, user_id: Optional[str] = None
+) -> tuple[Any, str, float]:
+    """Create a sandbox of ``size`` and wait for its server.
+
+    With ``user_id`` it mounts that user's workspace; without, it is for the
+    warm pool. Returns (sandbox, tunnel_url, created_at).
+    """
+    created_at = time.monotonic()
+    with metrics.SANDBOX_CREATE.time():
+        sb = await _backend.create(size, user_id)
+    print(f"[sandbox_manager] Sandbox created: {_backend.sandbox_id(sb)}")
+
+    tunnel_url = None
+    try:
+        # Start the server (don't wait for it to complete)
+        process = await _backend.exec(sb, *_backend.server_command)
+
+        # Get tunnel URL for HTTP access
+        tunnel_url = await _backend.tunnel_url(sb, SANDBOX_PORT)
+        print(f"[sandbox_manager] Tunnel URL: {tunnel_url}")
+
+        # Wait for server to be ready
+        with metrics.SANDBOX_READY.time():
+            await _wait_for_ready(tunnel_url, process)
+    except BaseException as e:
+        if isinstance(e, Exception):
+            metrics.ERRORS.inc("sandbox_boot")
+        await _terminate(sb, tunnel_url)
+        raise
+
+    return sb, tunnel_url, created_at
+
+
+async def _terminate(sb: Any, tunnel_url: str | None = None):
+    """Terminate a sandbox (and drop its pooled HTTP connections), ignoring errors."""
+    if tunnel_url is not None:
+        await _close_http_client(tunnel_url)
+    try:
+        await _backend.terminate(sb)
+    except Exception:
+        pass
+
+
+def _http_client(tunnel_url: str) -> "httpx.AsyncClient":
+    """Get the long-lived, keep-alive HTTP client for a sandbox tunnel."""
+    global _HTTP2
+    client = _http_clients.get(tunnel_url)
+    if client is None or client.is_closed:
+        import httpx
+
+        if _HTTP2 is None:
+            try:
+                import h2  # noqa: F401  # HTTP/2 needs httpx[http2]
+                _HTTP2 = True
+            except ImportError:
+                _HTTP2 = False
+        client = httpx.AsyncClient(
+            base_url=tunnel_url,
+            http2=_HTTP2,
+            limits=httpx.Limits(
+                max_connections=_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=_HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=10.0,
+        )
+        _http_clients[tunnel_url] = client
+    return client
+
+
+async def _close_http_client(tunnel_url: str):
+    client = _http_clients.pop(tunnel_url, None)
+    if client is not None:
+        try:
+            await client.aclose()
+        except Exception:
+            pass
+
 
-    # Create user's volume (persistent across sandbox restarts)
-    print(f"[sandbox_manager] Creating volume for user: {user_id}")
-    user_volume = modal.Volume.from_name(
-        f"monios-user-{user_id}",
-        create_if_missing=True
+async def shutdown(terminate_all: bool = False):
+    """Stop the supervisor, drain the warm pool and close all pooled HTTP connections.
+
+    With ``terminate_all``, also terminate every active and retiring sandbox.
+    """
+    if _supervisor_task is not None:
+        _supervisor_task.cancel()
+    if terminate_all:
+        owned = [e for e in (*_active_sandboxes.values(), *_retiring) if e.owned]
+        await asyncio.gather(*(_record_usage(e) for e in owned))
+        await asyncio.gather(*(_release(e) for e in owned))
+        doomed = [(sb, tunnel_url) for sb, tunnel_url, _ in _pool]
+        doomed += [(e.sandbox, e.tunnel_url) for e in owned]
+        _pool.clear()
+        _active_sandboxes.clear()
+        _retiring.clear()
+        await asyncio.gather(*(_terminate(sb, tunnel_url) for sb, tunnel_url in doomed))
+    set_pool_target(0)
+    for tunnel_url in list(_http_clients):
+        await _close_http_client(tunnel_url)
+
+
+async def _attach(tunnel_url: str, user_id: str, takeover: bool = False):
+    """Bind a booted sandbox to the user whose workspace it mounts.
+
+    With ``takeover`` it holds turns until _hand_over() lets it start.
+    """
+    resp = await _http_client(tunnel_url).post(
+        "/attach",
+        json={"user_id": user_id, "takeover": takeover},
+        timeout=10.0,
     )
+    if resp.status_code != 200:
+        raise Exception(f"Sandbox attach failed status={resp.status_code} payload={resp.text}")
+
+
+async def _is_healthy(tunnel_url: str) -> bool:
+    """Quick health probe used before handing out a pooled sandbox."""
+    try:
+        resp = await _http_client(tunnel_url).get("/health", timeout=2.0)
+        return resp.status_code == 200
+    except Exception:
+        return False
+
+
+async def _take_from_pool() -> tuple[Any, str, float] | None:
+    """Pop the first live pooled sandbox, discarding stale or dead ones."""
+    while _pool:
+        sb, tunnel_url, created_at = _pool.pop(0)
+        fresh = time.monotonic() - created_at < _pool_max_age
+        if fresh and await _backend.poll(sb) is None and await _is_healthy(tunnel_url):
+            return sb, tunnel_url, created_at
+        _pool_stats["discarded"] += 1
+        _spawn(_terminate(sb, tunnel_url))
+    return None
+
+
+async def _adopt(pooled: tuple[Any, str, float], user_id: str) -> bool:
+    """Hand a pooled sandbox's fresh workspace to the user.
+
+    If the user already has a workspace, the sandbox goes back to the pool
+    for someone who doesn't. Returns whether the user got it.
+    """
+    sb, tunnel_url, _ = pooled
+    try:
+        adopted = await _backend.adopt(sb, user_id)
+    except Exception as e:
+        print(f"[sandbox_manager] Adopting pooled workspace for {user_id} failed: {e}")
+        _pool_stats["discarded"] += 1
+        _spawn(_terminate(sb, tunnel_url))
+        return False
+    if not adopted:
+        _pool.insert(0, pooled)
+    return adopted
+
+
+async def _boot_into_pool() -> bool:
+    """Boot one sandbox into the warm pool. Returns False if booting failed."""
+    global _pool_booting
+    _pool_booting += 1
+    try:
+        sb, tunnel_url, created_at = await _boot_sandbox()
+    except Exception as e:
+        print(f"[sandbox_manager] Pool refill failed: {e}")
+        return False
+    finally:
+        _pool_booting -= 1
+    _pool_stats["created"] += 1
+    if len(_pool) >= _pool_target:
+        # Target shrank while we were booting
+        await _terminate(sb, tunnel_url)
+        return True
+    _pool.append((sb, tunnel_url, created_at))
+    print(f"[sandbox_manager] Pool size: {len(_pool)}/{_pool_target}")
+    return True
+
+
+async def _refill():
+    """Boot sandboxes concurrently until the pool reaches its target size."""
+    while (needed := _pool_target - len(_pool) - _pool_booting) > 0:
+        results = await asyncio.gather(*(_boot_into_pool() for _ in range(needed)))
+        if not all(results):
+            return
+
+
+def refill_pool() -> Optional[asyncio.Task]:
+    """Start a background refill of the warm pool if one isn't already running."""
+    global _refill_task
+    if _refill_task is None or _refill_task.done():
+        if len(_pool) + _pool_booting < _pool_target:
+            _refill_task = asyncio.create_task(_refill())
+    return _refill_task
+
 
-    # Create new sandbox with secrets for Claude API
-    print(f"[sandbox_manager] Creating sandbox for user: {user_id}")
-    volumes = {"/workspace": user_volume}
-    if _code_volume:
-        volumes["/code"] = _code_volume
-
-    sb = modal.Sandbox.create(
-        app=_app,
-        image=_sandbox_image,
-        secrets=_secrets,
-        env={
-            "IS_SANDBOX": "1",
-            "HOME": "/workspace",
-        },
-        timeout=3600,  # 1 hour max lifetime
-        idle_timeout=300,  # 5 min idle = terminate
-        volumes=volumes,
-        cpu=1.0,
-        memory=512,
-        encrypted_ports=[8080],  # Expose sandbox server port
+def set_pool_target(size: int) -> Optional[asyncio.Task]:
+    """Change the warm pool target size, trimming or refilling as needed."""
+    global _pool_target
+    _pool_target = max(0, size)
+    while len(_pool) > _pool_target:
+        sb, tunnel_url, _ = _pool.pop()
+        _spawn(_terminate(sb, tunnel_url))
+    return refill_pool()
+
+
+def pool_stats() -> dict[str, int]:
+    """Warm pool size and hit/miss counters."""
+    return {
+        "size": len(_pool),
+        "booting": _pool_booting,
+        "target": _pool_target,
+        **_pool_stats,
+    }
+
+
+async def _poll(entry: ActiveSandbox) -> int | None:
+    # Routed sandboxes are polled by their owner
+    return await _backend.poll(entry.sandbox) if entry.owned else None
+
+
+async def _renew(user_id: str, entry: ActiveSandbox) -> bool:
+    """Renew an owned entry's lease (or claim it, if that failed earlier). False if fenced off."""
+    if not entry.owned:
+        return True
+    try:
+        if entry.lease is None:
+            sandbox_id = _backend.sandbox_id(entry.sandbox)
+            lease = await _registry.claim(user_id, sandbox_id, entry.tunnel_url, CONTROLLER_ID)
+            if lease.owner != CONTROLLER_ID or lease.sandbox_id != sandbox_id:
+                return False
+        else:
+            lease = await _registry.renew(entry.lease)
+            if lease is None:
+                return False
+        entry.lease = lease
+    except Exception as e:
+        # Keep serving; the lease only lapses if renewals keep failing for LEASE_TTL
+        metrics.ERRORS.inc("sandbox_registry")
+        print(f"[sandbox_manager] Lease renewal failed: {e}")
+    return True
+
+
+async def _remote_status(tunnel_url: str) -> dict | None:
+    """The sandbox's /status (idle time, resource usage), or None if it doesn't answer."""
+    try:
+        resp = await _http_client(tunnel_url).get("/status", timeout=2.0)
+        return resp.json() if resp.status_code == 200 else None
+    except Exception:
+        return None
+
+
+async def _supervise_once():
+    """One supervisor pass over active sandboxes.
+
+    Renews the leases of owned sandboxes and gives up any that were fenced
+    off. Drops dead sandboxes, terminates idle ones just before Modal's idle
+    timeout would, rolls over sandboxes nearing their max lifetime, and
+    terminates retired sandboxes once their last request has finished.
+    Sandboxes routed to another controller's lease are only dropped from
+    the cache when idle here.
+    """
+    now = time.monotonic()
+    entries = list(_active_sandboxes.items())
+    polls, renewals = await asyncio.gather(
+        asyncio.gather(*(_poll(entry) for _, entry in entries), return_exceptions=True),
+        asyncio.gather(*(_renew(user_id, entry) for user_id, entry in entries)),
     )
-    print(f"[sandbox_manager] Sandbox created: {sb.object_id}")
+    for (user_id, entry), returncode, renewed in zip(entries, polls, renewals):
+        if _active_sandboxes.get(user_id) is not entry:
+            continue
+        idle = entry.in_use == 0 and now - entry.last_used > _REAP_IDLE_AFTER
+        if not entry.owned:
+            if idle:
+                await _drop_routed(user_id, entry)
+        elif not renewed:
+            print(f"[sandbox_manager] Lease for {user_id} was taken over, retiring sandbox")
+            _sandbox_stats["fenced"] += 1
+            del _active_sandboxes[user_id]
+            _retire(entry)
+        elif returncode is not None and not isinstance(returncode, Exception):
+            print(f"[sandbox_manager] Sandbox for {user_id} exited ({returncode}), dropping")
+            _sandbox_stats["reaped_dead"] += 1
+            await _record_usage(entry, returncode)
+            await _forget(user_id, entry.sandbox)
+        elif idle and await _idle_everywhere(entry):
+            print(f"[sandbox_manager] Sandbox for {user_id} idle, terminating")
+            _sandbox_stats["reaped_idle"] += 1
+            await _record_usage(entry)
+            await _forget(user_id, entry.sandbox)
+            await _terminate(entry.sandbox)
+        elif (
+            now - entry.created_at > SANDBOX_LIFETIME - _ROLLOVER_MARGIN
+            and user_id not in _rolling_over
+        ):
+            _rolling_over.add(user_id)
+            _spawn(_roll_over(user_id, entry))
+
+    # Controllers routing to a retired sandbox notice within one lease TTL
+    grace = LEASE_TTL if _registry.shared else 0.0
+    for entry in list(_retiring):
+        if entry.in_use == 0 and now - entry.retired_at >= grace:
+            _retiring.remove(entry)
+            await _record_usage(entry)
+            await _terminate(entry.sandbox, entry.tunnel_url)
+
+
+async def _idle_everywhere(entry: ActiveSandbox) -> bool:
+    """Whether an owned sandbox is idle for every controller, not just this one."""
+    if not _registry.shared:
+        return True
+    status = await _remote_status(entry.tunnel_url)
+    return status is None or float(status.get("idle_seconds", 0.0)) > _REAP_IDLE_AFTER
 
-    # Start the sandbox server inside (don't wait for it to complete)
-    print(f"[sandbox_manager] Starting sandbox_server.py")
-    run_cmd = getattr(sb, "exec")  # Modal Sandbox API method
 
-    # First check if the file exists
-    check_process = run_cmd("ls", "-la", "/code/")
-    print(f"[sandbox_manager] /code/ contents: {check_process.stdout.read()}")
+def _retire(entry: ActiveSandbox):
+    entry.retired_at = time.monotonic()
+    _retiring.append(entry)
 
-    # Start the server from the shared code volume
-    process = run_cmd("python", "/code/sandbox_server.py")
-    print(f"[sandbox_manager] Process started: {process}")
 
-    # Give it a moment to start and check for immediate errors
-    import time
-    time.sleep(2)
+async def _roll_over(user_id: str, old: ActiveSandbox):
+    """Replace a sandbox nearing its lifetime limit with a fresh one for the same user.
 
-    # Check if process has early output or errors
+    Turns are routed to the new sandbox straight away, but it holds them
+    until the old one has handed the workspace over (see _hand_over).
+    """
     try:
-        # Non-blocking read of any available output
-        if process.poll() is not None:
-            stdout = process.stdout.read()
-            stderr = process.stderr.read()
-            print(f"[sandbox_manager] Process exited early! returncode={process.poll()}")
-            print(f"[sandbox_manager] stdout: {stdout}")
-            print(f"[sandbox_manager] stderr: {stderr}")
+        print(f"[sandbox_manager] Rolling over sandbox for {user_id}")
+        size = await _choose_size(user_id, old)
+        if size != old.size:
+            print(f"[sandbox_manager] Resizing {user_id}: {old.size.name} -> {size.name}")
+        new = await _new_attached_sandbox(user_id, size, takeover=True)
+        if _active_sandboxes.get(user_id) is not old:
+            # Cleared or replaced while we were booting
+            await _terminate(new.sandbox, new.tunnel_url)
+            return
+        if old.lease is not None:
+            lease = await _registry.replace(
+                old.lease, _backend.sandbox_id(new.sandbox), new.tunnel_url
+            )
+            if lease is None:
+                # Fenced off; the next supervisor pass retires the old one
+                await _terminate(new.sandbox, new.tunnel_url)
+                return
+            new.lease = lease
+        new.last_used = old.last_used
+        _active_sandboxes[user_id] = new
+        _retire(old)
+        _sandbox_stats["rollovers"] += 1
+        if new.size != old.size:
+            _sandbox_stats["resized"] += 1
+        await _hand_over(user_id, old, new)
     except Exception as e:
-        print(f"[sandbox_manager] Could not read process output: {e}")
+        print(f"[sandbox_manager] Rollover failed for {user_id}: {e}")
+    finally:
+        _rolling_over.discard(user_id)
 
-    # Get tunnel URL for HTTP access
-    print(f"[sandbox_manager] Getting tunnel...")
-    tunnels = sb.tunnels()
-    print(f"[sandbox_manager] Available tunnels: {tunnels}")
-    tunnel = tunnels.get(8080)
-    if not tunnel:
-        raise Exception(f"No tunnel on port 8080. Available: {list(tunnels.keys())}")
-    tunnel_url = tunnel.url
-    print(f"[sandbox_manager] Tunnel URL: {tunnel_url}")
 
-    # Wait for server to be ready
-    await _wait_for_ready(tunnel_url)
+async def _hand_over(user_id: str, old: ActiveSandbox, new: ActiveSandbox):
+    """Move the user's workspace from ``old`` to its replacement, then let ``new`` start turns.
+
+    Both mount the same volume, but a sandbox only sees another's changes
+    once they are committed and it reloads. So ``old`` first finishes its
+    running turn and refuses later ones (controllers resend those to
+    ``new``), then its changes, the CLI's session included, are committed
+    and ``new`` reloads them.
+    """
+    old.in_use += 1  # Not terminated by the supervisor meanwhile
+    try:
+        resp = await _http_client(old.tunnel_url).post("/handover", timeout=_HANDOVER_TIMEOUT)
+        if resp.status_code != 200:
+            raise Exception(f"status={resp.status_code} payload={resp.text}")
+        await _backend.commit_workspace(old.sandbox)
+    except Exception as e:
+        metrics.ERRORS.inc("sandbox_handover")
+        print(f"[sandbox_manager] Handover from old sandbox for {user_id} failed: {e}")
+    finally:
+        old.in_use -= 1
+    try:
+        await _backend.reload_workspace(new.sandbox)
+    except Exception as e:
+        metrics.ERRORS.inc("sandbox_handover")
+        print(f"[sandbox_manager] Workspace reload for {user_id} failed: {e}")
+    try:
+        await _http_client(new.tunnel_url).post("/takeover", timeout=10.0)
+    except Exception as e:
+        # The sandbox starts turns on its own after a timeout
+        print(f"[sandbox_manager] Takeover for {user_id} failed: {e}")
+
+
+async def _supervise_forever():
+    while True:
+        await asyncio.sleep(_SUPERVISE_INTERVAL)
+        try:
+            await _supervise_once()
+        except Exception as e:
+            print(f"[sandbox_manager] Supervisor pass failed: {e}")
+
+
+def start_supervisor() -> asyncio.Task:
+    """Start the background liveness/idle/rollover supervisor."""
+    global _supervisor_task
+    if _supervisor_task is None or _supervisor_task.done():
+        _supervisor_task = asyncio.create_task(_supervise_forever())
+    return _supervisor_task
 
-    # Cache the sandbox
-    _active_sandboxes[user_id] = (sb, tunnel_url)
 
-    return sb, tunnel_url
+def sandbox_stats() -> dict[str, object]:
+    """Active sandbox counts (routed = leased by another controller), sizes and supervisor counters."""
+    by_size: dict[str, int] = {}
+    for entry in _active_sandboxes.values():
+        if entry.owned:
+            by_size[entry.size.name] = by_size.get(entry.size.name, 0) + 1
+    return {
+        "active": len(_active_sandboxes),
+        "routed": sum(1 for entry in _active_sandboxes.values() if not entry.owned),
+        "busy": sum(1 for entry in _active_sandboxes.values() if entry.in_use),
+        "retiring": len(_retiring),
+        "by_size": by_size,
+        **_sandbox_stats,
+    }
 
 
-async def _wait_for_ready(tunnel_url: str, timeout: float = 60.0):
-    """Wait for sandbox server to be ready."""
+async def _wait_for_ready(
+    tunnel_url: str,
+    process=None,
+    timeout: float = 60.0,
+    initial_delay: float = 0.05,
+    max_delay: float = 1.0,
+):
+    """Wait for sandbox server to be ready.
+
+    Probes with jittered exponential backoff, so a server that comes up
+    quickly is noticed within tens of milliseconds rather than a fixed 1s
+    tick. If the server ``process`` is given, fail fast with its output when
+    it exits early.
+    """
     print(f"[sandbox_manager] Waiting for sandbox to be ready at {tunnel_url}")
-    async with httpx.AsyncClient() as client:
-        start = asyncio.get_event_loop().time()
-        attempt = 0
-        last_error = None
-        while True:
-            attempt += 1
-            try:
-                resp = await client.get(f"{tunnel_url}/health", timeout=5.0)
-                print(f"[sandbox_manager] Health check attempt {attempt}: status={resp.status_code}")
-                if resp.status_code == 200:
-                    print(f"[sandbox_manager] Sandbox ready!")
-                    return
-            except Exception as e:
-                last_error = str(e)
-                if attempt % 5 == 0:  # Log every 5th attempt
-                    print(f"[sandbox_manager] Health check attempt {attempt} failed: {e}")
+    client = _http_client(tunnel_url)
+    start = asyncio.get_event_loop().time()
+    attempt = 0
+    last_error = None
+    delay = initial_delay
+    while True:
+        attempt += 1
+        try:
+            resp = await client.get("/health", timeout=5.0)
+            if resp.status_code == 200:
+                print(f"[sandbox_manager] Sandbox ready after {attempt} health checks")
+                return
+        except Exception as e:
+            last_error = str(e)
+            if attempt % 5 == 0:  # Log every 5th attempt
+                print(f"[sandbox_manager] Health check attempt {attempt} failed: {e}")
+
+        if process is not None:
+            returncode = await process.poll()
+            if returncode is not None:
+                stdout, stderr = await process.output()
+                raise Exception(
+                    f"Sandbox server exited early! returncode={returncode} "
+                    f"stdout={stdout!r} stderr={stderr!r}"
+                )
+
+        elapsed = asyncio.get_event_loop().time() - start
+        if elapsed > timeout:
+            raise TimeoutError(f"Sandbox server did not start in {timeout}s. Last error: {last_error}")
+
+        await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        delay = min(delay * 2, max_delay)
 
-            elapsed = asyncio.get_event_loop().time() - start
-            if elapsed > timeout:
-                raise TimeoutError(f"Sandbox server did not start in {timeout}s. Last error: {last_error}")
 
-            await asyncio.sleep(1.0)
+async def _cancel_remote_turn(tunnel_url: str, turn_id: str):
+    """Ask the sandbox to interrupt (or skip) a turn nobody is waiting for anymore."""
+    try:
+        await _http_client(tunnel_url).post("/cancel", json={"turn_id": turn_id}, timeout=5.0)
+    except Exception as e:
+        print(f"[sandbox_manager] Cancelling turn {turn_id} failed: {e}")
+
+
+def _trace_headers() -> dict[str, str]:
+    """traceparent header for the current request's trace, if any."""
+    trace = tracing.current()
+    return {"traceparent": trace.traceparent()} if trace is not None else {}
+
+
+def _is_handed_over(resp: "httpx.Response") -> bool:
+    if resp.status_code != 409:
+        return False
+    try:
+        return resp.json().get("handed_over") is True
+    except Exception:
+        return False
 
 
 async def send_message(user_id: str, message: str) -> tuple[str, str, list[dict[str, object]]]:
     """Send a message to the user's sandbox and get response."""
-    sb, tunnel_url = await get_or_create_sandbox(user_id)
+    try:
+        return await _send_message(user_id, message)
+    except _HandedOver:
+        # Refused by a sandbox being rolled over; its replacement takes it
+        return await _send_message(user_id, message)
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{tunnel_url}/chat",
-            json={"message": message},
-            timeout=120.0,  # 2 min timeout for Claude responses
+
+async def _send_message(user_id: str, message: str) -> tuple[str, str, list[dict[str, object]]]:
+    trace = tracing.current()
+    turn_id = secrets.token_hex(8)
+    async with _using_sandbox(user_id) as tunnel_url:
+        sent_at = time.perf_counter()
+        try:
+            with metrics.SANDBOX_REQUEST.time("/chat"), tracing.span("sandbox_request"):
+                resp = await _http_client(tunnel_url).post(
+                    "/chat",
+                    json={"message": message, "turn_id": turn_id},
+                    headers={**_trace_headers(), **framing.request_headers()},
+                    timeout=120.0,  # 2 min timeout for Claude responses
+                )
+        except asyncio.CancelledError:
+            _spawn(_cancel_remote_turn(tunnel_url, turn_id))
+            raise
+        if _is_handed_over(resp):
+            raise _HandedOver(resp.text)
+    if resp.status_code != 200:
+        metrics.ERRORS.inc("sandbox_http")
+        # Surface sandbox errors directly for debugging
+        try:
+            error_payload = resp.json()
+        except Exception:
+            error_payload = {"error": resp.text}
+        raise Exception(
+            f"Sandbox error status={resp.status_code} payload={error_payload}"
         )
-        if resp.status_code != 200:
-            # Surface sandbox errors directly for debugging
-            try:
-                error_payload = resp.json()
-            except Exception:
-                error_payload = {"error": resp.text}
-            raise Exception(
-                f"Sandbox error status={resp.status_code} payload={error_payload}"
-            )
 
-        data = resp.json()
+    data = framing.decode(resp.content)[0] if framing.is_framed(resp.headers) else resp.json()
+    _observe_remote(data.get("timings"))
+    if trace is not None:
+        trace.add_remote(data.get("timings"), sent_at)
+    _note_usage(user_id, data.get("usage"))
+
+    if "error" in data:
+        raise Exception(data["error"])
+
+    return data.get("content", ""), data.get("session_id", ""), data.get("tool_events", [])
+
+
+def _observe_remote(timings: list[dict] | None):
+    """Record the sandbox's own stage timings in the controller's histograms."""
+    for stage in timings or ():
+        if stage.get("name") == "first_message":
+            metrics.SDK_FIRST_MESSAGE.observe(stage["duration_ms"] / 1000)
+
+
+async def _iter_sse(resp: "httpx.Response") -> AsyncIterator[dict[str, object]]:
+    """Parse server-sent events from a streaming response."""
+    data_lines: list[str] = []
+    async for line in resp.aiter_lines():
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+        elif not line and data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
+
+
+async def stream_message(user_id: str, message: str) -> AsyncIterator[dict[str, object]]:
+    """Send a message to the user's sandbox and relay events as they arrive.
+
+    Yields the same events as ``sessions.stream_response``: ``text`` deltas,
+    ``tool_use``/``tool_result`` events and a final ``done`` event.
+    """
+    for attempt in range(2):
+        try:
+            async with aclosing(_stream_message(user_id, message)) as events:
+                async for event in events:
+                    yield event
+            return
+        except _HandedOver:
+            # Refused (before any event) by a sandbox being rolled over; its
+            # replacement takes it
+            if attempt:
+                raise
+
+
+async def _stream_message(user_id: str, message: str) -> AsyncIterator[dict[str, object]]:
+    trace = tracing.current()
+    turn_id = secrets.token_hex(8)
+    async with _using_sandbox(user_id) as tunnel_url:
+        sent_at = time.perf_counter()
+        try:
+            async with _http_client(tunnel_url).stream(
+                "POST",
+                "/chat/stream",
+                json={"message": message, "turn_id": turn_id},
+                headers={**_trace_headers(), **framing.request_headers()},
+                timeout=120.0,  # Max gap between events, not the whole turn
+            ) as resp:
+                metrics.SANDBOX_REQUEST.observe(time.perf_counter() - sent_at, "/chat/stream")
+                if trace is not None:
+                    trace.record("sandbox_request", sent_at)
+                if resp.status_code != 200:
+                    metrics.ERRORS.inc("sandbox_http")
+                    await resp.aread()
+                    raise Exception(
+                        f"Sandbox error status={resp.status_code} payload={resp.text}"
+                    )
+
+                if framing.is_framed(resp.headers):
+                    events = framing.iter_frames(resp.aiter_bytes())
+                else:
+                    events = _iter_sse(resp)
+                async for event in events:
+                    if event.get("type") == "error":
+                        if event.get("handed_over"):
+                            raise _HandedOver(event.get("error"))
+                        raise Exception(event.get("error"))
+                    if event.get("type") == "done":
+                        timings = event.pop("timings", None)
+                        _observe_remote(timings)
+                        if trace is not None:
+                            trace.add_remote(timings, sent_at)
+                        _note_usage(user_id, event.pop("usage", None))
+                    yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            # Our caller went away; free the sandbox's client for the next turn
+            _spawn(_cancel_remote_turn(tunnel_url, turn_id))
+            raise
 
-        if "error" in data:
-            raise Exception(data["error"])
 
-        return data.get("content", ""), data.get("session_id", ""), data.get("tool_events", [])
+async def _running_tunnel(user_id: str) -> str | None:
+    """Tunnel URL of the user's running sandbox, ours or leased elsewhere; never boots one."""
+    entry = _active_sandboxes.get(user_id)
+    if entry is not None:
+        return entry.tunnel_url
+    # The user's sandbox may be leased by another controller
+    try:
+        lease = await _registry.get(user_id)
+    except Exception:
+        return None
+    return lease.tunnel_url if lease is not None else None
 
 
 async def clear_session(user_id: str) -> bool:
     """Clear session for a user. Optionally terminate sandbox."""
-    if user_id not in _active_sandboxes:
+    tunnel_url = await _running_tunnel(user_id)
+    if tunnel_url is None:
         return False
 
-    sb, tunnel_url = _active_sandboxes[user_id]
-
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(f"{tunnel_url}/clear", timeout=10.0)
+        await _http_client(tunnel_url).post("/clear", timeout=10.0)
     except:
         pass
 
     return True
 
 
-async def terminate_sandbox(user_id: str) -> bool:
-    """Terminate a user's sandbox completely."""
-    if user_id not in _active_sandboxes:
-        return False
+async def fetch_blob(user_id: str, blob_id: str) -> bytes | None:
+    """A tool result blob the user's sandbox offloaded, or None if it can't be had.
 
-    sb, _ = _active_sandboxes[user_id]
+    Only asks a sandbox that is already running: booting one to look up a
+    blob id would let anyone start sandboxes.
+    """
+    tunnel_url = await _running_tunnel(user_id)
+    if tunnel_url is None:
+        return None
+    with metrics.SANDBOX_REQUEST.time("/blobs"):
+        resp = await _http_client(tunnel_url).get(f"/blobs/{blob_id}", timeout=60.0)
+    if resp.status_code != 200:
+        return None
+    return resp.content
 
-    try:
-        sb.terminate()
-    except:
-        pass
+
+async def delete_blobs(user_id: str):
+    """Delete the blobs in the user's workspace, if their sandbox is running.
+
+    Otherwise the sandbox prunes old blobs when it next attaches.
+    """
+    tunnel_url = await _running_tunnel(user_id)
+    if tunnel_url is not None:
+        await _http_client(tunnel_url).delete("/blobs", timeout=10.0)
+
+
+async def terminate_sandbox(user_id: str) -> bool:
+    """Terminate a user's sandbox completely (only if this controller owns it)."""
+    entry = _active_sandboxes.get(user_id)
+    if entry is None or not entry.owned:
+        return False
 
     del _active_sandboxes[user_id]
+    await _record_usage(entry)
+    await _release(entry)
+    await _terminate(entry.sandbox, entry.tunnel_url)
     return True
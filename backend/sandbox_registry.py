@@ -0,0 +1,414 @@
+"""Shared registry of which sandbox serves which user.
+
+With more than one controller process (uvicorn workers, Modal containers),
+a user's requests land on different processes. The registry lets any of
+them find the user's existing sandbox instead of booting a duplicate.
+
+Each entry is a lease: the controller that booted the sandbox owns it,
+renews it from its supervisor and is the only one allowed to reap, roll
+over or terminate it. Other controllers route requests to the leased
+tunnel URL. A lease that isn't renewed within its TTL (its owner died or
+stalled) can be claimed by another controller.
+
+Every claim bumps the user's fencing token, and renew/replace/release only
+succeed while the caller's token is still current. A controller that
+stalled past its lease therefore can't clobber the new owner's entry; its
+renew fails and it gives its sandbox up.
+
+The registry also keeps each user's recent sandbox usage samples (see
+sandbox_sizing), so whichever controller boots the user's next sandbox can
+size it, and restarts don't forget them.
+
+Implementations: MemoryRegistry (one process), SQLiteRegistry (processes
+on one host, e.g. uvicorn workers) and ModalDictRegistry (Modal
+containers).
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Optional, Protocol
+
+LEASE_TTL = float(os.environ.get("SANDBOX_LEASE_TTL", "60"))
+
+# Usage samples kept per user
+USAGE_HISTORY = 20
+
+
+@dataclass(frozen=True)
+class Lease:
+    """A controller's claim on the sandbox serving ``user_id``."""
+    user_id: str
+    sandbox_id: str
+    tunnel_url: str
+    owner: str  # controller id
+    token: int  # fencing token; increases with every claim or replacement
+    expires_at: float  # time.time()
+
+    @property
+    def live(self) -> bool:
+        return self.expires_at > time.time()
+
+
+class SandboxRegistry(Protocol):
+    # True if other processes can see the entries (so they may be routing to our sandboxes)
+    shared: bool
+
+    async def get(self, user_id: str) -> Lease | None:
+        """The user's live lease, if any."""
+
+    async def claim(
+        self, user_id: str, sandbox_id: str, tunnel_url: str, owner: str, ttl: float = LEASE_TTL
+    ) -> Lease:
+        """Lease a sandbox for the user unless a live lease exists.
+
+        Returns the winning lease: the new one, or the live one that beat us.
+        """
+
+    async def renew(self, lease: Lease, ttl: float = LEASE_TTL) -> Lease | None:
+        """Extend ``lease``. Returns None if it was fenced off by a newer one."""
+
+    async def replace(
+        self, lease: Lease, sandbox_id: str, tunnel_url: str, ttl: float = LEASE_TTL
+    ) -> Lease | None:
+        """Point the owner's lease at a new sandbox (a rollover). None if fenced off."""
+
+    async def release(self, lease: Lease) -> bool:
+        """Drop ``lease`` if it is still current."""
+
+    async def usage_history(self, user_id: str) -> list[dict]:
+        """The user's recent sandbox usage samples (UsageSample fields), oldest first."""
+
+    async def add_usage(self, user_id: str, sample: dict, keep: int = USAGE_HISTORY):
+        """Append a usage sample, keeping only the user's ``keep`` most recent."""
+
+
+def _new_lease(
+    current: Lease | None, user_id: str, sandbox_id: str, tunnel_url: str, owner: str, ttl: float
+) -> Lease:
+    return Lease(
+        user_id=user_id,
+        sandbox_id=sandbox_id,
+        tunnel_url=tunnel_url,
+        owner=owner,
+        token=(current.token if current else 0) + 1,
+        expires_at=time.time() + ttl,
+    )
+
+
+def _is_current(current: Lease | None, lease: Lease) -> bool:
+    return current is not None and current.token == lease.token and current.owner == lease.owner
+
+
+class MemoryRegistry:
+    """In-process registry: the default, and enough for a single controller.
+
+    Leases live in memory; usage samples go to the controller's store so a
+    restart keeps them.
+    """
+
+    shared = False
+
+    def __init__(self):
+        # Released leases stay (expired) so tokens keep increasing
+        self._leases: dict[str, Lease] = {}
+
+    async def get(self, user_id: str) -> Lease | None:
+        lease = self._leases.get(user_id)
+        return lease if lease is not None and lease.live else None
+
+    async def claim(
+        self, user_id: str, sandbox_id: str, tunnel_url: str, owner: str, ttl: float = LEASE_TTL
+    ) -> Lease:
+        current = self._leases.get(user_id)
+        if current is not None and current.live:
+            return current
+        lease = _new_lease(current, user_id, sandbox_id, tunnel_url, owner, ttl)
+        self._leases[user_id] = lease
+        return lease
+
+    async def renew(self, lease: Lease, ttl: float = LEASE_TTL) -> Lease | None:
+        if not _is_current(self._leases.get(lease.user_id), lease):
+            return None
+        renewed = replace(lease, expires_at=time.time() + ttl)
+        self._leases[lease.user_id] = renewed
+        return renewed
+
+    async def replace(
+        self, lease: Lease, sandbox_id: str, tunnel_url: str, ttl: float = LEASE_TTL
+    ) -> Lease | None:
+        if not _is_current(self._leases.get(lease.user_id), lease):
+            return None
+        new = _new_lease(lease, lease.user_id, sandbox_id, tunnel_url, lease.owner, ttl)
+        self._leases[lease.user_id] = new
+        return new
+
+    async def release(self, lease: Lease) -> bool:
+        if not _is_current(self._leases.get(lease.user_id), lease):
+            return False
+        self._leases[lease.user_id] = replace(lease, expires_at=0.0)
+        return True
+
+    async def usage_history(self, user_id: str) -> list[dict]:
+        import store
+
+        return await asyncio.to_thread(store.usage_samples, user_id, USAGE_HISTORY)
+
+    async def add_usage(self, user_id: str, sample: dict, keep: int = USAGE_HISTORY):
+        import store
+
+        await asyncio.to_thread(store.add_usage_sample, user_id, sample, keep)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sandbox_leases (
+    user_id TEXT PRIMARY KEY,
+    sandbox_id TEXT NOT NULL,
+    tunnel_url TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    token INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sandbox_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    sample TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sandbox_usage_user_id ON sandbox_usage (user_id, id);
+"""
+
+
+class SQLiteRegistry:
+    """Registry in a SQLite table, shared by every process on the host.
+
+    Each operation is one short ``BEGIN IMMEDIATE`` transaction, so the
+    read-check-write of a claim or renewal is atomic across processes. Calls
+    run in a worker thread to keep the event loop free.
+    """
+
+    shared = True
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode, so BEGIN IMMEDIATE below controls the transaction
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SQLITE_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _read(self, conn: sqlite3.Connection, user_id: str) -> Lease | None:
+        row = conn.execute(
+            "SELECT user_id, sandbox_id, tunnel_url, owner, token, expires_at"
+            " FROM sandbox_leases WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        return Lease(*row) if row else None
+
+    def _write(self, conn: sqlite3.Connection, lease: Lease):
+        conn.execute(
+            "INSERT OR REPLACE INTO sandbox_leases"
+            " (user_id, sandbox_id, tunnel_url, owner, token, expires_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (lease.user_id, lease.sandbox_id, lease.tunnel_url, lease.owner, lease.token,
+             lease.expires_at),
+        )
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _claim(self, user_id, sandbox_id, tunnel_url, owner, ttl) -> Lease:
+        def claim(conn):
+            current = self._read(conn, user_id)
+            if current is not None and current.live:
+                return current
+            lease = _new_lease(current, user_id, sandbox_id, tunnel_url, owner, ttl)
+            self._write(conn, lease)
+            return lease
+        return self._transaction(claim)
+
+    def _update(self, lease: Lease, make) -> Lease | None:
+        def update(conn):
+            if not _is_current(self._read(conn, lease.user_id), lease):
+                return None
+            new = make()
+            self._write(conn, new)
+            return new
+        return self._transaction(update)
+
+    async def get(self, user_id: str) -> Lease | None:
+        lease = await asyncio.to_thread(lambda: self._read(self._conn(), user_id))
+        return lease if lease is not None and lease.live else None
+
+    async def claim(
+        self, user_id: str, sandbox_id: str, tunnel_url: str, owner: str, ttl: float = LEASE_TTL
+    ) -> Lease:
+        return await asyncio.to_thread(self._claim, user_id, sandbox_id, tunnel_url, owner, ttl)
+
+    async def renew(self, lease: Lease, ttl: float = LEASE_TTL) -> Lease | None:
+        return await asyncio.to_thread(
+            self._update, lease, lambda: replace(lease, expires_at=time.time() + ttl)
+        )
+
+    async def replace(
+        self, lease: Lease, sandbox_id: str, tunnel_url: str, ttl: float = LEASE_TTL
+    ) -> Lease | None:
+        return await asyncio.to_thread(
+            self._update,
+            lease,
+            lambda: _new_lease(lease, lease.user_id, sandbox_id, tunnel_url, lease.owner, ttl),
+        )
+
+    async def release(self, lease: Lease) -> bool:
+        released = await asyncio.to_thread(
+            self._update, lease, lambda: replace(lease, expires_at=0.0)
+        )
+        return released is not None
+
+    def _usage_history(self, user_id: str) -> list[dict]:
+        rows = self._conn().execute(
+            "SELECT sample FROM sandbox_usage WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, USAGE_HISTORY),
+        ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def _add_usage(self, user_id: str, sample: dict, keep: int):
+        def add(conn):
+            conn.execute(
+                "INSERT INTO sandbox_usage (user_id, sample) VALUES (?, ?)",
+                (user_id, json.dumps(sample)),
+            )
+            conn.execute(
+                "DELETE FROM sandbox_usage WHERE user_id = ? AND id NOT IN"
+                " (SELECT id FROM sandbox_usage WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, keep),
+            )
+        self._transaction(add)
+
+    async def usage_history(self, user_id: str) -> list[dict]:
+        return await asyncio.to_thread(self._usage_history, user_id)
+
+    async def add_usage(self, user_id: str, sample: dict, keep: int = USAGE_HISTORY):
+        await asyncio.to_thread(self._add_usage, user_id, sample, keep)
+
+
+class ModalDictRegistry:
+    """Registry in a ``modal.Dict``, shared by every controller container.
+
+    modal.Dict has no compare-and-swap, so writes are read-check-write
+    followed by a read-back: a controller only acts on a claim once the
+    read-back shows its own token. Two claims racing inside that window can
+    both read back the later write; the loser sees it and routes to the
+    winner. Expired leases are left in place so tokens keep increasing.
+    """
+
+    shared = True
+
+    def __init__(self, name: str = "monios-sandbox-leases"):
+        self.name = name
+        self._dict = None
+        self._usage_dict = None
+
+    def _store(self):
+        if self._dict is None:
+            import modal
+
+            self._dict = modal.Dict.from_name(self.name, create_if_missing=True)
+        return self._dict
+
+    def _usage(self):
+        # A separate dict, so a user id can never collide with a lease key
+        if self._usage_dict is None:
+            import modal
+
+            self._usage_dict = modal.Dict.from_name(f"{self.name}-usage", create_if_missing=True)
+        return self._usage_dict
+
+    async def _read(self, user_id: str) -> Lease | None:
+        data = await self._store().get.aio(user_id)
+        return Lease(**data) if data else None
+
+    async def _write(self, lease: Lease) -> Lease | None:
+        await self._store().put.aio(lease.user_id, asdict(lease))
+        current = await self._read(lease.user_id)
+        return lease if _is_current(current, lease) else None
+
+    async def get(self, user_id: str) -> Lease | None:
+        lease = await self._read(user_id)
+        return lease if lease is not None and lease.live else None
+
+    async def claim(
+        self, user_id: str, sandbox_id: str, tunnel_url: str, owner: str, ttl: float = LEASE_TTL
+    ) -> Lease:
+        current = await self._read(user_id)
+        if current is not None and current.live:
+            return current
+        lease = _new_lease(current, user_id, sandbox_id, tunnel_url, owner, ttl)
+        if await self._write(lease) is not None:
+            return lease
+        return await self._read(user_id) or lease
+
+    async def renew(self, lease: Lease, ttl: float = LEASE_TTL) -> Lease | None:
+        if not _is_current(await self._read(lease.user_id), lease):
+            return None
+        return await self._write(replace(lease, expires_at=time.time() + ttl))
+
+    async def replace(
+        self, lease: Lease, sandbox_id: str, tunnel_url: str, ttl: float = LEASE_TTL
+    ) -> Lease | None:
+        if not _is_current(await self._read(lease.user_id), lease):
+            return None
+        return await self._write(
+            _new_lease(lease, lease.user_id, sandbox_id, tunnel_url, lease.owner, ttl)
+        )
+
+    async def release(self, lease: Lease) -> bool:
+        if not _is_current(await self._read(lease.user_id), lease):
+            return False
+        await self._store().put.aio(lease.user_id, asdict(replace(lease, expires_at=0.0)))
+        return True
+
+    async def usage_history(self, user_id: str) -> list[dict]:
+        return list(await self._usage().get.aio(user_id) or [])
+
+    async def add_usage(self, user_id: str, sample: dict, keep: int = USAGE_HISTORY):
+        # Read-modify-write: two controllers recording at once may lose a sample,
+        # which only makes the next sizing decision use one fewer
+        history = await self.usage_history(user_id)
+        history.append(sample)
+        await self._usage().put.aio(user_id, history[-keep:])
+
+
+def from_env() -> Optional[SandboxRegistry]:
+    """Registry named by SANDBOX_REGISTRY: ``memory``, ``sqlite[:path]`` or ``modal[:name]``."""
+    spec = os.environ.get("SANDBOX_REGISTRY")
+    if not spec:
+        return None
+    kind, _, arg = spec.partition(":")
+    if kind == "memory":
+        return MemoryRegistry()
+    if kind == "sqlite":
+        import store
+
+        return SQLiteRegistry(arg or store.DB_PATH)
+    if kind == "modal":
+        return ModalDictRegistry(arg or "monios-sandbox-leases")
+    raise ValueError(f"Unknown SANDBOX_REGISTRY: {spec!r}")
@@ -1,34 +1,211 @@
 """Small HTTP server that runs inside each user's sandbox.
 
 This handles Claude SDK interactions within the isolated sandbox environment.
+The server and the Claude SDK client share one asyncio event loop, so health,
+status and clear requests are served while a chat turn is in flight.
 """
 
 import json
 import asyncio
+import hashlib
 import traceback
 import os
+import re
+import shutil
+import struct
+import time
 from collections import deque
 from pathlib import Path
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import AsyncIterator
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
 from claude_agent_sdk import (
     ClaudeSDKClient,
     ClaudeAgentOptions,
     AssistantMessage,
     TextBlock,
     SystemMessage,
+    StreamEvent,
     ToolUseBlock,
     ToolResultBlock,
+    UserMessage,
 )
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 SYSTEM_PROMPT = "You are a helpful assistant in a terminal-aesthetic chat app called Monios. Keep responses concise and friendly."
 
 # Single client per sandbox (one user per sandbox)
 _client: ClaudeSDKClient | None = None
 _session_id: str | None = None
 _stderr_lines: deque[str] = deque(maxlen=200)
-_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(_loop)
-_SESSION_FILE = Path("/workspace/.session_id")
+
+# The SDK client handles one turn at a time; concurrent chats queue here
+_chat_lock = asyncio.Lock()
+
+# Turn currently using the client, and turns cancelled before they got the lock
+_current_turn: str | None = None
+_cancelled_turns: deque[str] = deque(maxlen=64)
+
+# An abandoned turn being interrupted and drained; the next turn waits for it
+_drain_task: asyncio.Task | None = None
+_disconnecting: set[asyncio.Task] = set()  # Held so the loop doesn't drop them mid-run
+DRAIN_TIMEOUT = 30.0
+
+# When the last turn ended; controllers sharing this sandbox judge idleness by it
+_last_activity = time.monotonic()
+
+# Rollovers: a replacement sandbox attached with takeover holds its turns
+# until the controller calls /takeover, once its predecessor has handed the
+# workspace over (/handover) and the volume has been reloaded. A sandbox
+# that has handed over refuses turns, so controllers retry them elsewhere.
+_taken_over = asyncio.Event()
+_taken_over.set()
+_handed_over = False
+TAKEOVER_TIMEOUT = float(os.environ.get("SANDBOX_TAKEOVER_TIMEOUT", "300"))
+
+# Resource usage since boot, reported as ``usage`` so the controller can size
+# the user's next sandbox. Peak RSS is sampled while turns run.
+_booted_at = time.monotonic()
+_usage: dict[str, float] = {
+    "peak_rss_mb": 0.0, "busy_seconds": 0.0, "turns": 0, "tool_calls": 0, "oom_kills": 0,
+}
+USAGE_SAMPLE_INTERVAL = 1.0
+
+# The sandbox's own workspace mount, which only ever holds one user's files.
+# Sandboxes boot unattached; /attach binds them to that user.
+_WORKSPACE = Path(os.environ.get("WORKSPACE", "/workspace"))
+_workspace: Path | None = None
+_user_id: str | None = None
+
+# Tool results larger than this are stored in the workspace by content hash
+# and sent as a preview plus a reference; the controller fetches them from
+# /blobs on demand (see the controller's blobs.py)
+TOOL_RESULT_INLINE_MAX = int(os.environ.get("TOOL_RESULT_INLINE_MAX", "16384"))
+_PREVIEW_CHARS = 2048
+_BLOB_ID = re.compile(r"^[0-9a-f]{64}\.(txt|json)$")
+# Pruned on attach; DELETE /blobs (clearing the history) removes them all
+BLOB_MAX_AGE = float(os.environ.get("TOOL_RESULT_BLOB_MAX_AGE", str(7 * 24 * 3600)))
+BLOB_MAX_BYTES = int(os.environ.get("TOOL_RESULT_BLOB_WORKSPACE_MAX_BYTES", str(256 * 1024**2)))
+
+
+class _StageTimer:
+    """Stage timings for one request, in ms from when it arrived.
+
+    Returned to the controller (``timings`` in /chat and the ``done`` event)
+    so it can merge them into the request's trace.
+    """
+
+    def __init__(self, traceparent: str | None = None):
+        self.start = time.perf_counter()
+        self.traceparent = traceparent
+        self.stages: list[dict[str, object]] = []
+
+    def record(self, name: str, started: float, **attrs: object) -> None:
+        self.stages.append({
+            "name": name,
+            "start_ms": round((started - self.start) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            **attrs,
+        })
+
+    def log(self) -> None:
+        """Print the timings if the controller sampled this trace."""
+        parts = (self.traceparent or "").split("-")
+        try:
+            sampled = len(parts) == 4 and int(parts[3], 16) & 1
+        except ValueError:
+            sampled = False
+        if sampled:
+            print(json.dumps({
+                "event": "sandbox_turn",
+                "trace_id": parts[1],
+                "parent_span_id": parts[2],
+                "stages": self.stages,
+            }))
+
+
+def _process_tree_usage() -> tuple[float, float] | None:
+    """(RSS in MB, CPU seconds) of this server and its descendants, Linux only.
+
+    CPU includes reaped children (cutime/cstime), so a Claude CLI that has
+    exited still counts.
+    """
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    children: dict[int, list[int]] = {}
+    stats: dict[int, tuple[int, int]] = {}  # pid -> (rss pages, cpu ticks)
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # Fields after the ")" of the command name start at field 3 (state)
+            fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+            ppid, rss = int(fields[1]), int(fields[21])
+            ticks = sum(int(f) for f in fields[11:15])  # utime, stime, cutime, cstime
+        except (OSError, ValueError, IndexError):
+            continue
+        pid = int(entry.name)
+        children.setdefault(ppid, []).append(pid)
+        stats[pid] = (rss, ticks)
+    rss_pages = ticks = 0
+    stack = [os.getpid()]
+    while stack:
+        pid = stack.pop()
+        pid_rss, pid_ticks = stats.get(pid, (0, 0))
+        rss_pages += pid_rss
+        ticks += pid_ticks
+        stack.extend(children.get(pid, []))
+    return rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _usage_report() -> dict[str, float]:
+    usage = _process_tree_usage()
+    rss_mb, cpu_seconds = usage if usage else (0.0, 0.0)
+    _usage["peak_rss_mb"] = max(_usage["peak_rss_mb"], rss_mb)
+    return {
+        **_usage,
+        "rss_mb": round(rss_mb, 1),
+        "peak_rss_mb": round(_usage["peak_rss_mb"], 1),
+        "cpu_seconds": round(cpu_seconds, 2),
+        "busy_seconds": round(_usage["busy_seconds"], 2),
+        "uptime_seconds": round(time.monotonic() - _booted_at, 1),
+    }
+
+
+async def _sample_usage_forever() -> None:
+    while True:
+        await asyncio.sleep(USAGE_SAMPLE_INTERVAL)
+        if _chat_lock.locked():
+            usage = _process_tree_usage()
+            if usage:
+                _usage["peak_rss_mb"] = max(_usage["peak_rss_mb"], usage[0])
+
+
+_sampler_task: asyncio.Task | None = None
+
+
+async def _start_usage_sampler() -> None:
+    global _sampler_task
+    _sampler_task = asyncio.create_task(_sample_usage_forever())
+
+
+def _killed(e: BaseException) -> bool:
+    """Whether the Claude CLI died from SIGKILL, which in a sandbox means the OOM killer."""
+    return getattr(e, "exit_code", None) in (137, -9)
 
 
 def _on_stderr(line: str) -> None:
@@ -43,31 +220,88 @@ def _missing_api_key() -> bool:
     )
 
 
+def _session_file() -> Path:
+    return _workspace / ".session_id"
+
+
 def _load_session_id() -> str | None:
     try:
-        return _SESSION_FILE.read_text().strip() or None
+        return _session_file().read_text().strip() or None
     except OSError:
         return None
 
 
 def _save_session_id(session_id: str) -> None:
     try:
-        _SESSION_FILE.write_text(session_id)
+        _session_file().write_text(session_id)
     except OSError:
         pass
 
 
 def _clear_session_id() -> None:
     try:
-        _SESSION_FILE.unlink(missing_ok=True)
+        _session_file().unlink(missing_ok=True)
     except OSError:
         pass
 
 
+def attach(user_id: str, takeover: bool = False) -> Path:
+    """Bind this sandbox to the user whose workspace it mounts, for its lifetime.
+
+    With ``takeover``, turns wait until /takeover says the workspace is current.
+    """
+    global _workspace, _user_id
+    if not user_id:
+        raise ValueError("Missing user id")
+    if _user_id is not None:
+        if _user_id != user_id:
+            raise ValueError("Sandbox is already attached to another user")
+        return _workspace
+    workspace = _WORKSPACE
+    workspace.mkdir(parents=True, exist_ok=True)
+    _workspace = workspace
+    _user_id = user_id
+    if takeover:
+        _taken_over.clear()
+    return workspace
+
+
+async def handover():
+    """Hand the workspace over to a replacement sandbox.
+
+    Lets the running turn (and any drain) finish, closes the client so the
+    CLI has written out the session, and flushes the workspace to disk.
+    Turns that get the lock from now on are refused.
+    """
+    global _client, _handed_over
+    _handed_over = True
+    async with _chat_lock:
+        if _drain_task is not None and not _drain_task.done():
+            await asyncio.shield(_drain_task)
+        if _client is not None:
+            try:
+                await _client.disconnect()
+            except Exception:
+                pass
+            _client = None
+    await asyncio.to_thread(os.sync)
+
+
+async def _await_takeover():
+    try:
+        await asyncio.wait_for(_taken_over.wait(), TAKEOVER_TIMEOUT)
+    except asyncio.TimeoutError:
+        # The controller went away mid-rollover; serve rather than hang
+        print("Takeover timed out, starting turns anyway")
+        _taken_over.set()
+
+
 async def get_client() -> ClaudeSDKClient:
     """Get or create the Claude SDK client."""
     global _client, _session_id
     if _client is None:
+        if _workspace is None:
+            raise RuntimeError("Sandbox is not attached to a workspace")
         if _missing_api_key():
             raise RuntimeError(
                 "Missing API key. Set ANTHROPIC_API_KEY (or CLAUDE_API_KEY) in monios-secrets."
@@ -79,146 +313,526 @@ async def get_client() -> ClaudeSDKClient:
             allowed_tools=[],
             permission_mode="bypassPermissions",
             max_turns=10,
-            cwd="/workspace",  # User's isolated workspace
+            cwd=str(_workspace),  # User's isolated workspace
+            env={"HOME": str(_workspace)},  # Keep Claude's session files with the workspace
             resume=_session_id,
             extra_args={"debug-to-stderr": None},
             stderr=_on_stderr,
+            include_partial_messages=True,  # Token-level text deltas for streaming
         )
         _client = ClaudeSDKClient(options=options)
         await _client.connect()
     return _client
 
 
-async def chat(message: str) -> tuple[str, str, list[dict[str, object]]]:
-    """Send message and get response."""
-    global _session_id
-    client = await get_client()
+def _text_delta(msg: StreamEvent) -> str | None:
+    """Extract a top-level text delta from a partial stream event."""
+    if msg.parent_tool_use_id is not None:
+        return None
+    event = msg.event
+    if event.get("type") != "content_block_delta":
+        return None
+    delta = event.get("delta", {})
+    if delta.get("type") != "text_delta":
+        return None
+    return delta.get("text") or None
+
+
+def _tool_event(block: object) -> dict[str, object] | None:
+    """Convert a tool content block into a tool event dict."""
+    if isinstance(block, ToolUseBlock):
+        return {
+            "type": "tool_use",
+            "name": block.name,
+            "input": block.input,
+            "tool_use_id": block.id,
+        }
+    if isinstance(block, ToolResultBlock):
+        return {
+            "type": "tool_result",
+            "tool_use_id": block.tool_use_id,
+            "content": block.content,
+            "is_error": block.is_error,
+        }
+    return None
+
+
+def _blob_dir() -> Path:
+    return _workspace / ".blobs"
+
+
+def _store_blob(data: bytes, ext: str) -> str:
+    blob_id = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+    target = _blob_dir() / blob_id
+    if target.exists():
+        os.utime(target)  # Recent again as far as pruning goes
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".tmp-{blob_id}")
+        tmp.write_bytes(data)
+        tmp.replace(target)
+    return blob_id
+
 
-    if _session_id:
-        await client.query(prompt=message, session_id=_session_id)
+def _prune_blobs() -> int:
+    """Delete blobs older than BLOB_MAX_AGE, then the oldest until the rest fit in BLOB_MAX_BYTES."""
+    files = []
+    for file in _blob_dir().glob("*"):
+        try:
+            stat = file.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, file))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    cutoff = time.time() - BLOB_MAX_AGE
+    deleted = 0
+    for mtime, size, file in files:
+        if mtime >= cutoff and total <= BLOB_MAX_BYTES:
+            break
+        file.unlink(missing_ok=True)
+        total -= size
+        deleted += 1
+    return deleted
+
+
+async def _offload(event: dict[str, object]) -> dict[str, object]:
+    """Swap a large tool result's content for a preview and a blob reference."""
+    content = event.get("content")
+    if content is None or _workspace is None:
+        return event
+    if isinstance(content, str):
+        data, ext, media_type = content.encode(), "txt", "text/plain"
     else:
-        await client.query(prompt=message)
+        data, ext, media_type = json.dumps(content).encode(), "json", "application/json"
+    if len(data) <= TOOL_RESULT_INLINE_MAX:
+        return event
+    blob_id = await asyncio.to_thread(_store_blob, data, ext)
+    if isinstance(content, list):
+        content = "\n".join(
+            block.get("text", "") for block in content
+            if isinstance(block, dict) and block.get("type") == "text"
+        )
+    elif not isinstance(content, str):
+        content = json.dumps(content)
+    return {
+        **event,
+        "content": content[:_PREVIEW_CHARS],
+        "truncated": True,
+        "blob": {"id": blob_id, "size": len(data), "media_type": media_type},
+    }
+
+
+class TurnCancelled(Exception):
+    """The controller cancelled this turn before it started."""
+
+
+async def _drain(client: ClaudeSDKClient) -> None:
+    async for _ in client.receive_response():
+        pass
+
+
+async def _interrupt_and_drain(client: ClaudeSDKClient) -> None:
+    """Stop an abandoned turn and consume the rest of it so the client is ready again."""
+    global _client
+    try:
+        await client.interrupt()
+        await asyncio.wait_for(_drain(client), DRAIN_TIMEOUT)
+    except Exception as e:
+        print(f"Drain after cancel failed, dropping client: {e}")
+        if _client is client:
+            _client = None
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+
+def _abandon_turn(client: ClaudeSDKClient, queried: bool) -> None:
+    """Clean up after a turn whose consumer went away, without awaiting (we may be cancelled)."""
+    global _drain_task, _client
+    if queried:
+        _drain_task = asyncio.create_task(_interrupt_and_drain(client))
+    else:
+        # The query may be half-sent; a fresh client (resuming the session) is safer
+        if _client is client:
+            _client = None
+        task = asyncio.create_task(client.disconnect())
+        _disconnecting.add(task)
+        task.add_done_callback(_disconnecting.discard)
+
+
+async def cancel(turn_id: str | None) -> bool:
+    """Interrupt ``turn_id`` if it is running, or make it a no-op if it hasn't started.
+
+    An interrupted turn still finishes normally with whatever it produced so far.
+    """
+    if turn_id is not None and turn_id == _current_turn and _client is not None:
+        await _client.interrupt()
+        return True
+    if turn_id is not None:
+        _cancelled_turns.append(turn_id)
+    return False
+
+
+async def chat_stream(
+    message: str, timer: _StageTimer | None = None, turn_id: str | None = None
+) -> AsyncIterator[dict[str, object]]:
+    """Send message and yield text/tool events, then a final ``done`` event.
+
+    If the consumer goes away mid-turn the turn is interrupted and drained in
+    the background; the next turn waits for that before starting.
+    """
+    global _session_id, _current_turn, _last_activity
+    if _drain_task is not None and not _drain_task.done():
+        await asyncio.shield(_drain_task)
+    timer = timer or _StageTimer()
+    turn_started = time.perf_counter()
+    connected = _client is not None
+    client = await get_client()
+    if not connected:
+        timer.record("client_connect", turn_started)
 
     response_text = ""
     tool_events: list[dict[str, object]] = []
     new_session_id = None
-
-    async for msg in client.receive_response():
-        if isinstance(msg, SystemMessage):
-            data = msg.data
-            new_session_id = data.get("session_id", None)
-        if isinstance(msg, AssistantMessage):
-            for block in msg.content:
-                if isinstance(block, TextBlock):
-                    response_text += block.text
-                elif isinstance(block, ToolUseBlock):
-                    tool_events.append(
-                        {
-                            "type": "tool_use",
-                            "name": block.name,
-                            "input": block.input,
-                            "tool_use_id": block.id,
-                        }
-                    )
-                elif isinstance(block, ToolResultBlock):
-                    tool_events.append(
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": block.tool_use_id,
-                            "content": block.content,
-                            "is_error": block.is_error,
-                        }
-                    )
+    streamed_text = False
+    awaiting_first = True
+    tools_started: dict[str, tuple[str, float]] = {}  # tool_use_id -> (name, start)
+
+    if turn_id is not None and turn_id in _cancelled_turns:
+        raise TurnCancelled(f"Turn {turn_id} was cancelled")
+    _current_turn = turn_id
+    queried = False
+    try:
+        query_started = time.perf_counter()
+        if _session_id:
+            await client.query(prompt=message, session_id=_session_id)
+        else:
+            await client.query(prompt=message)
+        queried = True
+        timer.record("query", query_started)
+
+        async for msg in client.receive_response():
+            if awaiting_first and not isinstance(msg, SystemMessage):
+                timer.record("first_message", query_started)
+                awaiting_first = False
+            if isinstance(msg, SystemMessage):
+                data = msg.data
+                new_session_id = data.get("session_id", None)
+            elif isinstance(msg, StreamEvent):
+                delta = _text_delta(msg)
+                if delta:
+                    streamed_text = True
+                    yield {"type": "text", "text": delta}
+            elif isinstance(msg, (AssistantMessage, UserMessage)):
+                if not isinstance(msg.content, list):
+                    continue
+                for block in msg.content:
+                    if isinstance(block, TextBlock):
+                        if isinstance(msg, AssistantMessage):
+                            response_text += block.text
+                            if not streamed_text:
+                                yield {"type": "text", "text": block.text}
+                        continue
+                    event = _tool_event(block)
+                    if event is not None:
+                        if isinstance(block, ToolUseBlock):
+                            tools_started[block.id] = (block.name, time.perf_counter())
+                        else:
+                            if block.tool_use_id in tools_started:
+                                name, started = tools_started.pop(block.tool_use_id)
+                                timer.record("tool", started, tool=name, tool_use_id=block.tool_use_id)
+                            event = await _offload(event)
+                        tool_events.append(event)
+                        yield event
+                if isinstance(msg, AssistantMessage):
+                    streamed_text = False
+    except (asyncio.CancelledError, GeneratorExit):
+        _abandon_turn(client, queried)
+        raise
+    except Exception as e:
+        if _killed(e):
+            _usage["oom_kills"] += 1
+        raise
+    finally:
+        _current_turn = None
+        _last_activity = time.monotonic()
+        _usage["turns"] += 1
+        _usage["busy_seconds"] += time.perf_counter() - turn_started
+        _usage["tool_calls"] += sum(1 for event in tool_events if event["type"] == "tool_use")
 
     if new_session_id:
         _session_id = new_session_id
         _save_session_id(new_session_id)
 
-    return response_text, _session_id, tool_events
+    timer.record("turn", turn_started)
+    timer.log()
+    yield {
+        "type": "done",
+        "content": response_text,
+        "session_id": _session_id,
+        "tool_events": tool_events,
+        "timings": timer.stages,
+        "usage": _usage_report(),
+    }
+
+
+async def chat(
+    message: str, timer: _StageTimer | None = None, turn_id: str | None = None
+) -> tuple[str, str, list[dict[str, object]]]:
+    """Send message and get response."""
+    response_text, session_id, tool_events = "", _session_id, []
+    async for event in chat_stream(message, timer, turn_id):
+        if event["type"] == "done":
+            response_text = event["content"]
+            session_id = event["session_id"]
+            tool_events = event["tool_events"]
+    return response_text, session_id, tool_events
+
+
+def _sse(event: dict[str, object]) -> bytes:
+    """Encode an event as a server-sent event frame."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+# Compact framing for responses to controllers that offer it; the encoder
+# half of the controller's framing.py, which documents the format
+_FRAMES_MEDIA_TYPE = "application/vnd.monios.frames"
+_FRAMING_HEADER = "X-Monios-Framing"
+_FRAME_HEADER = struct.Struct(">I")
+_FRAME_COMPRESSED = 0x80000000
+_FRAME_COMPRESS_MIN = 512
+
+
+def _framing(request: Request) -> str | None:
+    """The best framing codec the controller offered that this sandbox can encode."""
+    if msgpack is None:
+        return None
+    offered = [c.strip() for c in request.headers.get(_FRAMING_HEADER, "").split(",")]
+    for codec in offered:
+        if codec == "msgpack" or (codec == "msgpack+zstd" and zstandard is not None):
+            return codec
+    return None
+
+
+class _FrameEncoder:
+    def __init__(self, codec: str):
+        self.codec = codec
+        self._compressor = zstandard.ZstdCompressor(level=3) if codec == "msgpack+zstd" else None
+
+    def encode(self, event: dict[str, object]) -> bytes:
+        payload = msgpack.packb(event)
+        flag = 0
+        if self._compressor is not None and len(payload) >= _FRAME_COMPRESS_MIN:
+            compressed = self._compressor.compress(payload)
+            if len(compressed) < len(payload):
+                payload, flag = compressed, _FRAME_COMPRESSED
+        return _FRAME_HEADER.pack(len(payload) | flag) + payload
+
+    def headers(self) -> dict[str, str]:
+        return {_FRAMING_HEADER: self.codec}
 
 
 async def clear():
-    """Clear the session."""
+    """Clear the session, interrupting any in-flight turn first."""
     global _client, _session_id
-    if _client:
+    if _client is not None and _chat_lock.locked():
         try:
-            await _client.disconnect()
-        except:
+            await _client.interrupt()
+        except Exception:
             pass
-        _client = None
-    _session_id = None
-    _clear_session_id()
+    async with _chat_lock:
+        if _client:
+            try:
+                await _client.disconnect()
+            except:
+                pass
+            _client = None
+        _session_id = None
+        if _workspace is not None:
+            _clear_session_id()
 
 
-class ChatHandler(BaseHTTPRequestHandler):
-    """HTTP handler for chat requests."""
+_HANDED_OVER = {"error": "Sandbox handed over to its replacement", "handed_over": True}
 
-    def do_POST(self):
-        if self.path == "/chat":
-            content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
-            data = json.loads(body)
 
-            message = data.get("message", "")
+def _error_payload(e: Exception) -> dict[str, object]:
+    return {
+        "error": str(e),
+        "traceback": traceback.format_exc(),
+        "stderr_tail": list(_stderr_lines),
+    }
 
+
+async def chat_endpoint(request: Request) -> Response:
+    timer = _StageTimer(request.headers.get("traceparent"))
+    data = await request.json()
+    message = data.get("message", "")
+    turn_id = data.get("turn_id")
+    codec = _framing(request)
+
+    await _await_takeover()
+    try:
+        async with _chat_lock:
+            timer.record("lock_wait", timer.start)
+            if _handed_over:
+                return JSONResponse(_HANDED_OVER, status_code=409)
+            response_text, session_id, tool_events = await chat(message, timer, turn_id)
+    except TurnCancelled as e:
+        return JSONResponse({"error": str(e), "cancelled": True}, status_code=499)
+    except Exception as e:
+        return JSONResponse(_error_payload(e), status_code=500)
+
+    result = {
+        "content": response_text,
+        "session_id": session_id,
+        "tool_events": tool_events,
+        "timings": timer.stages,
+        "usage": _usage_report(),
+    }
+    if codec is not None:
+        encoder = _FrameEncoder(codec)
+        return Response(encoder.encode(result), media_type=_FRAMES_MEDIA_TYPE, headers=encoder.headers())
+    return JSONResponse(result)
+
+
+async def chat_stream_endpoint(request: Request) -> Response:
+    timer = _StageTimer(request.headers.get("traceparent"))
+    data = await request.json()
+    message = data.get("message", "")
+    turn_id = data.get("turn_id")
+    codec = _framing(request)
+    encoder = _FrameEncoder(codec) if codec is not None else None
+    encode = encoder.encode if encoder is not None else _sse
+
+    async def events():
+        await _await_takeover()
+        async with _chat_lock:
+            timer.record("lock_wait", timer.start)
+            if _handed_over:
+                yield encode({"type": "error", **_HANDED_OVER})
+                return
             try:
-                response_text, session_id, tool_events = _loop.run_until_complete(chat(message))
-                result = {
-                    "content": response_text,
-                    "session_id": session_id,
-                    "tool_events": tool_events,
-                }
-                self.send_response(200)
-            except Exception as e:
-                result = {
-                    "error": str(e),
-                    "traceback": traceback.format_exc(),
-                    "stderr_tail": list(_stderr_lines),
-                }
-                self.send_response(500)
-
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
-
-        elif self.path == "/clear":
-            try:
-                _loop.run_until_complete(clear())
-                result = {"status": "cleared"}
-                self.send_response(200)
+                async for event in chat_stream(message, timer, turn_id):
+                    yield encode(event)
+            except TurnCancelled as e:
+                yield encode({"type": "error", "error": str(e), "cancelled": True})
             except Exception as e:
-                result = {"error": str(e), "traceback": traceback.format_exc()}
-                self.send_response(500)
+                yield encode({"type": "error", **_error_payload(e)})
 
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(result).encode())
+    if encoder is not None:
+        return StreamingResponse(
+            events(),
+            media_type=_FRAMES_MEDIA_TYPE,
+            headers={"Cache-Control": "no-cache", **encoder.headers()},
+        )
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
-        else:
-            self.send_response(404)
-            self.end_headers()
-
-    def do_GET(self):
-        if self.path == "/health":
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "ok"}).encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
 
-    def log_message(self, format, *args):
-        # Suppress default logging
-        pass
+async def attach_endpoint(request: Request) -> Response:
+    data = await request.json()
+    try:
+        workspace = attach(data.get("user_id", ""), bool(data.get("takeover")))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    try:
+        await asyncio.to_thread(_prune_blobs)
+    except OSError as e:
+        print(f"[sandbox_server] Pruning blobs failed: {e}")
+    return JSONResponse({"status": "attached", "workspace": str(workspace)})
+
+
+async def handover_endpoint(request: Request) -> Response:
+    try:
+        await handover()
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    return JSONResponse({"status": "handed_over"})
+
+
+async def takeover_endpoint(request: Request) -> Response:
+    _taken_over.set()
+    return JSONResponse({"status": "taken_over"})
+
+
+async def cancel_endpoint(request: Request) -> Response:
+    data = await request.json()
+    try:
+        interrupted = await cancel(data.get("turn_id"))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    return JSONResponse({"status": "interrupted" if interrupted else "not_running"})
+
+
+async def clear_endpoint(request: Request) -> Response:
+    try:
+        await clear()
+    except Exception as e:
+        return JSONResponse({"error": str(e), "traceback": traceback.format_exc()}, status_code=500)
+    return JSONResponse({"status": "cleared"})
+
+
+async def blob_endpoint(request: Request) -> Response:
+    blob_id = request.path_params["blob_id"]
+    if _workspace is None or not _BLOB_ID.match(blob_id):
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    path = _blob_dir() / blob_id
+    if not path.is_file():
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    return FileResponse(path, media_type="application/octet-stream")
+
+
+async def delete_blobs_endpoint(request: Request) -> Response:
+    if _workspace is not None:
+        await asyncio.to_thread(shutil.rmtree, _blob_dir(), True)
+    return JSONResponse({"status": "deleted"})
+
+
+async def health_endpoint(request: Request) -> Response:
+    return JSONResponse({"status": "ok"})
+
+
+async def status_endpoint(request: Request) -> Response:
+    return JSONResponse({
+        "status": "ok",
+        "user_id": _user_id,
+        "workspace": str(_workspace) if _workspace else None,
+        "session_id": _session_id,
+        "connected": _client is not None,
+        "busy": _chat_lock.locked(),
+        "draining": _drain_task is not None and not _drain_task.done(),
+        "handed_over": _handed_over,
+        "awaiting_takeover": not _taken_over.is_set(),
+        "idle_seconds": 0.0 if _chat_lock.locked() else time.monotonic() - _last_activity,
+        "usage": _usage_report(),
+    })
+
+
+app = Starlette(routes=[
+    Route("/chat", chat_endpoint, methods=["POST"]),
+    Route("/chat/stream", chat_stream_endpoint, methods=["POST"]),
+    Route("/attach", attach_endpoint, methods=["POST"]),
+    Route("/handover", handover_endpoint, methods=["POST"]),
+    Route("/takeover", takeover_endpoint, methods=["POST"]),
+    Route("/cancel", cancel_endpoint, methods=["POST"]),
+    Route("/clear", clear_endpoint, methods=["POST"]),
+    Route("/blobs", delete_blobs_endpoint, methods=["DELETE"]),
+    Route("/blobs/{blob_id}", blob_endpoint, methods=["GET"]),
+    Route("/health", health_endpoint, methods=["GET"]),
+    Route("/status", status_endpoint, methods=["GET"]),
+], on_startup=[_start_usage_sampler])
 
 
 def main():
     """Run the sandbox server."""
-    port = 8080
-    server = HTTPServer(("0.0.0.0", port), ChatHandler)
+    port = int(os.environ.get("PORT", "8080"))
     print(f"Sandbox server running on port {port}")
-    server.serve_forever()
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="warning")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+"""Choosing a sandbox size from a user's observed resource usage.
+
+Each sandbox reports its peak memory, CPU time and turn counts (see
+``usage`` in sandbox_server's /status). When a sandbox ends, sandbox_manager
+turns its final report into a UsageSample, keeps the user's recent samples
+in the sandbox registry (so every controller sees them, across restarts)
+and logs each one as a ``sandbox_usage`` JSON line. The next sandbox for
+that user, whether it's a new one or a rollover, is sized by a SizingPolicy
+over those samples.
+
+Policies are plain objects, so they can be evaluated offline: ``replay``
+runs one over recorded samples (e.g. the ``sandbox_usage`` lines grepped
+from controller logs) and reports how often it would have under-sized a
+sandbox and how much it would have allocated. See benchmarks/replay_sizing.py.
+"""
+
+import json
+import os
+from dataclasses import asdict, dataclass, fields
+from typing import Iterable, Protocol, Sequence
+
+
+@dataclass(frozen=True)
+class SandboxSize:
+    """A resource tier a sandbox can be created with."""
+    name: str
+    cpu: float  # cores
+    memory_mb: int
+
+
+# small matches what every sandbox got before sizing (1 core, 512 MB)
+TIERS: tuple[SandboxSize, ...] = (
+    SandboxSize("small", 1.0, 512),
+    SandboxSize("medium", 1.0, 1024),
+    SandboxSize("large", 2.0, 2048),
+)
+_TIERS_BY_NAME = {tier.name: tier for tier in TIERS}
+
+# New users (and the warm pool) get this tier
+DEFAULT_TIER = _TIERS_BY_NAME[os.environ.get("SANDBOX_DEFAULT_TIER", "small")]
+
+# Exit codes of a process killed by SIGKILL, as the OOM killer does
+_KILLED = (137, -9)
+
+
+@dataclass(frozen=True)
+class UsageSample:
+    """Resource usage over one sandbox's life for a user."""
+    user_id: str
+    tier: str  # SandboxSize.name it ran with
+    peak_rss_mb: float
+    cpu_seconds: float
+    busy_seconds: float  # time spent running turns
+    wall_seconds: float
+    turns: int = 0
+    tool_calls: int = 0
+    oom_kills: int = 0  # Claude CLI processes killed inside the sandbox
+    exit_code: int | None = None  # set if the sandbox itself died
+
+    @property
+    def oom(self) -> bool:
+        return self.oom_kills > 0 or self.exit_code in _KILLED
+
+    @property
+    def cpu_utilization(self) -> float:
+        """Cores used while running turns."""
+        return self.cpu_seconds / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+    @classmethod
+    def from_report(
+        cls, user_id: str, tier: SandboxSize, report: dict, exit_code: int | None = None
+    ) -> "UsageSample":
+        """Build a sample from a sandbox's ``usage`` report."""
+        return cls(
+            user_id=user_id,
+            tier=tier.name,
+            peak_rss_mb=float(report.get("peak_rss_mb", 0.0)),
+            cpu_seconds=float(report.get("cpu_seconds", 0.0)),
+            busy_seconds=float(report.get("busy_seconds", 0.0)),
+            wall_seconds=float(report.get("uptime_seconds", 0.0)),
+            turns=int(report.get("turns", 0)),
+            tool_calls=int(report.get("tool_calls", 0)),
+            oom_kills=int(report.get("oom_kills", 0)),
+            exit_code=exit_code,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UsageSample":
+        """Rebuild a sample from ``asdict()`` output, ignoring fields it doesn't know."""
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+    def to_json(self) -> str:
+        return json.dumps({"event": "sandbox_usage", **asdict(self)})
+
+
+class SizingPolicy(Protocol):
+    def choose(self, history: Sequence[UsageSample]) -> SandboxSize:
+        """Pick a size for the user's next sandbox from their samples, oldest first."""
+
+
+class FixedPolicy:
+    """Always the same size; the baseline to compare other policies against."""
+
+    def __init__(self, size: SandboxSize = DEFAULT_TIER):
+        self.size = size
+
+    def choose(self, history: Sequence[UsageSample]) -> SandboxSize:
+        return self.size
+
+
+class HeadroomPolicy:
+    """Smallest tier that fits the user's recent peaks with some headroom.
+
+    Memory must cover the highest recent peak RSS times ``memory_headroom``
+    and CPU the highest recent utilization during turns times
+    ``cpu_headroom``. A sandbox that was OOM-killed moves the user at least
+    one tier above the one it ran with.
+    """
+
+    def __init__(
+        self,
+        tiers: Sequence[SandboxSize] = TIERS,
+        default: SandboxSize = DEFAULT_TIER,
+        memory_headroom: float = 1.5,
+        cpu_headroom: float = 1.25,
+        window: int = 10,
+    ):
+        self.tiers = sorted(tiers, key=lambda t: (t.memory_mb, t.cpu))
+        self.default = default
+        self.memory_headroom = memory_headroom
+        self.cpu_headroom = cpu_headroom
+        self.window = window
+
+    def choose(self, history: Sequence[UsageSample]) -> SandboxSize:
+        recent = list(history)[-self.window:]
+        if not recent:
+            return self.default
+        memory = max(s.peak_rss_mb for s in recent) * self.memory_headroom
+        cpu = max(s.cpu_utilization for s in recent) * self.cpu_headroom
+        floor = 0
+        for sample in recent:
+            if sample.oom:
+                index = next((i for i, t in enumerate(self.tiers) if t.name == sample.tier), -1)
+                floor = max(floor, index + 1)
+        for tier in self.tiers[floor:]:
+            if tier.memory_mb >= memory and tier.cpu >= cpu:
+                return tier
+        return self.tiers[-1]
+
+
+def load_samples(lines: Iterable[str]) -> list[UsageSample]:
+    """Parse ``sandbox_usage`` JSON lines, skipping any other log output."""
+    samples = []
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            continue
+        if data.pop("event", None) == "sandbox_usage":
+            samples.append(UsageSample.from_dict(data))
+    return samples
+
+
+def replay(policy: SizingPolicy, samples: Iterable[UsageSample]) -> dict[str, object]:
+    """Evaluate ``policy`` against recorded samples, in order.
+
+    For each sample the policy picks a size from that user's earlier
+    samples. The pick is under-sized if the recorded peak doesn't fit in
+    it, or if the sandbox was OOM-killed at that tier or a larger one (an
+    OOM-killed sandbox's peak understates what it needed). Allocation is
+    the picked size held for the sample's wall time.
+    """
+    history: dict[str, list[UsageSample]] = {}
+    tiers: dict[str, int] = {}
+    undersized = 0
+    memory_gb_hours = cpu_hours = used_memory_gb_hours = 0.0
+    count = 0
+    for sample in samples:
+        count += 1
+        size = policy.choose(history.get(sample.user_id, []))
+        tiers[size.name] = tiers.get(size.name, 0) + 1
+        ran_with = _TIERS_BY_NAME.get(sample.tier)
+        oom_at_or_above = sample.oom and (ran_with is None or ran_with.memory_mb >= size.memory_mb)
+        if sample.peak_rss_mb > size.memory_mb or oom_at_or_above:
+            undersized += 1
+        hours = sample.wall_seconds / 3600
+        memory_gb_hours += size.memory_mb / 1024 * hours
+        cpu_hours += size.cpu * hours
+        used_memory_gb_hours += sample.peak_rss_mb / 1024 * hours
+        history.setdefault(sample.user_id, []).append(sample)
+    return {
+        "samples": count,
+        "users": len(history),
+        "undersized": undersized,
+        "undersized_rate": round(undersized / count, 4) if count else 0.0,
+        "tiers": tiers,
+        "allocated_memory_gb_hours": round(memory_gb_hours, 3),
+        "allocated_cpu_hours": round(cpu_hours, 3),
+        "peak_memory_gb_hours": round(used_memory_gb_hours, 3),
+    }
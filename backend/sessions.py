@@ -1,132 +1,391 @@
 """Shared session management for Claude SDK clients."""
 
-import json
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import aclosing
 from pathlib import Path
+from typing import AsyncIterator, Optional
 
+import blobs
+import metrics
+import store
+import tracing
 from claude_agent_sdk import (
     ClaudeSDKClient,
     ClaudeAgentOptions,
     AssistantMessage,
     TextBlock,
     SystemMessage,
+    StreamEvent,
     ToolUseBlock,
     ToolResultBlock,
+    UserMessage,
 )
 
-# Shared session store for all users (web + iOS)
-_sessions: dict[str, ClaudeSDKClient] = {}
+# Shared session store for all users (web + iOS), least recently used first.
+# Each client is a Claude CLI subprocess, so the cache is bounded; evicted users
+# resume from their persisted session_id on the next message.
+_sessions: OrderedDict[str, ClaudeSDKClient] = OrderedDict()
+_last_used: dict[str, float] = {}  # user_id -> monotonic time of last use
+_in_use: dict[str, int] = {}  # user_id -> turns in flight (never evicted)
+_cache_stats: dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+_reaper_task: Optional[asyncio.Task] = None
+# user_id -> interrupt + drain of a turn whose consumer went away; the next turn waits for it
+_draining: dict[str, asyncio.Task] = {}
+_disconnecting: set[asyncio.Task] = set()  # Held so the loop doesn't drop them mid-run
 
-# Persist session_ids to survive restarts
-_SESSION_FILE = Path(__file__).parent / ".session_ids.json"
-_session_ids: dict[str, str] = {}  # user_id -> session_id
+MAX_CLIENTS = int(os.environ.get("SESSION_MAX_CLIENTS", "32"))
+IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "900"))
+MAX_RSS_MB = float(os.environ.get("SESSION_MAX_RSS_MB", "0"))  # 0 = no memory limit
+REAP_INTERVAL = 60.0
+DRAIN_TIMEOUT = 30.0
 
-
-def _load_session_ids():
-    """Load persisted session_ids from disk."""
-    global _session_ids
-    if _SESSION_FILE.exists():
-        try:
-            _session_ids = json.loads(_SESSION_FILE.read_text())
-        except (json.JSONDecodeError, IOError):
-            _session_ids = {}
-
-
-def _save_session_ids():
-    """Save session_ids to disk."""
-    try:
-        _SESSION_FILE.write_text(json.dumps(_session_ids, indent=2))
-    except IOError:
-        pass
-
-
-# Load on module import
-_load_session_ids()
+# Persist session_ids to survive restarts. Reads hit this in-memory map; each
+# change is a single-row upsert applied off the event loop by the store's writer.
+_session_ids: dict[str, str] = store.load_session_ids()  # user_id -> session_id
 
 SYSTEM_PROMPT = "You are a helpful assistant in a terminal-aesthetic chat app called Monios. Keep responses concise and friendly."
 
 
 async def get_or_create_client(user_id: str) -> ClaudeSDKClient:
     """Get existing client or create new one for user."""
-    if user_id not in _sessions:
+    if user_id in _sessions:
+        _cache_stats["hits"] += 1
+        _sessions.move_to_end(user_id)
+    else:
+        _cache_stats["misses"] += 1
         options = ClaudeAgentOptions(
             system_prompt=SYSTEM_PROMPT,
             allowed_tools=[],
             permission_mode="bypassPermissions",
             max_turns=10,  # Allow multiple turns for tool use + response
-            cwd="../workspace"
+            cwd="../workspace",
+            resume=_session_ids.get(user_id),  # Pick up where an evicted client left off
+            include_partial_messages=True,  # Token-level text deltas for streaming
         )
         client = ClaudeSDKClient(options=options)
         await client.connect()
         _sessions[user_id] = client
-    return _sessions[user_id]
+    _last_used[user_id] = time.monotonic()
+    client = _sessions[user_id]
+    await evict_idle_clients()
+    return client
+
+
+def _children_rss_mb() -> float | None:
+    """Total RSS of this process's descendants (the CLI subprocesses), Linux only."""
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    children: dict[int, list[int]] = {}
+    rss_pages: dict[int, int] = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # Fields after the ")" of the command name start at field 3 (state)
+            fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+            ppid, rss = int(fields[1]), int(fields[21])
+        except (OSError, ValueError, IndexError):
+            continue
+        pid = int(entry.name)
+        children.setdefault(ppid, []).append(pid)
+        rss_pages[pid] = rss
+    total = 0
+    stack = list(children.get(os.getpid(), []))
+    while stack:
+        pid = stack.pop()
+        total += rss_pages.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+async def _disconnect(user_id: str):
+    client = _sessions.pop(user_id, None)
+    _last_used.pop(user_id, None)
+    if client is not None:
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+
+async def evict_idle_clients() -> int:
+    """Evict clients over the count, idle-TTL or memory limits. Returns the number evicted."""
+    now = time.monotonic()
+    # Least recently used first; clients with a turn in flight are never evicted
+    candidates = [uid for uid in _sessions if not _in_use.get(uid)]
+    victims = [uid for uid in candidates if now - _last_used.get(uid, now) > IDLE_TTL]
+    excess = len(_sessions) - len(victims) - MAX_CLIENTS
+    remaining = [uid for uid in candidates if uid not in victims]
+    if excess > 0:
+        victims += remaining[:excess]
+        remaining = remaining[excess:]
+    if MAX_RSS_MB > 0 and remaining:
+        rss = await asyncio.to_thread(_children_rss_mb)
+        if rss is not None and rss > MAX_RSS_MB:
+            per_client = rss / max(len(_sessions), 1)
+            over = int((rss - MAX_RSS_MB) // per_client) + 1
+            victims += remaining[:over]
+
+    for uid in victims:
+        await _disconnect(uid)
+    if victims:
+        _cache_stats["evictions"] += len(victims)
+        print(f"[sessions] Evicted {len(victims)} client(s), {len(_sessions)} remaining")
+    return len(victims)
+
+
+async def _reap_forever():
+    while True:
+        await asyncio.sleep(REAP_INTERVAL)
+        try:
+            await evict_idle_clients()
+        except Exception as e:
+            print(f"[sessions] Eviction failed: {e}")
+
+
+def start_reaper() -> asyncio.Task:
+    """Start periodic eviction so idle clients are released without new traffic."""
+    global _reaper_task
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.create_task(_reap_forever())
+    return _reaper_task
+
+
+async def close_all():
+    """Stop the reaper and disconnect every cached client."""
+    if _reaper_task is not None:
+        _reaper_task.cancel()
+    for uid in list(_sessions):
+        await _disconnect(uid)
+
+
+def cache_stats() -> dict[str, int]:
+    """Client cache size and hit/miss/eviction counters."""
+    return {"clients": len(_sessions), **_cache_stats}
 
 
 async def clear_session(user_id: str) -> bool:
     """Clear session for a user. Returns True if session existed."""
     existed = False
     if user_id in _sessions:
-        try:
-            await _sessions[user_id].disconnect()
-        except:
-            pass
-        del _sessions[user_id]
+        await _disconnect(user_id)
         existed = True
     if user_id in _session_ids:
         del _session_ids[user_id]
-        _save_session_ids()
+        store.delete_session_id(user_id)
         existed = True
     return existed
 
-async def get_response(
+def _text_delta(msg: StreamEvent) -> str | None:
+    """Extract a top-level text delta from a partial stream event."""
+    if msg.parent_tool_use_id is not None:
+        return None
+    event = msg.event
+    if event.get("type") != "content_block_delta":
+        return None
+    delta = event.get("delta", {})
+    if delta.get("type") != "text_delta":
+        return None
+    return delta.get("text") or None
+
+
+def _tool_event(block: object) -> dict[str, object] | None:
+    """Convert a tool content block into a tool event dict."""
+    if isinstance(block, ToolUseBlock):
+        return {
+            "type": "tool_use",
+            "name": block.name,
+            "input": block.input,
+            "tool_use_id": block.id,
+        }
+    if isinstance(block, ToolResultBlock):
+        return {
+            "type": "tool_result",
+            "tool_use_id": block.tool_use_id,
+            "content": block.content,
+            "is_error": block.is_error,
+        }
+    return None
+
+
+async def stream_response(
     message: str, user_id: str, session_id: str | None = None
-) -> tuple[str, str | None, list[dict[str, object]]]:
-    """Send message and get response for a user."""
+) -> AsyncIterator[dict[str, object]]:
+    """Send message and yield events as the turn runs.
+
+    Yields ``text`` deltas and ``tool_use``/``tool_result`` events, followed by
+    a final ``done`` event carrying the full content, session_id and tool_events.
+    """
+    _acquire(user_id)
+    try:
+        # Close the inner turn before releasing, so an abandoned turn's drain is already counted
+        async with aclosing(_stream_turn(message, user_id, session_id)) as events:
+            async for event in events:
+                yield event
+    finally:
+        _release(user_id)
+
+
+def _acquire(user_id: str):
+    _in_use[user_id] = _in_use.get(user_id, 0) + 1
+
+
+def _release(user_id: str):
+    _in_use[user_id] -= 1
+    if not _in_use[user_id]:
+        del _in_use[user_id]
+    if user_id in _last_used:
+        _last_used[user_id] = time.monotonic()
+
+
+async def _drain(client: ClaudeSDKClient):
+    async for _ in client.receive_response():
+        pass
+
+
+async def _interrupt_and_drain(user_id: str, client: ClaudeSDKClient):
+    """Stop an abandoned turn and consume the rest of it so the client can be reused."""
+    try:
+        await client.interrupt()
+        await asyncio.wait_for(_drain(client), DRAIN_TIMEOUT)
+    except Exception as e:
+        print(f"[sessions] Drain after cancel failed for {user_id}, dropping client: {e}")
+        if _sessions.get(user_id) is client:
+            await _disconnect(user_id)
+        else:
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+    finally:
+        if _draining.get(user_id) is asyncio.current_task():
+            del _draining[user_id]
+        _release(user_id)
+
+
+def _abandon_turn(user_id: str, client: ClaudeSDKClient, queried: bool):
+    """Clean up after a turn whose consumer went away, without awaiting (we may be cancelled)."""
+    if queried:
+        _acquire(user_id)  # Not evictable while draining
+        _draining[user_id] = asyncio.create_task(_interrupt_and_drain(user_id, client))
+    else:
+        # The query may be half-written; a fresh client resuming the session is safer
+        if _sessions.get(user_id) is client:
+            del _sessions[user_id]
+            _last_used.pop(user_id, None)
+        task = asyncio.create_task(client.disconnect())
+        _disconnecting.add(task)
+        task.add_done_callback(_disconnecting.discard)
+
+
+async def _stream_turn(
+    message: str, user_id: str, session_id: str | None
+) -> AsyncIterator[dict[str, object]]:
+    drain = _draining.get(user_id)
+    if drain is not None:
+        await asyncio.shield(drain)
+
+    trace = tracing.current()
+    connected = user_id in _sessions
+    connect_started = time.perf_counter()
     client = await get_or_create_client(user_id)
+    if trace is not None and not connected:
+        trace.record("client_connect", connect_started)
 
     # Use provided session_id, or fall back to persisted one
     effective_session_id = session_id or _session_ids.get(user_id)
 
-    print(f"user_id: {user_id}")
-    print(f"message: {message}")
-    print(f"effective_session_id: {effective_session_id}")
-    if effective_session_id:
-        await client.query(prompt=message, session_id=effective_session_id)
-    else:
-        await client.query(prompt=message)
+    tracing.event(
+        "turn.start",
+        user_id=user_id,
+        message_chars=len(message),
+        session_id=effective_session_id,
+    )
 
     response_text = ""
     tool_events: list[dict[str, object]] = []
     new_session_id = None
-    async for msg in client.receive_response():
-        if isinstance(msg, SystemMessage):
-            data = msg.data
-            new_session_id = data.get("session_id", None)
-        if isinstance(msg, AssistantMessage):
-            for block in msg.content:
-                if isinstance(block, TextBlock):
-                    response_text += block.text
-                elif isinstance(block, ToolUseBlock):
-                    tool_events.append(
-                        {
-                            "type": "tool_use",
-                            "name": block.name,
-                            "input": block.input,
-                            "tool_use_id": block.id,
-                        }
-                    )
-                elif isinstance(block, ToolResultBlock):
-                    tool_events.append(
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": block.tool_use_id,
-                            "content": block.content,
-                            "is_error": block.is_error,
-                        }
-                    )
+    streamed_text = False
+    awaiting_first = True
+    tools_started: dict[str, tuple[str, float]] = {}  # tool_use_id -> (name, start)
+    queried = False
+    try:
+        with tracing.span("query"):
+            if effective_session_id:
+                await client.query(prompt=message, session_id=effective_session_id)
+            else:
+                await client.query(prompt=message)
+        queried = True
+        queried_at = time.perf_counter()
+
+        async for msg in client.receive_response():
+            if awaiting_first and not isinstance(msg, SystemMessage):
+                metrics.SDK_FIRST_MESSAGE.observe(time.perf_counter() - queried_at)
+                if trace is not None:
+                    trace.record("first_message", queried_at)
+                awaiting_first = False
+            if isinstance(msg, SystemMessage):
+                data = msg.data
+                new_session_id = data.get("session_id", None)
+            elif isinstance(msg, StreamEvent):
+                delta = _text_delta(msg)
+                if delta:
+                    streamed_text = True
+                    yield {"type": "text", "text": delta}
+            elif isinstance(msg, (AssistantMessage, UserMessage)):
+                if not isinstance(msg.content, list):
+                    continue
+                for block in msg.content:
+                    if isinstance(block, TextBlock):
+                        if isinstance(msg, AssistantMessage):
+                            response_text += block.text
+                            # Older CLIs don't emit partial messages; send the whole block
+                            if not streamed_text:
+                                yield {"type": "text", "text": block.text}
+                        continue
+                    event = _tool_event(block)
+                    if event is not None:
+                        if isinstance(block, ToolUseBlock):
+                            tools_started[block.id] = (block.name, time.perf_counter())
+                        else:
+                            if trace is not None and block.tool_use_id in tools_started:
+                                name, started = tools_started.pop(block.tool_use_id)
+                                trace.record("tool", started, tool=name, tool_use_id=block.tool_use_id)
+                            event = await blobs.offload(user_id, event)
+                        tool_events.append(event)
+                        yield event
+                if isinstance(msg, AssistantMessage):
+                    streamed_text = False
+    except (asyncio.CancelledError, GeneratorExit):
+        _abandon_turn(user_id, client, queried)
+        raise
 
     # Persist the session_id for this user
     if new_session_id:
-        _session_ids[user_id] = new_session_id
-        _save_session_ids()
+        if _session_ids.get(user_id) != new_session_id:
+            _session_ids[user_id] = new_session_id
+            store.set_session_id(user_id, new_session_id)
+
+    yield {
+        "type": "done",
+        "content": response_text,
+        "session_id": new_session_id,
+        "tool_events": tool_events,
+    }
+
 
+async def get_response(
+    message: str, user_id: str, session_id: str | None = None
+) -> tuple[str, str | None, list[dict[str, object]]]:
+    """Send message and get response for a user."""
+    response_text, new_session_id, tool_events = "", None, []
+    async for event in stream_response(message, user_id, session_id):
+        if event["type"] == "done":
+            response_text = event["content"]
+            new_session_id = event["session_id"]
+            tool_events = event["tool_events"]
     return response_text, new_session_id, tool_events
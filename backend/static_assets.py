@@ -0,0 +1,188 @@
+"""Serving the built frontend (frontend/dist) cheaply.
+
+The build is immutable for the life of the process, so StaticAssets indexes
+it once at startup: media type, a content-hash ETag and the compressed
+variants of every file. A request is then a dict lookup:
+
+- ``Accept-Encoding`` picks the ``.br`` or ``.gz`` variant written next to
+  the file at build time (``python static_assets.py frontend/dist``, run by
+  the frontend's build script). Compressible files with no gzip variant are
+  gzipped once in memory.
+- Files named with a content hash by Vite (``assets/index-B4x9aZ_q.js``)
+  are cached for a year as immutable; everything else, index.html included,
+  is revalidated each time with ``If-None-Match`` for a 304.
+- Files up to MEMORY_MAX bytes (index.html, most chunks) are served from
+  memory; larger ones from disk.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+if TYPE_CHECKING:
+    from fastapi.responses import Response
+
+MEMORY_MAX = int(os.environ.get("STATIC_MEMORY_MAX", str(256 * 1024)))
+COMPRESS_MIN = 1024  # Smaller files aren't worth a compressed variant
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Vite's hashed output: assets/name-<8 char base64url hash>.ext
+_FINGERPRINTED = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+_COMPRESSIBLE = re.compile(r"^(text/|application/(javascript|json|xml|wasm|manifest\+json)|image/svg)")
+_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+@dataclass
+class _Variant:
+    path: Path
+    stat: os.stat_result
+    etag: str
+    body: bytes | None = None  # Kept in memory if small
+
+
+@dataclass
+class _Asset:
+    media_type: str
+    cache_control: str
+    variants: dict[str, _Variant] = field(default_factory=dict)  # "identity", "gzip", "br"
+
+
+def _compressible(media_type: str) -> bool:
+    return _COMPRESSIBLE.match(media_type) is not None
+
+
+def _variant(path: Path, etag: str, data: bytes | None = None) -> _Variant:
+    stat = path.stat()
+    if data is None and stat.st_size <= MEMORY_MAX:
+        data = path.read_bytes()
+    return _Variant(path=path, stat=stat, etag=etag, body=data)
+
+
+class StaticAssets:
+    def __init__(self, directory: str | os.PathLike):
+        self.directory = Path(directory)
+        self._assets: dict[str, _Asset] = {}
+        for path in sorted(self.directory.rglob("*")):
+            if not path.is_file() or path.suffix in (".br", ".gz"):
+                continue
+            name = path.relative_to(self.directory).as_posix()
+            self._assets[name] = self._index(name, path)
+
+    def _index(self, name: str, path: Path) -> _Asset:
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:20]
+        asset = _Asset(
+            media_type=media_type,
+            cache_control=IMMUTABLE if _FINGERPRINTED.match(name) else REVALIDATE,
+        )
+        in_memory = data if len(data) <= MEMORY_MAX else None
+        asset.variants["identity"] = _variant(path, f'"{digest}"', in_memory)
+        if not _compressible(media_type) or len(data) < COMPRESS_MIN:
+            return asset
+        for encoding, suffix in _SUFFIXES.items():
+            built = path.with_name(path.name + suffix)
+            if built.is_file():
+                asset.variants[encoding] = _variant(built, f'"{digest}-{encoding}"')
+        if "gzip" not in asset.variants and len(data) <= MEMORY_MAX:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                asset.variants["gzip"] = _Variant(
+                    path=path, stat=asset.variants["identity"].stat,
+                    etag=f'"{digest}-gzip"', body=compressed,
+                )
+        return asset
+
+    def response(self, path: str, request_headers) -> "Response":
+        """The response for ``path`` (relative to the directory). Raises a 404 if unknown."""
+        # Imported here so the build can run precompress() without the backend's dependencies
+        from fastapi import HTTPException
+        from fastapi.responses import FileResponse, Response
+
+        asset = self._assets.get(path)
+        if asset is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+
+        encoding = _negotiate(request_headers.get("accept-encoding", ""), asset.variants)
+        variant = asset.variants[encoding]
+        headers = {"ETag": variant.etag, "Cache-Control": asset.cache_control}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if _not_modified(request_headers.get("if-none-match"), variant.etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if variant.body is not None:
+            return Response(variant.body, media_type=asset.media_type, headers=headers)
+        return FileResponse(
+            variant.path, media_type=asset.media_type, headers=headers, stat_result=variant.stat
+        )
+
+
+def _negotiate(accept_encoding: str, variants: dict[str, _Variant]) -> str:
+    """Best available encoding the client accepts: br, then gzip, then identity."""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        key, _, value = params.strip().partition("=")
+        try:
+            q = float(value) if key.strip() == "q" else 1.0
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+def _not_modified(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
+
+
+def precompress(directory: str | os.PathLike) -> int:
+    """Write ``.gz`` (and ``.br``, if brotli is installed) next to each compressible file.
+
+    Run on the build output; returns how many variants were written.
+    Variants that wouldn't be smaller than the file are skipped.
+    """
+    written = 0
+    for path in sorted(Path(directory).rglob("*")):
+        if not path.is_file() or path.suffix in (".br", ".gz"):
+            continue
+        media_type = mimetypes.guess_type(path.name)[0] or ""
+        data = path.read_bytes()
+        if not _compressible(media_type) or len(data) < COMPRESS_MIN:
+            continue
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data):
+                path.with_name(path.name + suffix).write_bytes(compressed)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:] or ["frontend/dist"]:
+        print(f"[static_assets] Wrote {precompress(directory)} compressed variants in {directory}")
@@ -0,0 +1,233 @@
+"""Local SQLite persistence for the controller.
+
+The database runs in WAL mode so readers never block the writer and a crash
+can't leave a half-written file behind. Writes are queued and applied by a
+single background thread, batched into one transaction, so request handlers
+never touch the disk on the event loop.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+DB_PATH = Path(os.environ.get("MONIOS_DB_PATH", Path(__file__).parent / ".monios.db"))
+
+# Pre-SQLite session_id map, imported once on first open
+_LEGACY_SESSION_FILE = Path(__file__).parent / ".session_ids.json"
+
+# How long the writer waits for more writes to batch into the same transaction
+BATCH_WINDOW = 0.05
+MAX_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_ids (
+    user_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tool_events TEXT,
+    session_id TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_user_id ON messages (user_id, id);
+CREATE TABLE IF NOT EXISTS usage_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    sample TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_samples_user_id ON usage_samples (user_id, id);
+"""
+
+_writes: "queue.Queue[Optional[tuple[str, tuple[Any, ...]]]]" = queue.Queue()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30.0, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable across app crashes in WAL mode
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def connection() -> sqlite3.Connection:
+    """Per-thread read connection."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+    return conn
+
+
+def _write_loop():
+    conn = _connect()
+    while True:
+        item = _writes.get()
+        batch = [item]
+        # Gather whatever else arrives within the batch window
+        while item is not None and len(batch) < MAX_BATCH:
+            try:
+                item = _writes.get(timeout=BATCH_WINDOW)
+            except queue.Empty:
+                break
+            batch.append(item)
+
+        statements = [w for w in batch if w is not None]
+        try:
+            with conn:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"[store] Write batch of {len(statements)} failed: {e}")
+        finally:
+            for _ in batch:
+                _writes.task_done()
+
+        if batch[-1] is None:
+            conn.close()
+            return
+
+
+def enqueue(sql: str, params: tuple[Any, ...] = ()):
+    """Queue a write for the background writer thread."""
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_write_loop, name="store-writer", daemon=True)
+                _writer.start()
+    _writes.put((sql, params))
+
+
+def flush():
+    """Block until every queued write has been applied."""
+    if _writer is not None and _writer.is_alive():
+        _writes.join()
+
+
+def close():
+    """Flush pending writes and stop the writer thread."""
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        _writes.put(None)
+        _writer.join()
+    _writer = None
+
+
+def load_session_ids() -> dict[str, str]:
+    """Load the user_id -> session_id map, importing the legacy JSON file if present."""
+    conn = connection()
+    if _LEGACY_SESSION_FILE.exists():
+        try:
+            legacy = json.loads(_LEGACY_SESSION_FILE.read_text())
+        except (json.JSONDecodeError, IOError):
+            legacy = {}
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO session_ids (user_id, session_id) VALUES (?, ?)",
+                list(legacy.items()),
+            )
+        _LEGACY_SESSION_FILE.rename(_LEGACY_SESSION_FILE.with_suffix(".json.migrated"))
+    return dict(conn.execute("SELECT user_id, session_id FROM session_ids"))
+
+
+def set_session_id(user_id: str, session_id: str):
+    enqueue(
+        "INSERT INTO session_ids (user_id, session_id) VALUES (?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET session_id = excluded.session_id",
+        (user_id, session_id),
+    )
+
+
+def delete_session_id(user_id: str):
+    enqueue("DELETE FROM session_ids WHERE user_id = ?", (user_id,))
+
+
+def append_message(
+    user_id: str,
+    role: str,
+    content: str,
+    created_at: str,
+    tool_events: list[dict[str, object]] | None = None,
+    session_id: str | None = None,
+):
+    """Queue a chat message for the user's history."""
+    enqueue(
+        "INSERT INTO messages (user_id, role, content, tool_events, session_id, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            user_id,
+            role,
+            content,
+            json.dumps(tool_events) if tool_events else None,
+            session_id,
+            created_at,
+        ),
+    )
+
+
+def list_messages(
+    user_id: str, limit: int, before: int | None = None
+) -> tuple[list[dict[str, object]], int | None]:
+    """Page backwards through a user's history using the message id as cursor.
+
+    Returns the page in chronological order and the cursor for the next
+    (older) page, or None when there are no older messages. Each page is a
+    single range scan on the (user_id, id) index regardless of depth.
+    """
+    rows = connection().execute(
+        "SELECT id, role, content, tool_events, session_id, created_at FROM messages "
+        "WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (user_id, before if before is not None else 2**63 - 1, limit + 1),
+    ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [
+        {
+            "id": row[0],
+            "role": row[1],
+            "content": row[2],
+            "tool_events": json.loads(row[3]) if row[3] else [],
+            "session_id": row[4],
+            "timestamp": row[5],
+        }
+        for row in reversed(rows)
+    ]
+    next_cursor = rows[-1][0] if has_more else None
+    return messages, next_cursor
+
+
+def delete_messages(user_id: str):
+    enqueue("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+
+def add_usage_sample(user_id: str, sample: dict[str, object], keep: int):
+    """Queue a sandbox usage sample, trimming the user's samples to the ``keep`` newest."""
+    enqueue(
+        "INSERT INTO usage_samples (user_id, sample) VALUES (?, ?)",
+        (user_id, json.dumps(sample)),
+    )
+    enqueue(
+        "DELETE FROM usage_samples WHERE user_id = ? AND id NOT IN "
+        "(SELECT id FROM usage_samples WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+        (user_id, user_id, keep),
+    )
+
+
+def usage_samples(user_id: str, limit: int) -> list[dict[str, object]]:
+    """The user's ``limit`` most recent sandbox usage samples, oldest first."""
+    rows = connection().execute(
+        "SELECT sample FROM usage_samples WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, limit),
+    ).fetchall()
+    return [json.loads(row[0]) for row in reversed(rows)]
@@ -0,0 +1,140 @@
+"""Per-request trace context, propagated to sandboxes as a W3C ``traceparent``.
+
+Each chat request starts a Trace. Stages on the controller record spans on
+it, the sandbox returns its own stage timings (client connect, query, first
+message, each tool call) which are merged in as ``sandbox.*`` spans, and the
+finished trace is printed as one JSON line: a per-request waterfall.
+
+Spans are always recorded (a perf_counter call and a list append), but only
+sampled traces are printed: TRACE_SAMPLE_RATE of them, any whose incoming
+traceparent was sampled, and every trace slower than TRACE_SLOW_MS.
+"""
+
+import json
+import os
+import random
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "10000"))  # 0 = never log for slowness
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("monios_trace", default=None)
+
+
+class Trace:
+    """A request's trace id, spans and sampling decision."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str | None = None,
+        parent_span_id: str | None = None,
+        sampled: bool | None = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.sampled = random.random() < SAMPLE_RATE if sampled is None else sampled
+        self.start = time.perf_counter()
+        self.spans: list[dict[str, object]] = []
+        self.attrs: dict[str, object] = {}
+
+    def traceparent(self, span_id: str | None = None) -> str:
+        flags = "01" if self.sampled else "00"
+        return f"00-{self.trace_id}-{span_id or self.span_id}-{flags}"
+
+    def record(self, name: str, started: float, ended: float | None = None, **attrs: object):
+        """Add a span from perf_counter timestamps."""
+        ended = time.perf_counter() if ended is None else ended
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self.start) * 1000, 2),
+            "duration_ms": round((ended - started) * 1000, 2),
+            **attrs,
+        })
+
+    @contextmanager
+    def span(self, name: str, **attrs: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, **attrs)
+
+    def add_remote(self, timings: list[dict[str, object]] | None, sent_at: float, prefix: str = "sandbox."):
+        """Merge stage timings reported by a remote hop, relative to when we sent the request."""
+        offset = (sent_at - self.start) * 1000
+        for timing in timings or []:
+            span = dict(timing)
+            span["name"] = prefix + str(span.get("name"))
+            span["start_ms"] = round(offset + float(span.get("start_ms", 0)), 2)
+            self.spans.append(span)
+
+    def event(self, name: str, **fields: object):
+        """Print a structured event if this trace is sampled."""
+        if self.sampled:
+            print(json.dumps({"event": name, "trace_id": self.trace_id, **fields}, default=str))
+
+    def finish(self, **attrs: object):
+        """Print the waterfall if the trace is sampled or slow."""
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        if not (self.sampled or (SLOW_MS and duration_ms >= SLOW_MS)):
+            return
+        print(json.dumps({
+            "event": "trace",
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "duration_ms": round(duration_ms, 2),
+            **self.attrs,
+            **attrs,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }, default=str))
+
+
+def start(name: str, traceparent: str | None = None) -> Trace:
+    """Start a trace for this request, continuing an incoming traceparent if valid."""
+    match = _TRACEPARENT.match(traceparent or "")
+    if match:
+        trace_id, parent_span_id, flags = match.groups()
+        trace = Trace(name, trace_id, parent_span_id, sampled=bool(int(flags, 16) & 1) or None)
+    else:
+        trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+
+def use(trace: Trace):
+    """Make ``trace`` current, e.g. inside a streaming response generator."""
+    _current.set(trace)
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attrs: object) -> Iterator[None]:
+    """Record a span on the current trace, if there is one."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **attrs):
+        yield
+
+
+def event(name: str, **fields: object):
+    """Print a structured event on the current trace, if it is sampled."""
+    trace = _current.get()
+    if trace is not None:
+        trace.event(name, **fields)
@@ -0,0 +1,132 @@
+"""Per-user ordering of chat turns with bounded queue depth.
+
+A user's Claude client (local or in their sandbox) can only run one turn at
+a time. Every user gets a lane: turns run one after another in arrival order,
+at most MAX_DEPTH turns may be running or waiting, and with COALESCE enabled
+messages that pile up behind a running turn are merged into the next turn.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+MAX_DEPTH = int(os.environ.get("TURN_QUEUE_DEPTH", "4"))
+COALESCE = os.environ.get("TURN_COALESCE", "0") == "1"
+COALESCE_SEPARATOR = "\n\n"
+
+
+class QueueFullError(Exception):
+    """Raised when a user already has MAX_DEPTH turns running or queued."""
+
+
+@dataclass
+class _Lane:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    depth: int = 0
+    # Messages waiting to be coalesced into the next turn: (message, future)
+    pending: list[tuple[str, asyncio.Future]] = field(default_factory=list)
+
+
+_lanes: dict[str, _Lane] = {}
+
+
+@dataclass
+class Reservation:
+    """A place in a user's lane, taken before the turn that uses it starts."""
+    user_id: str
+    lane: _Lane
+    released: bool = False
+
+    def release(self):
+        """Give the place back; safe to call more than once."""
+        if not self.released:
+            self.released = True
+            _leave(self.user_id, self.lane)
+
+
+def reserve(user_id: str) -> Reservation:
+    """Take a place in the user's lane, or raise QueueFullError if it has no room.
+
+    Checking and taking the place is one step, so concurrent requests can't
+    all pass the check and overfill the lane.
+    """
+    lane = _lanes.get(user_id)
+    if lane is not None and lane.depth >= MAX_DEPTH:
+        raise QueueFullError(f"Too many messages in flight for this user (max {MAX_DEPTH})")
+    lane = _lanes.setdefault(user_id, _Lane())
+    lane.depth += 1
+    return Reservation(user_id, lane)
+
+
+def _leave(user_id: str, lane: _Lane):
+    lane.depth -= 1
+    if lane.depth == 0 and _lanes.get(user_id) is lane:
+        del _lanes[user_id]
+
+
+@asynccontextmanager
+async def turn(user_id: str, reservation: Reservation | None = None) -> AsyncIterator[None]:
+    """Hold the user's lane for one turn, waiting behind earlier turns.
+
+    Uses ``reservation`` if the place was taken in advance with reserve().
+    """
+    if reservation is None:
+        reservation = reserve(user_id)
+    try:
+        async with reservation.lane.lock:
+            yield
+    finally:
+        reservation.release()
+
+
+async def run(user_id: str, message: str, fn: Callable[[str], Awaitable[T]]) -> T:
+    """Run ``fn(message)`` as the user's next turn and return its result.
+
+    With COALESCE on, messages that arrived while an earlier turn ran are
+    joined into one turn and every caller receives the same result.
+    """
+    if not COALESCE:
+        async with turn(user_id):
+            return await fn(message)
+
+    reservation = reserve(user_id)
+    lane = reservation.lane
+    entry = (message, asyncio.get_running_loop().create_future())
+    lane.pending.append(entry)
+    try:
+        async with lane.lock:
+            if entry[1].done():
+                # An earlier turn already answered this message
+                return entry[1].result()
+            batch, lane.pending = lane.pending, []
+            try:
+                result = await fn(COALESCE_SEPARATOR.join(m for m, _ in batch))
+            except Exception as e:
+                for _, fut in batch:
+                    if fut is not entry[1] and not fut.done():
+                        fut.set_exception(e)
+                raise
+            except BaseException:
+                # Cancelled: hand the other messages back to the next turn
+                lane.pending[:0] = [b for b in batch if b is not entry]
+                raise
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(result)
+            return result
+    finally:
+        if entry in lane.pending:
+            lane.pending.remove(entry)
+        reservation.release()
+
+
+def stats() -> dict[str, int]:
+    """Number of users with turns in flight and total turns running or queued."""
+    return {
+        "active_users": len(_lanes),
+        "queued_turns": sum(lane.depth for lane in _lanes.values()),
+    }